@@ -0,0 +1,177 @@
+"""
+Crystal Heikin Ashi - Historique du compte
+Snapshots bruts (append-only), agrégats minute/heure maintenus à l'écriture, courbe d'equity sous-échantillonnée
+"""
+
+import math
+import os
+import threading
+import time
+
+# Durée de conservation par niveau (jours, 0 = illimitée)
+ACCOUNT_RAW_DAYS = int(os.environ.get('ACCOUNT_RAW_DAYS', 7))
+ACCOUNT_MINUTE_DAYS = int(os.environ.get('ACCOUNT_MINUTE_DAYS', 90))
+PRUNE_INTERVAL = 3600
+
+# Points maximum d'une courbe
+MAX_POINTS = 1000
+
+# Niveaux: (nom, taille de bucket en secondes, conservation en jours)
+RESOLUTIONS = (('M1', 60, ACCOUNT_MINUTE_DAYS), ('H1', 3600, 0))
+
+# Ajout seul: deux snapshots de la même milliseconde sont conservés, comme dans les agrégats
+INSERT_SNAPSHOT_SQL = '''
+    INSERT INTO account_snapshots (ts, balance, equity, margin, free_margin)
+    VALUES (?, ?, ?, ?, ?)
+'''
+# Buckets de `width` ms agrégés par SQLite (au plus `points` lignes): premier/dernier snapshot par (ts, id)
+RAW_CURVE_SQL = '''
+    WITH buckets AS (
+        SELECT ts / :width AS bucket, min(equity) AS equity_min, max(equity) AS equity_max,
+               max(margin) AS margin_max, count(*) AS samples, min(ts) AS first_ts, max(ts) AS last_ts
+        FROM account_snapshots WHERE ts >= :start AND ts < :end GROUP BY bucket
+    )
+    SELECT b.bucket * :width / 1000.0, last.balance, first.equity, b.equity_min, b.equity_max, last.equity,
+           b.margin_max, last.free_margin, b.samples
+    FROM buckets b
+    JOIN account_snapshots first
+        ON first.id = (SELECT id FROM account_snapshots WHERE ts = b.first_ts ORDER BY id LIMIT 1)
+    JOIN account_snapshots last
+        ON last.id = (SELECT id FROM account_snapshots WHERE ts = b.last_ts ORDER BY id DESC LIMIT 1)
+    ORDER BY b.bucket
+'''
+# Idem sur les agrégats d'un niveau (bucket en secondes, `width` multiple de la résolution): clé primaire directe
+ROLLUP_CURVE_SQL = '''
+    WITH buckets AS (
+        SELECT bucket / :width AS bucket, min(equity_min) AS equity_min, max(equity_max) AS equity_max,
+               max(margin_max) AS margin_max, sum(samples) AS samples, min(bucket) AS first_bucket,
+               max(bucket) AS last_bucket
+        FROM account_rollups WHERE resolution = :resolution AND bucket >= :start AND bucket < :end GROUP BY 1
+    )
+    SELECT b.bucket * :width, last.balance, first.equity_open, b.equity_min, b.equity_max, last.equity_last,
+           b.margin_max, last.free_margin, b.samples
+    FROM buckets b
+    JOIN account_rollups first ON first.resolution = :resolution AND first.bucket = b.first_bucket
+    JOIN account_rollups last ON last.resolution = :resolution AND last.bucket = b.last_bucket
+    ORDER BY b.bucket
+'''
+# Bucket existant: min/max étendus, dernières valeurs remplacées (snapshots reçus dans l'ordre)
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO account_rollups
+    (resolution, bucket, balance, equity_open, equity_min, equity_max, equity_last, margin_max, free_margin, samples)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+    ON CONFLICT (resolution, bucket) DO UPDATE SET
+        balance = excluded.balance,
+        equity_min = min(equity_min, excluded.equity_min),
+        equity_max = max(equity_max, excluded.equity_max),
+        equity_last = excluded.equity_last,
+        margin_max = max(margin_max, excluded.margin_max),
+        free_margin = excluded.free_margin,
+        samples = samples + 1
+'''
+
+
+class AccountHistory:
+    """Série temporelle du compte: écriture des snapshots et lecture de la courbe d'equity"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self.latest = None      # dernier snapshot enregistré (dict, ts en secondes)
+
+    def record(self, account, now=None):
+        """
+        Fonction d'écriture (pour db_write) d'un snapshot ACCOUNT_SCHEMA: brut + agrégats + purge périodique.
+        Retourne le snapshot, à passer à stored() une fois l'écriture validée
+        """
+        now = time.time() if now is None else now
+        snapshot = dict(account, ts=now)
+        with self._lock:
+            prune = now - self._last_prune >= PRUNE_INTERVAL
+            if prune:
+                self._last_prune = now
+
+        values = (account['balance'], account['equity'], account['margin'], account['free_margin'])
+        balance, equity, margin, free_margin = values
+
+        def write(c):
+            c.execute(INSERT_SNAPSHOT_SQL, (int(now * 1000), *values))
+            c.executemany(UPSERT_ROLLUP_SQL, [
+                (seconds, int(now) // seconds * seconds, balance, equity, equity, equity, equity, margin, free_margin)
+                for _, seconds, _ in RESOLUTIONS])
+            if prune:
+                self._prune(c, now)
+            return snapshot
+        return write
+
+    def stored(self, snapshot):
+        """Dernier snapshot servi par /api/account/history et le bootstrap, après commit de son écriture"""
+        with self._lock:
+            if self.latest is None or snapshot['ts'] >= self.latest['ts']:
+                self.latest = snapshot
+
+    @staticmethod
+    def _prune(c, now):
+        """Supprime les niveaux au-delà de leur durée de conservation"""
+        if ACCOUNT_RAW_DAYS:
+            c.execute('DELETE FROM account_snapshots WHERE ts < ?', (int((now - ACCOUNT_RAW_DAYS * 86400) * 1000),))
+        for _, seconds, days in RESOLUTIONS:
+            if days:
+                c.execute('DELETE FROM account_rollups WHERE resolution = ? AND bucket < ?',
+                          (seconds, now - days * 86400))
+
+    def load(self, conn):
+        """Dernier snapshot depuis la base (au démarrage)"""
+        row = conn.execute('SELECT * FROM account_snapshots ORDER BY ts DESC, id DESC LIMIT 1').fetchone()
+        if row is not None:
+            with self._lock:
+                self.latest = {'ts': row['ts'] / 1000, 'balance': row['balance'], 'equity': row['equity'],
+                               'margin': row['margin'], 'free_margin': row['free_margin']}
+        return self.latest
+
+    def curve(self, conn, start, end, points, now=None):
+        """
+        Courbe d'equity sur [start, end[ en `points` buckets au plus (min/max/dernier préservés).
+        Le niveau lu est le plus fin qui reste borné: brut si bucket < 1 min, minute si < 1 h, sinon heure.
+        Chaque niveau est agrégé par bucket dans SQLite: au plus `points` lignes lues, quel que soit le débit
+        """
+        now = time.time() if now is None else now
+        points = max(1, min(points, MAX_POINTS))
+        width = max(1, math.ceil((end - start) / points))
+
+        source, seconds = 'raw', 0
+        if width >= 60 or (ACCOUNT_RAW_DAYS and start < now - ACCOUNT_RAW_DAYS * 86400):
+            for name, resolution, days in RESOLUTIONS:
+                source, seconds = name, resolution
+                if width < resolution * 60 and not (days and start < now - days * 86400):
+                    break
+            width = math.ceil(width / seconds) * seconds    # buckets alignés sur ceux du niveau lu
+
+        if source == 'raw':
+            rows = conn.execute(RAW_CURVE_SQL, {'width': width * 1000, 'start': int(start * 1000),
+                                                'end': int(end * 1000)}).fetchall()
+        else:
+            rows = conn.execute(ROLLUP_CURVE_SQL, {'width': width, 'resolution': seconds,
+                                                   'start': int(start // seconds * seconds), 'end': end}).fetchall()
+
+        curve = []
+        current = None
+        for t, balance, equity_open, equity_min, equity_max, equity_last, margin, free_margin, samples in rows:
+            bucket = int(t) // width * width
+            if current is None or current['t'] != bucket:
+                current = {'t': bucket, 'equity_open': equity_open, 'equity_min': equity_min,
+                           'equity_max': equity_max, 'margin': margin, 'samples': 0}
+                curve.append(current)
+            else:
+                current['equity_min'] = min(current['equity_min'], equity_min)
+                current['equity_max'] = max(current['equity_max'], equity_max)
+                current['margin'] = max(current['margin'], margin)
+            current['balance'] = balance
+            current['equity'] = equity_last
+            current['free_margin'] = free_margin
+            current['samples'] += samples
+        return {'source': source, 'resolution': width, 'start': start, 'end': end, 'points': curve}
+
+
+# Historique unique du processus
+account_history = AccountHistory()
@@ -3,82 +3,229 @@ Crystal Heikin Ashi - Flask Bridge Application
 Reçoit les signaux de l'indicateur MT5 et affiche un dashboard en temps réel
 """
 
-from flask import Flask, render_template, jsonify, request
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, render_template, jsonify, request, g, stream_with_context
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from datetime import datetime
-import json
-import sqlite3
+import logging
 import os
+import threading
+import time
+
+from confluence import compute_confluence, FINAL_SIGNALS
+from database import init_db, get_db, db_write, writer_stats, stop_writer, WriterOverloaded
+from signal_store import save_signals, decode_row
+from state_cache import state_cache
+from retention import start_retention_thread
+from history import HistoryQuery, page, iter_signals, to_ndjson, to_csv, parse_time
+from trade_queue import trade_notifier, has_claimable, claim, enqueue, complete, cancel, DEFAULT_CONSUMER
+from logs import get_logger, RATE_LIMITED
+import metrics
+from rooms import (ALL, ALL_ROOMS, PROTOCOLS, PROTOCOL_FULL, PROTOCOL_BINARY, room_for, rooms_for,
+                   parse_protocol, parse_subscription, symbol_rooms, open_rooms, rooms_lock)
+from signal_stream import signal_streams, snapshot_message, delta_message
+from coalescer import Coalescer
+from idempotency import signal_responses, RequestInFlight
+from position_sync import position_book
+from account_history import account_history
+from indicators import indicator_engine
+from mtf import multi_timeframe
+from bootstrap import (SnapshotCache, DashboardPusher, PushSource, BOOTSTRAP_HISTORY, STATS_PUSH_INTERVAL)
+from schema import (read_payload, validate, validate_list, PayloadError, ValidationError,
+                    SIGNAL_SCHEMA, TRADE_CONFIRM_SCHEMA, POSITION_SCHEMA, ACCOUNT_SCHEMA,
+                    TRADE_SCHEMA, TICKET_COMMAND_SCHEMA, CLOSE_ALL_SCHEMA)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'crystal_heikin_secret_2025'
-socketio = SocketIO(app, cors_allowed_origins="*")
+# threading (python app.py, développement) ou eventlet/gevent (python server.py, production)
+ASYNC_MODE = os.environ.get('ASYNC_MODE', 'threading')
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=ASYNC_MODE)
 
-# Base de données pour stocker l'historique des signaux
-DB_PATH = 'signals.db'
+log_signal = get_logger('SIGNAL')
+log_trade = get_logger('TRADE')
+log_pending = get_logger('PENDING')
+log_ws = get_logger('WS')
+log_app = get_logger('APP')
 
-def init_db():
-    """Initialise la base de données SQLite"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS signals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            symbol TEXT NOT NULL,
-            timeframe TEXT NOT NULL,
-            signal_type TEXT NOT NULL,
-            ha_open REAL,
-            ha_high REAL,
-            ha_low REAL,
-            ha_close REAL,
-            trend TEXT,
-            momentum_shift INTEGER DEFAULT 0,
-            bid REAL,
-            ask REAL,
-            spread REAL,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS trades (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            symbol TEXT NOT NULL,
-            action TEXT NOT NULL,
-            volume REAL,
-            price REAL,
-            sl REAL,
-            tp REAL,
-            status TEXT DEFAULT 'pending',
-            ticket INTEGER,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS positions (
-            ticket INTEGER PRIMARY KEY,
-            symbol TEXT NOT NULL,
-            type TEXT NOT NULL,
-            volume REAL,
-            open_price REAL,
-            current_price REAL,
-            sl REAL DEFAULT 0,
-            tp REAL DEFAULT 0,
-            profit REAL DEFAULT 0,
-            open_time TEXT,
-            status TEXT DEFAULT 'open',
-            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
+# ============================================
+# PARSING & STOCKAGE DES SIGNAUX
+# ============================================
+
+def parse_signal(data):
+    """Construit le dict signal à partir des données brutes de l'EA (schéma SIGNAL_SCHEMA, ValidationError si invalide)"""
+    return validate(data, SIGNAL_SCHEMA)
+
+def invalid_payload(e, logger):
+    """Réponse 400 détaillée: JSON illisible ou erreurs champ par champ"""
+    logger.warning('Payload rejeté: %s', e, extra=RATE_LIMITED)
+    return jsonify({'status': 'error', 'message': str(e), 'errors': getattr(e, 'errors', [])}), 400
+
+def replayed(payload, status):
+    """Réponse mémorisée d'une requête rejouée avec la même clé d'idempotence (aucun retraitement)"""
+    return jsonify(payload), status, {'Idempotent-Replayed': 'true'}
+
+def begin_idempotent(key):
+    """Réserve la clé d'idempotence: (réponse mémorisée, None) ou (None, réponse 409 si l'original est en cours)"""
+    try:
+        return signal_responses.begin(key), None
+    except RequestInFlight as e:
+        log_signal.warning('%s', e, extra=RATE_LIMITED)
+        return None, (jsonify({'status': 'error', 'message': str(e)}), 409)
+
+def broadcast(event, data, **kwargs):
+    """socketio.emit chronométré (sérialisation + fan-out vers les clients)"""
+    start = time.perf_counter()
+    socketio.emit(event, data, **kwargs)
+    if metrics.METRICS_ENABLED:
+        metrics.EMIT_LATENCY.labels(event).observe(time.perf_counter() - start)
+
+def room_members(rooms):
+    """Sessions présentes dans des rooms (exclues des envois par symbole pour éviter les doublons)"""
+    with rooms_lock:
+        sids = {sid for room in rooms for sid, _ in socketio.server.manager.get_participants('/', room)}
+    return list(sids) or None
+
+def has_subscribers(rooms):
+    """Au moins une room ouverte (les rooms vides sont supprimées par Socket.IO)"""
+    opened = set(open_rooms(socketio.server.manager))
+    return any(room in opened for room in rooms)
+
+def symbol_targets(symbol):
+    """Rooms ALL + toutes les rooms ouvertes d'un symbole (symbole ou symbole+timeframe, tous protocoles)"""
+    return ALL_ROOMS + symbol_rooms(socketio.server.manager).get(symbol, [])
+
+def signal_payload(protocol, signals, deltas):
+    """(événement, données) d'un groupe de signaux pour un protocole"""
+    if protocol == PROTOCOL_FULL:
+        if len(signals) == 1:
+            return 'new_signal', signals[0]
+        return 'new_signals', {'signals': signals}
+    return 'signal_delta', delta_message(deltas, binary=(protocol == PROTOCOL_BINARY))
+
+def broadcast_signals(signals):
+    """
+    Diffuse des signaux aux rooms intéressées, pour chaque protocole:
+    ALL reçoit tout, chaque symbole/timeframe sa part (séquences des deltas dans l'ordre d'émission)
+    """
+    with signal_streams.lock:
+        deltas = [signal_streams.update(signal) for signal in signals]
+        for protocol in PROTOCOLS:
+            all_room = room_for(ALL, protocol=protocol)
+            if len(signals) == 1:
+                rooms = [all_room] + rooms_for(signals[0]['symbol'], signals[0]['timeframe'], protocol)
+                if has_subscribers(rooms):
+                    event, data = signal_payload(protocol, signals, deltas)
+                    broadcast(event, data, to=rooms)
+                continue
+
+            if has_subscribers([all_room]):
+                event, data = signal_payload(protocol, signals, deltas)
+                broadcast(event, data, to=all_room)
+            groups = {}
+            for signal, delta in zip(signals, deltas):
+                group = groups.setdefault((signal['symbol'], signal['timeframe']), ([], []))
+                group[0].append(signal)
+                group[1].append(delta)
+            skip = None
+            for (symbol, timeframe), (group_signals, group_deltas) in groups.items():
+                rooms = rooms_for(symbol, timeframe, protocol)
+                if not has_subscribers(rooms):
+                    continue
+                if skip is None:
+                    skip = room_members([all_room]) or []
+                event, data = signal_payload(protocol, group_signals, group_deltas)
+                broadcast(event, data, to=rooms, skip_sid=skip or None)
+
+# Diffusion limitée par symbole (BROADCAST_MAX_HZ); chaque signal reste sauvegardé
+signal_coalescer = Coalescer(broadcast_signals)
+
+def send_snapshot(subscriptions, binary):
+    """Envoie au client l'état complet des flux demandés (à appeler sous signal_streams.lock)"""
+    streams = []
+    for symbol, timeframe in subscriptions:
+        if symbol == ALL:
+            streams = signal_streams.snapshot()
+            break
+        streams += signal_streams.snapshot(symbol, timeframe)
+    emit('signal_snapshot', snapshot_message(streams, binary))
+
+def load_state_cache():
+    """Reconstruit les caches depuis la base: derniers signaux, compteurs 24h, flux delta, positions, compte"""
+    conn = get_db()
+    count = state_cache.rebuild(conn)
+    rows = conn.execute('''
+        SELECT s.* FROM signals s
+        JOIN (SELECT MAX(id) AS id FROM signals GROUP BY symbol, timeframe) last ON last.id = s.id
+    ''').fetchall()
+    open_positions = position_book.load(conn)
+    # Baux en cours: leur expiration doit invalider les ETag et réveiller les long-polls
+    for row in conn.execute("SELECT DISTINCT lease_expires FROM trades WHERE status IN ('pending', 'leased') AND lease_expires > 0"):
+        trade_notifier.lease(row[0])
+    account_history.load(conn)
+    indicator_engine.warm_up(conn)
+    multi_timeframe.warm_up(conn)
     conn.close()
+    signal_streams.seed([decode_row(row) for row in rows])
+    log_app.info('%d symboles/timeframes chargés dans le cache, %d positions ouvertes', count, open_positions)
+
+# ============================================
+# INSTRUMENTATION
+# ============================================
 
-def get_db():
-    """Connexion à la base de données"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.pop('request_start', None)
+    if start is not None and metrics.METRICS_ENABLED:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - start)
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Métriques au format texte Prometheus"""
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+# ============================================
+# ARRÊT PROPRE
+# ============================================
+
+# Écritures (POST) en cours; pendant l'arrêt les nouvelles sont refusées en 503
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+draining = False
+
+@app.before_request
+def track_in_flight():
+    global _in_flight
+    if request.method != 'POST':
+        return None
+    if draining:
+        return jsonify({'status': 'error', 'message': "Serveur en cours d'arrêt"}), 503
+    with _in_flight_lock:
+        _in_flight += 1
+    g.in_flight = True
+    return None
+
+@app.teardown_request
+def release_in_flight(exc):
+    global _in_flight
+    if g.pop('in_flight', False):
+        with _in_flight_lock:
+            _in_flight -= 1
+
+def drain(timeout):
+    """Arrêt propre: attend les écritures en cours, diffuse et sauvegarde le reste (retourne les abandonnées)"""
+    global draining
+    draining = True
+    deadline = time.monotonic() + timeout
+    while _in_flight and time.monotonic() < deadline:
+        socketio.sleep(0.05)
+    signal_coalescer.flush()
+    stop_writer(max(deadline - time.monotonic(), 1))
+    return _in_flight
 
 # ============================================
 # ROUTES API - Réception des signaux MT5
@@ -92,404 +239,298 @@ def test_connection():
 @app.route('/api/signal', methods=['POST'])
 def receive_signal():
     """Reçoit un signal de l'EA MT5"""
+    stages = metrics.StageTimer(metrics.SIGNAL_STAGES)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    replay, in_flight = begin_idempotent(idempotency_key)
+    if in_flight is not None:
+        return in_flight
+    if replay is not None:
+        return replayed(*replay)
     try:
-        # Essayer différents formats de données
-        data = None
-        
-        # JSON
-        if request.is_json:
-            data = request.get_json(silent=True)
-        
-        # Form data
-        if data is None:
-            data = request.form.to_dict()
-        
-        # Raw data (pour MT5 WebRequest)
-        if not data or len(data) == 0:
-            raw = request.get_data(as_text=True)
-            print(f"[DEBUG] Raw data reçu: {raw[:500]}")
-            
-            # Parser le JSON manuellement
-            import json
-            try:
-                # Nettoyer les caractères problématiques
-                raw = raw.strip()
-                if raw.startswith('{'):
-                    data = json.loads(raw)
-            except json.JSONDecodeError as e:
-                print(f"[DEBUG] Erreur JSON: {e}")
-                # Créer un signal minimal
-                data = {'symbol': 'UNKNOWN', 'trend': 'NEUTRAL'}
-        
-        if not data:
-            data = {}
-        
-        # Extraire les données avec valeurs par défaut
-        signal = {
-            'timestamp': data.get('timestamp', datetime.now().isoformat()),
-            'symbol': data.get('symbol', 'UNKNOWN'),
-            'timeframe': data.get('timeframe', 'M15'),
-            'signal_type': data.get('signal_type', 'UPDATE'),
-            'ha_open': float(data.get('ha_open', 0) or 0),
-            'ha_high': float(data.get('ha_high', 0) or 0),
-            'ha_low': float(data.get('ha_low', 0) or 0),
-            'ha_close': float(data.get('ha_close', 0) or 0),
-            'trend': data.get('trend', 'NEUTRAL'),
-            'momentum_shift': int(data.get('momentum_shift', 0) or 0),
-            'bid': float(data.get('bid', 0) or 0),
-            'ask': float(data.get('ask', 0) or 0),
-            'spread': float(data.get('spread', 0) or 0),
-            # Indicateurs
-            'resistance': float(data.get('resistance', 0) or 0),
-            'support': float(data.get('support', 0) or 0),
-            'supply_zone': float(data.get('supply_zone', 0) or 0),
-            'demand_zone': float(data.get('demand_zone', 0) or 0),
-            'vwap': float(data.get('vwap', 0) or 0),
-            'vwap_upper': float(data.get('vwap_upper', 0) or 0),
-            'vwap_lower': float(data.get('vwap_lower', 0) or 0),
-            'poc': float(data.get('poc', 0) or 0),
-            'harmonic_pattern': data.get('harmonic_pattern', 'NONE'),
-            'price_position': data.get('price_position', 'NEUTRAL'),
-            # Super Trend
-            'supertrend_up': float(data.get('supertrend_up', 0) or 0),
-            'supertrend_down': float(data.get('supertrend_down', 0) or 0),
-            'supertrend_direction': data.get('supertrend_direction', 'NEUTRAL'),
-            # Fibo Expansion
-            'fibo_level1': float(data.get('fibo_level1', 0) or 0),
-            'fibo_level2': float(data.get('fibo_level2', 0) or 0),
-            'fibo_level3': float(data.get('fibo_level3', 0) or 0),
-            # Nouveaux indicateurs
-            'anchored_vwap': float(data.get('anchored_vwap', 0) or 0),
-            'drawfib_level1': float(data.get('drawfib_level1', 0) or 0),
-            'drawfib_level2': float(data.get('drawfib_level2', 0) or 0),
-            'drawfib_level3': float(data.get('drawfib_level3', 0) or 0),
-            'candle_pattern': data.get('candle_pattern', 'NONE'),
-            'bollinger_signal': float(data.get('bollinger_signal', 0) or 0),
-            'bollinger_direction': data.get('bollinger_direction', 'NEUTRAL'),
-            'fvg_high': float(data.get('fvg_high', 0) or 0),
-            'fvg_low': float(data.get('fvg_low', 0) or 0),
-            'fvg_type': data.get('fvg_type', 'NONE'),
-            'macd_main': float(data.get('macd_main', 0) or 0),
-            'macd_signal': float(data.get('macd_signal', 0) or 0),
-            'macd_trend': data.get('macd_trend', 'NEUTRAL'),
-            'pro_resistance': float(data.get('pro_resistance', 0) or 0),
-            'pro_support': float(data.get('pro_support', 0) or 0)
-        }
-        
-        # =============================================
-        # CALCUL DE CONFLUENCE
-        # =============================================
-        bullish_count = 0
-        bearish_count = 0
-        total_indicators = 0
-        indicator_details = []
-        
-        # 1. Heikin Ashi Trend
-        ha_trend = signal['trend']
-        if ha_trend == 'BULLISH':
-            bullish_count += 1
-            indicator_details.append({'name': 'Heikin Ashi', 'signal': 'BULLISH', 'weight': 1})
-        elif ha_trend == 'BEARISH':
-            bearish_count += 1
-            indicator_details.append({'name': 'Heikin Ashi', 'signal': 'BEARISH', 'weight': 1})
-        else:
-            indicator_details.append({'name': 'Heikin Ashi', 'signal': 'NEUTRAL', 'weight': 1})
-        total_indicators += 1
-        
-        # 2. Super Trend
-        st_dir = signal['supertrend_direction']
-        if st_dir == 'BULLISH':
-            bullish_count += 1
-            indicator_details.append({'name': 'Super Trend', 'signal': 'BULLISH', 'weight': 1})
-        elif st_dir == 'BEARISH':
-            bearish_count += 1
-            indicator_details.append({'name': 'Super Trend', 'signal': 'BEARISH', 'weight': 1})
-        else:
-            indicator_details.append({'name': 'Super Trend', 'signal': 'NEUTRAL', 'weight': 1})
-        total_indicators += 1
-        
-        # 3. Harmonic Pattern
-        harmonic = signal['harmonic_pattern']
-        if harmonic == 'BULLISH':
-            bullish_count += 1
-            indicator_details.append({'name': 'Harmonic', 'signal': 'BULLISH', 'weight': 1})
-        elif harmonic == 'BEARISH':
-            bearish_count += 1
-            indicator_details.append({'name': 'Harmonic', 'signal': 'BEARISH', 'weight': 1})
-        elif harmonic not in ['NONE', '']:
-            indicator_details.append({'name': 'Harmonic', 'signal': 'DETECTED', 'weight': 1})
-        total_indicators += 1
-        
-        # 4. Prix vs Support/Resistance
-        bid = signal['bid']
-        support = signal['support']
-        resistance = signal['resistance']
-        if support > 0 and resistance > 0 and bid > 0:
-            mid_point = (support + resistance) / 2
-            if bid > mid_point:
-                bullish_count += 1
-                indicator_details.append({'name': 'Zone Position', 'signal': 'BULLISH', 'weight': 1})
-            else:
-                bearish_count += 1
-                indicator_details.append({'name': 'Zone Position', 'signal': 'BEARISH', 'weight': 1})
-            total_indicators += 1
-        
-        # 5. VWAP Position
-        vwap = signal['vwap']
-        if vwap > 0 and bid > 0:
-            if bid > vwap:
-                bullish_count += 1
-                indicator_details.append({'name': 'VWAP', 'signal': 'BULLISH', 'weight': 1})
-            else:
-                bearish_count += 1
-                indicator_details.append({'name': 'VWAP', 'signal': 'BEARISH', 'weight': 1})
-            total_indicators += 1
-        
-        # 6. Momentum Shift (bonus)
-        if signal['momentum_shift']:
-            if ha_trend == 'BULLISH':
-                bullish_count += 0.5
-            elif ha_trend == 'BEARISH':
-                bearish_count += 0.5
-            indicator_details.append({'name': 'Momentum Shift', 'signal': ha_trend, 'weight': 0.5})
-        
-        # 7. Candlestick Patterns
-        candle = signal['candle_pattern']
-        if candle == 'BULLISH':
-            bullish_count += 1
-            indicator_details.append({'name': 'Candle Pattern', 'signal': 'BULLISH', 'weight': 1})
-            total_indicators += 1
-        elif candle == 'BEARISH':
-            bearish_count += 1
-            indicator_details.append({'name': 'Candle Pattern', 'signal': 'BEARISH', 'weight': 1})
-            total_indicators += 1
-        
-        # 8. Bollinger RSI
-        bollinger = signal['bollinger_direction']
-        if bollinger == 'BULLISH':
-            bullish_count += 1
-            indicator_details.append({'name': 'Bollinger RSI', 'signal': 'BULLISH', 'weight': 1})
-            total_indicators += 1
-        elif bollinger == 'BEARISH':
-            bearish_count += 1
-            indicator_details.append({'name': 'Bollinger RSI', 'signal': 'BEARISH', 'weight': 1})
-            total_indicators += 1
-        
-        # 9. FVG (Fair Value Gap)
-        fvg = signal['fvg_type']
-        if fvg == 'BULLISH':
-            bullish_count += 1
-            indicator_details.append({'name': 'FVG', 'signal': 'BULLISH', 'weight': 1})
-            total_indicators += 1
-        elif fvg == 'BEARISH':
-            bearish_count += 1
-            indicator_details.append({'name': 'FVG', 'signal': 'BEARISH', 'weight': 1})
-            total_indicators += 1
-        
-        # 10. MACD Intraday
-        macd = signal['macd_trend']
-        if macd == 'BULLISH':
-            bullish_count += 1
-            indicator_details.append({'name': 'MACD', 'signal': 'BULLISH', 'weight': 1})
-            total_indicators += 1
-        elif macd == 'BEARISH':
-            bearish_count += 1
-            indicator_details.append({'name': 'MACD', 'signal': 'BEARISH', 'weight': 1})
-            total_indicators += 1
-        
-        # 11. Pro Support Resistance Position
-        pro_sup = signal['pro_support']
-        pro_res = signal['pro_resistance']
-        if pro_sup > 0 and pro_res > 0 and bid > 0:
-            mid = (pro_sup + pro_res) / 2
-            if bid > mid:
-                bullish_count += 1
-                indicator_details.append({'name': 'Pro S/R', 'signal': 'BULLISH', 'weight': 1})
-            else:
-                bearish_count += 1
-                indicator_details.append({'name': 'Pro S/R', 'signal': 'BEARISH', 'weight': 1})
-            total_indicators += 1
-        
-        # Calculer le score
-        if total_indicators > 0:
-            bullish_score = (bullish_count / total_indicators) * 100
-            bearish_score = (bearish_count / total_indicators) * 100
-        else:
-            bullish_score = 0
-            bearish_score = 0
-        
-        # Déterminer le signal final
-        if bullish_score >= 80:
-            final_signal = 'STRONG_BUY'
-        elif bullish_score >= 60:
-            final_signal = 'BUY'
-        elif bearish_score >= 80:
-            final_signal = 'STRONG_SELL'
-        elif bearish_score >= 60:
-            final_signal = 'SELL'
-        else:
-            final_signal = 'NEUTRAL'
-        
-        # Ajouter au signal
-        signal['confluence'] = {
-            'bullish_score': round(bullish_score, 1),
-            'bearish_score': round(bearish_score, 1),
-            'total_indicators': total_indicators,
-            'bullish_count': bullish_count,
-            'bearish_count': bearish_count,
-            'final_signal': final_signal,
-            'indicators': indicator_details
-        }
-        
-        print(f"[CONFLUENCE] {signal['symbol']}: {final_signal} (Bull:{bullish_score:.0f}% Bear:{bearish_score:.0f}%)")
-        
-        # Sauvegarder en base
-        conn = get_db()
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO signals (timestamp, symbol, timeframe, signal_type, 
-                ha_open, ha_high, ha_low, ha_close, trend, momentum_shift, bid, ask, spread)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (signal['timestamp'], signal['symbol'], signal['timeframe'], 
-              signal['signal_type'], signal['ha_open'], signal['ha_high'],
-              signal['ha_low'], signal['ha_close'], signal['trend'],
-              signal['momentum_shift'], signal['bid'], signal['ask'], signal['spread']))
-        conn.commit()
-        conn.close()
-        
-        # Diffuser via WebSocket
-        socketio.emit('new_signal', signal)
+        # JSON (décodeur rapide), formulaire ou texte brut de WebRequest MT5
+        data = read_payload(request)
+        
+        signal = parse_signal(data)
+        stages.mark('parse')
+        # Indicateurs absents (non chargés dans MT5) et tendances des timeframes supérieurs avant le score
+        indicator_engine.update(signal)
+        multi_timeframe.update(signal)
+        signal['confluence'] = compute_confluence(signal)
+        confluence = signal['confluence']
+        stages.mark('score')
+        
+        # Sauvegarder en base (group commit via l'écrivain)
+        db_write(lambda c: save_signals(c, [signal]))
+        state_cache.record(signal)
+        stages.mark('db')
+        
+        # Diffuser via WebSocket (rooms ALL, symbole, symbole+timeframe), coalescé par symbole
+        signal_coalescer.submit([signal])
+        stages.mark('broadcast')
         
         # Log
-        print(f"[SIGNAL] {signal['symbol']} | {signal['trend']} | Momentum Shift: {signal['momentum_shift']}")
+        log_signal.info('%s | %s | Momentum Shift: %s | %s (Bull:%.0f%% Bear:%.0f%%)',
+                        signal['symbol'], signal['trend'], signal['momentum_shift'], confluence['final_signal'],
+                        confluence['bullish_score'], confluence['bearish_score'], extra=RATE_LIMITED)
         
-        return jsonify({'status': 'success', 'signal': signal})
+        response = {'status': 'success', 'signal': signal}
+        signal_responses.put(idempotency_key, response)
+        return jsonify(response)
+    
+    except (PayloadError, ValidationError) as e:
+        return invalid_payload(e, log_signal)
+    
+    except WriterOverloaded as e:
+        log_signal.error('%s', e, extra=RATE_LIMITED)
+        return jsonify({'status': 'error', 'message': str(e)}), 503
     
     except Exception as e:
-        print(f"[ERROR] {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log_signal.exception('receive_signal: %s', e, extra=RATE_LIMITED)
         return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    finally:
+        # Sans réponse mémorisée (échec), un nouvel envoi de la même clé sera traité
+        signal_responses.release(idempotency_key)
+
+@app.route('/api/signals/batch', methods=['POST'])
+def receive_signals_batch():
+    """Reçoit plusieurs signaux de l'EA MT5 en une seule requête (mode multi-symboles)"""
+    stages = metrics.StageTimer(metrics.SIGNAL_STAGES)
+    idempotency_key = request.headers.get('Idempotency-Key')
+    replay, in_flight = begin_idempotent(idempotency_key)
+    if in_flight is not None:
+        return in_flight
+    if replay is not None:
+        return replayed(*replay)
+    try:
+        data = read_payload(request)
+
+        # Accepte une liste brute ou {"signals": [...]}
+        if isinstance(data, dict):
+            data = data.get('signals')
+        if not isinstance(data, list):
+            return jsonify({'status': 'error', 'message': 'Liste de signaux attendue'}), 400
+
+        # Parser puis scorer chaque signal, une erreur n'invalide pas le lot
+        results = []
+        signals = []
+        accepted = []
+        for index, item in enumerate(data):
+            try:
+                signal = parse_signal(item)
+                result = {'index': index, 'symbol': signal['symbol'], 'status': 'success'}
+                signals.append(signal)
+                accepted.append(result)
+                results.append(result)
+            except ValidationError as e:
+                symbol = item.get('symbol') if isinstance(item, dict) else None
+                results.append({'index': index, 'symbol': symbol, 'status': 'error', 'message': str(e),
+                                'errors': e.errors})
+        stages.mark('parse')
+
+        for signal, result in zip(signals, accepted):
+            indicator_engine.update(signal)
+            multi_timeframe.update(signal)
+            signal['confluence'] = compute_confluence(signal)
+            result['final_signal'] = signal['confluence']['final_signal']
+        stages.mark('score')
+
+        # Une seule transaction pour tout le lot
+        if signals:
+            db_write(lambda c: save_signals(c, signals))
+            for signal in signals:
+                state_cache.record(signal)
+            stages.mark('db')
+
+            # Un message groupé pour ALL, un par symbole/timeframe pour les autres rooms (coalescé par symbole)
+            signal_coalescer.submit(signals)
+            stages.mark('broadcast')
+
+        errors = len(data) - len(signals)
+        log_signal.info('Lot: %d signaux reçus, %d erreurs', len(signals), errors, extra=RATE_LIMITED)
+
+        response = {
+            'status': 'success' if signals or not data else 'error',
+            'accepted': len(signals),
+            'rejected': errors,
+            'results': results
+        }
+        signal_responses.put(idempotency_key, response)
+        return jsonify(response)
+
+    except PayloadError as e:
+        return invalid_payload(e, log_signal)
+
+    except WriterOverloaded as e:
+        log_signal.error('signals_batch: %s', e, extra=RATE_LIMITED)
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+
+    except Exception as e:
+        log_signal.exception('signals_batch: %s', e, extra=RATE_LIMITED)
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    finally:
+        signal_responses.release(idempotency_key)
+
+def order_consumer(symbol, data):
+    """
+    EA destinataire d'un ordre BUY/SELL: `consumer` explicite, sinon l'unique EA qui détient des positions sur le
+    symbole, sinon l'unique EA actif. None (ambigu ou aucun EA connu) = n'importe quel EA, le premier qui réserve
+    """
+    if data.get('consumer'):
+        return data['consumer']
+    for candidates in (position_book.symbol_consumers(symbol), trade_notifier.active_consumers()):
+        if len(candidates) == 1:
+            return candidates[0]
+        if candidates:
+            log_trade.warning('Ordre %s sans consumer: plusieurs EA possibles (%s), premier qui réserve',
+                              symbol, ', '.join(candidates))
+            return None
+    return None
 
 @app.route('/api/trade', methods=['POST'])
 def send_trade_command():
     """Envoie une commande de trade à MT5"""
     try:
-        data = request.get_json() or request.form.to_dict()
+        data = validate(read_payload(request), TRADE_SCHEMA)
         
-        symbol = data.get('symbol', '')
-        if not symbol or symbol == 'UNKNOWN' or symbol == '--':
+        symbol = data['symbol']
+        if symbol == 'UNKNOWN' or symbol == '--':
             return jsonify({'status': 'error', 'message': 'Symbole invalide'}), 400
         
         trade = {
             'timestamp': datetime.now().isoformat(),
             'symbol': symbol,
-            'action': data.get('action'),  # BUY, SELL, CLOSE
-            'volume': float(data.get('volume', 0.01) or 0.01),
-            'price': float(data.get('price', 0) or 0),
-            'sl': float(data.get('sl', 0) or 0),
-            'tp': float(data.get('tp', 0) or 0),
-            'status': 'pending'
+            'action': data['action'],
+            'volume': data['volume'] or 0.01,
+            'price': data['price'],
+            'sl': data['sl'],
+            'tp': data['tp'],
+            'status': 'pending',
+            'consumer': order_consumer(symbol, data)
         }
         
-        # Sauvegarder la commande
-        conn = get_db()
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO trades (timestamp, symbol, action, volume, price, sl, tp, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (trade['timestamp'], trade['symbol'], trade['action'], 
-              trade['volume'], trade['price'], trade['sl'], trade['tp'], trade['status']))
-        trade_id = c.lastrowid
-        conn.commit()
-        conn.close()
-        
-        trade['id'] = trade_id
+        # Sauvegarder la commande (une clé d'idempotence déjà vue renvoie la commande existante)
+        idempotency_key = request.headers.get('Idempotency-Key') or data['idempotency_key']
+        trade, duplicate = db_write(enqueue(trade, idempotency_key))
+        trade_id = trade['id']
+        if duplicate:
+            log_trade.info('Commande #%s déjà reçue (clé %s)', trade_id, idempotency_key)
+            return jsonify({'status': 'success', 'trade': trade, 'duplicate': True})
+        trade_notifier.notify()
         
         # Diffuser pour que l'EA récupère
-        socketio.emit('trade_command', trade)
+        broadcast('trade_command', trade, to=symbol_targets(trade['symbol']))
         
-        print(f"[TRADE] Nouvelle commande #{trade_id}: {trade['action']} {trade['symbol']} {trade['volume']} lots")
+        log_trade.info('Nouvelle commande #%s: %s %s %s lots', trade_id, trade['action'], trade['symbol'], trade['volume'])
         
         return jsonify({'status': 'success', 'trade': trade})
     
+    except (PayloadError, ValidationError) as e:
+        return invalid_payload(e, log_trade)
+    
+    except WriterOverloaded as e:
+        log_trade.error('send_trade: %s', e)
+        return jsonify({'status': 'error', 'message': str(e)}), 503
+    
     except Exception as e:
-        print(f"[ERROR] send_trade: {str(e)}")
+        log_trade.error('send_trade: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
 @app.route('/api/pending_trades', methods=['GET'])
 def get_pending_trades():
-    """L'EA récupère les trades en attente"""
+    """
+    L'EA réserve les trades en attente (bail de LEASE_SECONDS, ?consumer= identifie l'EA).
+    ?wait=N : long-poll, bloque jusqu'à N secondes tant que la file est vide ou inchangée.
+    If-None-Match : 304 sans requête SQLite si la file n'a pas changé.
+    """
+    wait = max(0.0, request.args.get('wait', 0, type=float))
+    consumer = request.args.get('consumer') or DEFAULT_CONSUMER
+    trade_notifier.seen(consumer)
+    version = trade_notifier.check_expired()
+    
+    # Fast path: rien n'a changé depuis le dernier poll du client
+    if request.headers.get('If-None-Match') == trade_notifier.etag(version):
+        if wait > 0:
+            version = trade_notifier.wait(version, wait)
+        if request.headers.get('If-None-Match') == trade_notifier.etag(version):
+            return '', 304, {'ETag': trade_notifier.etag(version)}
+    
+    trades = claim_pending_trades(consumer)
+    
+    # Long-poll: attendre qu'une commande soit mise en file (ou qu'un bail expire)
+    if not trades and wait > 0:
+        new_version = trade_notifier.wait(version, wait)
+        if new_version != version:
+            version = new_version
+            trades = claim_pending_trades(consumer)
+    
+    if trades:
+        # Poll de l'EA chaque seconde: résumé limité, détail en DEBUG
+        log_pending.info('%d trades en attente', len(trades), extra=RATE_LIMITED)
+        if log_pending.isEnabledFor(logging.DEBUG):
+            for t in trades:
+                log_pending.debug('ID=%s Action=%s Ticket=%s Symbol=%s', t['id'], t['action'],
+                                  t.get('ticket'), t.get('symbol'), extra=RATE_LIMITED)
+    
+    response = jsonify({'trades': trades})
+    response.headers['ETag'] = trade_notifier.etag(version)
+    return response
+
+def claim_pending_trades(consumer):
+    """Réserve les trades disponibles pour un EA, du plus ancien au plus récent (aucune écriture si file vide)"""
+    now = time.time()
     conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM trades WHERE status = 'pending' ORDER BY created_at ASC")
-    rows = c.fetchall()
-    trades = []
-    for row in rows:
-        trade = dict(row)
-        # S'assurer que le ticket est bien un entier
-        if trade.get('ticket'):
-            trade['ticket'] = int(trade['ticket'])
-        trades.append(trade)
+    available = has_claimable(conn, consumer, now)
     conn.close()
+    if not available:
+        return []
     
+    trades, expired = db_write(claim(consumer, now))
+    if expired:
+        log_trade.warning('Trades expirés sans confirmation: %s', ', '.join(f'#{i}' for i in expired))
+        trade_notifier.notify()
     if trades:
-        print(f"[PENDING] {len(trades)} trades en attente:")
-        for t in trades:
-            print(f"  - ID={t['id']} Action={t['action']} Ticket={t.get('ticket')} Symbol={t.get('symbol')}")
-    
-    return jsonify({'trades': trades})
+        trade_notifier.lease(trades[0]['lease_expires'])
+    for trade in trades:
+        # S'assurer que le ticket est bien un entier
+        if trade.get('ticket'):
+            trade['ticket'] = int(trade['ticket'])
+    return trades
 
 @app.route('/api/confirm_trade/<int:trade_id>', methods=['POST'])
 def confirm_trade(trade_id):
     """L'EA confirme l'exécution d'un trade"""
+    consumer = request.args.get('consumer') or DEFAULT_CONSUMER
     try:
-        # Essayer différents formats
-        data = None
-        if request.is_json:
-            data = request.get_json(silent=True)
-        
-        if data is None:
-            data = request.form.to_dict()
-        
-        if not data or len(data) == 0:
-            raw = request.get_data(as_text=True)
-            if raw:
-                import json
-                try:
-                    data = json.loads(raw)
-                except:
-                    data = {}
+        confirmation = validate(read_payload(request), TRADE_CONFIRM_SCHEMA)
+        status = confirmation['status']
+        ticket = confirmation['ticket']
         
-        if not data:
-            data = {}
-        
-        status = data.get('status', 'executed')
-        ticket = data.get('ticket', 0)
-        
-        conn = get_db()
-        c = conn.cursor()
-        c.execute('''
-            UPDATE trades SET status = ?, ticket = ? WHERE id = ?
-        ''', (status, ticket, trade_id))
-        conn.commit()
-        conn.close()
+        symbol, conflict = db_write(complete(trade_id, consumer, status, ticket, time.time()))
+        if conflict:
+            log_trade.warning('Confirmation #%s refusée (%s): %s', trade_id, consumer, conflict)
+            return jsonify({'status': 'error', 'message': conflict}), 404 if symbol is None else 409
+        trade_notifier.notify()
         
-        socketio.emit('trade_update', {'id': trade_id, 'status': status})
-        print(f"[TRADE] Confirmé #{trade_id} - Status: {status}, Ticket: {ticket}")
+        broadcast('trade_update', {'id': trade_id, 'status': status, 'symbol': symbol},
+                  to=symbol_targets(symbol))
+        log_trade.info('Confirmé #%s - Status: %s, Ticket: %s', trade_id, status, ticket)
         
         return jsonify({'status': 'success'})
     
+    except (PayloadError, ValidationError) as e:
+        # Corps invalide: la commande reste intacte (n'importe quel EA peut envoyer cette requête)
+        return invalid_payload(e, log_trade)
+    
     except Exception as e:
-        print(f"[ERROR] confirm_trade: {str(e)}")
-        # Même en cas d'erreur, marquer comme traité pour éviter la boucle
+        log_trade.error('confirm_trade: %s', e)
+        # Même en cas d'erreur, marquer comme traité pour éviter la boucle, si ce consommateur détient le bail
         try:
-            conn = get_db()
-            c = conn.cursor()
-            c.execute("UPDATE trades SET status = 'error' WHERE id = ?", (trade_id,))
-            conn.commit()
-            conn.close()
-        except:
+            _, conflict = db_write(complete(trade_id, consumer, 'error', 0, time.time()))
+            if not conflict:
+                trade_notifier.notify()
+        except Exception:
             pass
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
@@ -502,65 +543,168 @@ def dashboard():
     """Page principale du dashboard"""
     return render_template('dashboard.html')
 
+def load_pending_trades(conn):
+    """Trades en attente ou réservés, du plus récent au plus ancien"""
+    rows = conn.execute("SELECT * FROM trades WHERE status IN ('pending', 'leased') ORDER BY created_at DESC")
+    return [dict(row) for row in rows.fetchall()]
+
+def build_bootstrap():
+    """État complet du dashboard: stats, derniers signaux, positions, trades en attente, compte"""
+    conn = get_db()
+    signals, cursor = page(conn, HistoryQuery(), limit=BOOTSTRAP_HISTORY)
+    trades = load_pending_trades(conn)
+    conn.close()
+    return {
+        'stats': state_cache.stats(),
+        'signals': signals,
+        'next_cursor': cursor,
+        'positions': position_book.positions(),
+        'pending_trades': trades,
+        'account': account_history.latest,
+        'generated_at': time.time(),
+    }
+
+def stats_counters():
+    """Compteurs affichés par le dashboard (diffusés quand ils changent)"""
+    stats = state_cache.stats()
+    return {'trend_stats': stats['trend_stats'], 'momentum_shifts_24h': stats['momentum_shifts_24h']}
+
+def pending_trades_payload():
+    conn = get_db()
+    trades = load_pending_trades(conn)
+    conn.close()
+    return {'trades': trades}
+
+# Snapshot partagé par tous les dashboards, reconstruit si la file des trades ou les positions changent
+bootstrap_cache = SnapshotCache(build_bootstrap)
+
+# Diffusions vers la room ALL (dashboards): une requête SQLite par changement, pas par dashboard
+dashboard_pusher = DashboardPusher(
+    lambda event, payload: broadcast(event, payload, to=ALL_ROOMS),
+    [PushSource('pending_trades', pending_trades_payload, version=trade_notifier.check_expired),
+     PushSource('stats_update', stats_counters, interval=STATS_PUSH_INTERVAL)],
+    active=lambda: has_subscribers(ALL_ROOMS))
+
+@app.route('/api/bootstrap')
+def get_bootstrap():
+    """État initial du dashboard en une requête (réponse partagée, If-None-Match → 304)"""
+    if not state_cache.loaded:
+        load_state_cache()
+    body, etag = bootstrap_cache.get((trade_notifier.check_expired(), position_book.version))
+    if request.headers.get('If-None-Match') == etag:
+        return '', 304, {'ETag': etag}
+    return Response(body, mimetype='application/json', headers={'ETag': etag, 'Cache-Control': 'no-cache'})
+
 @app.route('/api/signals/history')
 def get_signals_history():
-    """Récupère l'historique des signaux"""
+    """
+    Historique des signaux, du plus récent au plus ancien (archives comprises).
+    Filtres symbol, timeframe, trend, from, to; page suivante: ?cursor=<next_cursor>
+    """
     limit = request.args.get('limit', 100, type=int)
+    try:
+        query = HistoryQuery.from_args(request.args)
+        conn = get_db()
+        try:
+            signals, next_cursor = page(conn, query, request.args.get('cursor'), limit)
+        finally:
+            conn.close()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    
+    return jsonify({'signals': signals, 'next_cursor': next_cursor})
+
+@app.route('/api/signals/export')
+def export_signals():
+    """Export en flux (NDJSON par défaut, ?format=csv), du plus ancien au plus récent, mêmes filtres que l'historique"""
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'status': 'error', 'message': 'format: ndjson ou csv'}), 400
+    try:
+        query = HistoryQuery.from_args(request.args)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    cursor = request.args.get('cursor')
+    
+    def generate():
+        conn = get_db()
+        try:
+            signals = iter_signals(conn, query, cursor)
+            yield from (to_csv(signals) if export_format == 'csv' else to_ndjson(signals))
+        finally:
+            conn.close()
+    
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    filename = f"signals.{'csv' if export_format == 'csv' else 'ndjson'}"
+    return Response(stream_with_context(generate()), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+@app.route('/api/signals/rollups')
+def get_signals_rollups():
+    """Agrégats minute (period=M1) ou bougie (period=BAR) des signaux archivés"""
     symbol = request.args.get('symbol', None)
+    period = request.args.get('period', 'M1')
+    limit = request.args.get('limit', 500, type=int)
     
     conn = get_db()
-    c = conn.cursor()
-    
     if symbol:
-        c.execute('''
-            SELECT * FROM signals WHERE symbol = ? 
-            ORDER BY created_at DESC LIMIT ?
-        ''', (symbol, limit))
+        rows = conn.execute('''
+            SELECT * FROM signal_rollups WHERE symbol = ? AND period = ?
+            ORDER BY bucket DESC LIMIT ?
+        ''', (symbol, period, limit)).fetchall()
     else:
-        c.execute('SELECT * FROM signals ORDER BY created_at DESC LIMIT ?', (limit,))
-    
-    signals = [dict(row) for row in c.fetchall()]
+        rows = conn.execute('''
+            SELECT * FROM signal_rollups WHERE period = ?
+            ORDER BY bucket DESC LIMIT ?
+        ''', (period, limit)).fetchall()
     conn.close()
     
-    return jsonify({'signals': signals})
+    rollups = []
+    for row in rows:
+        rollup = dict(row)
+        code = rollup.pop('last_final_signal')
+        rollup['last_final_signal'] = FINAL_SIGNALS[code] if code is not None else None
+        rollups.append(rollup)
+    return jsonify({'rollups': rollups})
 
 @app.route('/api/stats')
 def get_stats():
-    """Statistiques globales"""
-    conn = get_db()
-    c = conn.cursor()
-    
-    # Compter les signaux par tendance
-    c.execute('''
-        SELECT trend, COUNT(*) as count FROM signals 
-        WHERE created_at > datetime('now', '-24 hours')
-        GROUP BY trend
-    ''')
-    trend_stats = {row['trend']: row['count'] for row in c.fetchall()}
-    
-    # Compter les momentum shifts
-    c.execute('''
-        SELECT COUNT(*) as count FROM signals 
-        WHERE momentum_shift = 1 AND created_at > datetime('now', '-24 hours')
-    ''')
-    momentum_shifts = c.fetchone()['count']
-    
-    # Dernier signal par symbole
-    c.execute('''
-        SELECT symbol, trend, momentum_shift, bid, ask, timestamp 
-        FROM signals 
-        GROUP BY symbol 
-        ORDER BY created_at DESC
-    ''')
-    latest_by_symbol = [dict(row) for row in c.fetchall()]
-    
-    conn.close()
-    
-    return jsonify({
-        'trend_stats': trend_stats,
-        'momentum_shifts_24h': momentum_shifts,
-        'latest_by_symbol': latest_by_symbol
-    })
+    """Statistiques globales (servies par le cache mémoire, sans requête SQLite)"""
+    if not state_cache.loaded:
+        load_state_cache()
+    return jsonify(state_cache.stats())
+
+@app.route('/api/db/stats')
+def get_db_stats():
+    """État de l'écrivain SQLite (file, lots, rejets)"""
+    return jsonify(writer_stats())
+
+@app.route('/api/broadcast/stats')
+def get_broadcast_stats():
+    """Coalescence des diffusions (reçus, envoyés, prioritaires, remplacés)"""
+    interval = signal_coalescer.interval
+    return jsonify(dict(signal_coalescer.stats, max_hz=round(1 / interval, 3) if interval else 0))
+
+@app.route('/api/indicators')
+def get_indicators():
+    """Indicateurs calculés côté serveur pour la bougie en cours d'un symbole/timeframe"""
+    symbol = request.args.get('symbol')
+    timeframe = request.args.get('timeframe', 'M15')
+    if not symbol:
+        return jsonify({'status': 'error', 'message': 'symbol requis'}), 400
+    snapshot = indicator_engine.snapshot(symbol, timeframe)
+    if snapshot is None:
+        return jsonify({'status': 'error', 'message': 'Aucun prix reçu pour ce flux'}), 404
+    return jsonify(dict(snapshot, symbol=symbol, timeframe=timeframe, stats=indicator_engine.stats))
+
+@app.route('/api/mtf')
+def get_mtf():
+    """Bougies Heikin Ashi et tendance des timeframes agrégés côté serveur d'un symbole"""
+    symbol = request.args.get('symbol')
+    limit = request.args.get('limit', 50, type=int)
+    if not symbol:
+        return jsonify({'status': 'error', 'message': 'symbol requis'}), 400
+    return jsonify({'symbol': symbol, 'timeframes': multi_timeframe.snapshot(symbol, max(0, limit))})
 
 # ============================================
 # ROUTES POSITIONS & ACCOUNT
@@ -578,144 +722,176 @@ def get_positions():
     conn.close()
     return jsonify({'positions': positions})
 
+@app.route('/api/positions/history')
+def get_positions_history():
+    """Historique des positions: ouvertures, modifications, snapshots PnL et fermetures"""
+    limit = request.args.get('limit', 100, type=int)
+    ticket = request.args.get('ticket', None, type=int)
+    symbol = request.args.get('symbol', None)
+    
+    where, params = [], []
+    if ticket is not None:
+        where.append('ticket = ?')
+        params.append(ticket)
+    if symbol:
+        where.append('symbol = ?')
+        params.append(symbol)
+    
+    conn = get_db()
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT * FROM position_history {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY id DESC LIMIT ?
+    ''', (*params, limit))
+    events = [dict(row) for row in c.fetchall()]
+    conn.close()
+    return jsonify({'events': events})
+
 @app.route('/api/positions/update', methods=['POST'])
 def update_positions():
     """L'EA envoie les positions ouvertes"""
     try:
-        data = None
-        if request.is_json:
-            data = request.get_json(silent=True)
-        if data is None:
-            raw = request.get_data(as_text=True)
-            if raw:
-                import json
-                data = json.loads(raw)
-        
+        data = read_payload(request)
         if not data:
             return jsonify({'status': 'error', 'message': 'No data'}), 400
-        
-        positions = data.get('positions', [])
-        
-        conn = get_db()
-        c = conn.cursor()
-        
-        # Marquer toutes les positions comme fermées
-        c.execute("UPDATE positions SET status = 'closed' WHERE status = 'open'")
-        
-        # Mettre à jour ou insérer les positions actuelles
-        for pos in positions:
-            c.execute('''
-                INSERT OR REPLACE INTO positions 
-                (ticket, symbol, type, volume, open_price, current_price, sl, tp, profit, open_time, status)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'open')
-            ''', (
-                pos.get('ticket'),
-                pos.get('symbol'),
-                pos.get('type'),
-                pos.get('volume'),
-                pos.get('open_price'),
-                pos.get('current_price'),
-                pos.get('sl', 0),
-                pos.get('tp', 0),
-                pos.get('profit', 0),
-                pos.get('open_time', datetime.now().isoformat())
-            ))
-        
-        conn.commit()
-        conn.close()
-        
-        # Diffuser via WebSocket
-        socketio.emit('positions_update', {'positions': positions})
-        
-        return jsonify({'status': 'success', 'count': len(positions)})
+        if not isinstance(data, dict):
+            raise ValidationError([{'field': '$', 'error': 'objet JSON attendu'}])
+        
+        positions = validate_list(data.get('positions', []), POSITION_SCHEMA, 'positions')
+        # EA propriétaire des positions: les commandes CLOSE/MODIFY de ses tickets lui sont réservées
+        consumer = request.args.get('consumer') or None
+        
+        # Diff avec les positions connues de cet EA: seules les lignes changées sont écrites et diffusées
+        with position_book.lock:
+            changes = position_book.diff(positions, consumer)
+            if changes:
+                db_write(changes.write)
+                position_book.apply(changes)
+        
+        if changes:
+            broadcast('positions_changed', changes.message(), to=ALL_ROOMS)
+            skip = room_members(ALL_ROOMS)
+            changed_symbols = changes.symbols()
+            for symbol, symbol_room_names in symbol_rooms(socketio.server.manager).items():
+                if symbol in changed_symbols:
+                    broadcast('positions_changed', changes.message(symbol), to=symbol_room_names, skip_sid=skip)
+        
+        return jsonify({'status': 'success', 'count': len(positions), 'opened': len(changes.opened),
+                        'updated': len(changes.updated), 'closed': len(changes.closed)})
+    
+    except (PayloadError, ValidationError) as e:
+        return invalid_payload(e, log_trade)
     
     except Exception as e:
-        print(f"[ERROR] update_positions: {str(e)}")
+        log_trade.error('update_positions: %s', e, extra=RATE_LIMITED)
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
 @app.route('/api/account', methods=['POST'])
 def update_account():
     """L'EA envoie les infos du compte"""
     try:
-        data = None
-        if request.is_json:
-            data = request.get_json(silent=True)
-        if data is None:
-            raw = request.get_data(as_text=True)
-            if raw:
-                import json
-                data = json.loads(raw)
+        data = read_payload(request)
         
         if data:
-            socketio.emit('account_update', {
-                'balance': data.get('balance', 0),
-                'equity': data.get('equity', 0),
-                'margin': data.get('margin', 0),
-                'freeMargin': data.get('free_margin', 0)
+            account = validate(data, ACCOUNT_SCHEMA)
+            # Dernier snapshot exposé seulement une fois écrit (file pleine ou rollback: inchangé)
+            account_history.stored(db_write(account_history.record(account)))
+            broadcast('account_update', {
+                'balance': account['balance'],
+                'equity': account['equity'],
+                'margin': account['margin'],
+                'freeMargin': account['free_margin']
             })
         
         return jsonify({'status': 'success'})
     
+    except (PayloadError, ValidationError) as e:
+        return invalid_payload(e, log_trade)
+    
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
+@app.route('/api/account/history')
+def get_account_history():
+    """Courbe d'equity sous-échantillonnée (min/max/dernier par bucket) sur [start, end[ (epoch secondes)"""
+    try:
+        end = parse_time(request.args['end']) if 'end' in request.args else time.time()
+        start = parse_time(request.args['start']) if 'start' in request.args else max(0.0, end - 86400)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    points = request.args.get('points', 500, type=int)
+    if start >= end:
+        return jsonify({'status': 'error', 'message': 'start doit précéder end'}), 400
+    
+    conn = get_db()
+    curve = account_history.curve(conn, start, end, points)
+    conn.close()
+    curve['latest'] = account_history.latest
+    return jsonify(curve)
+
+def ticket_consumer(ticket, data):
+    """EA destinataire d'une commande sur un ticket: `consumer` explicite, sinon l'EA qui a déclaré la position"""
+    return data.get('consumer') or position_book.consumer(ticket)
+
 @app.route('/api/close_position', methods=['POST'])
 def close_position():
     """Demande de fermeture d'une position"""
     try:
-        data = request.get_json() or {}
-        ticket = data.get('ticket')
-        
-        if not ticket:
-            return jsonify({'status': 'error', 'message': 'Ticket requis'}), 400
-        
-        # Convertir en int
-        ticket = int(ticket)
+        data = validate(read_payload(request), TICKET_COMMAND_SCHEMA)
+        ticket = data['ticket']
+        consumer = ticket_consumer(ticket, data)
         
         # Ajouter la commande de fermeture avec le ticket dans plusieurs champs pour être sûr
-        conn = get_db()
-        c = conn.cursor()
         # Le ticket est dans la colonne 'ticket' ET dans 'symbol' comme backup
-        c.execute('''
-            INSERT INTO trades (timestamp, symbol, action, volume, price, sl, tp, status, ticket)
-            VALUES (?, ?, 'CLOSE', 0, 0, 0, 0, 'pending', ?)
-        ''', (datetime.now().isoformat(), str(ticket), ticket))
-        trade_id = c.lastrowid
-        conn.commit()
+        def insert_close(c):
+            c.execute('''
+                INSERT INTO trades (timestamp, symbol, action, volume, price, sl, tp, status, ticket, consumer)
+                VALUES (?, ?, 'CLOSE', 0, 0, 0, 0, 'pending', ?, ?)
+            ''', (datetime.now().isoformat(), str(ticket), ticket, consumer))
+            return c.lastrowid
+        trade_id = db_write(insert_close)
+        trade_notifier.notify()
         
         # Vérifier l'insertion
-        c.execute("SELECT * FROM trades WHERE id = ?", (trade_id,))
-        row = c.fetchone()
+        conn = get_db()
+        row = conn.execute("SELECT * FROM trades WHERE id = ?", (trade_id,)).fetchone()
         conn.close()
         
-        print(f"[TRADE] Demande fermeture position #{ticket}")
+        log_trade.info('Demande fermeture position #%s (%s)', ticket, consumer or 'tout EA')
         if row:
-            print(f"[DEBUG] Trade inséré ID={trade_id}: action={row['action']}, ticket={row['ticket']}, symbol={row['symbol']}")
+            log_trade.debug('Trade inséré ID=%s: action=%s, ticket=%s, symbol=%s',
+                            trade_id, row['action'], row['ticket'], row['symbol'])
         
         return jsonify({'status': 'success', 'ticket': ticket, 'trade_id': trade_id})
     
+    except (PayloadError, ValidationError) as e:
+        return invalid_payload(e, log_trade)
+    
     except Exception as e:
-        print(f"[ERROR] close_position: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        log_trade.exception('close_position: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
 @app.route('/api/close_all', methods=['POST'])
 def close_all_positions():
-    """Demande de fermeture de toutes les positions"""
+    """Demande de fermeture de toutes les positions: une commande par EA détenteur de positions"""
     try:
-        conn = get_db()
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO trades (timestamp, symbol, action, volume, status)
-            VALUES (?, '', 'CLOSE_ALL', 0, 'pending')
-        ''', (datetime.now().isoformat(),))
-        conn.commit()
-        conn.close()
-        
-        print("[TRADE] Demande fermeture TOUTES les positions")
-        
-        return jsonify({'status': 'success', 'closed': 'pending'})
+        data = validate(read_payload(request), CLOSE_ALL_SCHEMA)
+        # Un EA explicite, sinon chaque EA connu; aucun EA identifié = premier EA qui réserve
+        consumers = [data['consumer']] if data.get('consumer') else position_book.consumers() or [None]
+        timestamp = datetime.now().isoformat()
+        db_write(lambda c: c.executemany('''
+            INSERT INTO trades (timestamp, symbol, action, volume, status, consumer)
+            VALUES (?, '', 'CLOSE_ALL', 0, 'pending', ?)
+        ''', [(timestamp, consumer) for consumer in consumers]))
+        trade_notifier.notify()
+        
+        log_trade.info('Demande fermeture TOUTES les positions (%s)',
+                       ', '.join(consumer or 'tout EA' for consumer in consumers))
+        
+        return jsonify({'status': 'success', 'closed': 'pending', 'consumers': consumers})
+    
+    except (PayloadError, ValidationError) as e:
+        return invalid_payload(e, log_trade)
     
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 400
@@ -724,13 +900,10 @@ def close_all_positions():
 def modify_position():
     """Demande de modification d'une position (SL/TP)"""
     try:
-        data = request.get_json() or {}
-        ticket = data.get('ticket')
-        new_sl = data.get('sl')
-        new_tp = data.get('tp')
-        
-        if not ticket:
-            return jsonify({'status': 'error', 'message': 'Ticket requis'}), 400
+        data = validate(read_payload(request), TICKET_COMMAND_SCHEMA)
+        ticket = data['ticket']
+        new_sl = data['sl']
+        new_tp = data['tp']
         
         # Créer la commande de modification
         modify_data = {'ticket': ticket}
@@ -739,36 +912,34 @@ def modify_position():
         if new_tp is not None:
             modify_data['tp'] = new_tp
         
-        conn = get_db()
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO trades (timestamp, symbol, action, volume, sl, tp, status, ticket)
-            VALUES (?, ?, 'MODIFY', 0, ?, ?, 'pending', ?)
-        ''', (datetime.now().isoformat(), str(ticket), new_sl or 0, new_tp or 0, int(ticket)))
-        conn.commit()
-        conn.close()
+        consumer = ticket_consumer(ticket, data)
+        db_write(lambda c: c.execute('''
+            INSERT INTO trades (timestamp, symbol, action, volume, sl, tp, status, ticket, consumer)
+            VALUES (?, ?, 'MODIFY', 0, ?, ?, 'pending', ?, ?)
+        ''', (datetime.now().isoformat(), str(ticket), new_sl or 0, new_tp or 0, ticket, consumer)))
+        trade_notifier.notify()
         
-        print(f"[TRADE] Demande modification position #{ticket} - SL: {new_sl}, TP: {new_tp}")
+        log_trade.info('Demande modification position #%s - SL: %s, TP: %s', ticket, new_sl, new_tp)
         
         return jsonify({'status': 'success'})
     
+    except (PayloadError, ValidationError) as e:
+        return invalid_payload(e, log_trade)
+    
     except Exception as e:
-        print(f"[ERROR] modify_position: {str(e)}")
+        log_trade.error('modify_position: %s', e)
         return jsonify({'status': 'error', 'message': str(e)}), 400
 
 @app.route('/api/cancel_trade/<int:trade_id>', methods=['POST'])
 def cancel_trade(trade_id):
-    """Annuler un trade en attente (supprimer de la queue)"""
+    """Annuler un trade en attente ou réservé par un EA (supprimer de la queue, le bail est libéré)"""
     try:
-        conn = get_db()
-        c = conn.cursor()
-        c.execute("UPDATE trades SET status = 'cancelled' WHERE id = ? AND status = 'pending'", (trade_id,))
-        affected = c.rowcount
-        conn.commit()
-        conn.close()
+        affected = db_write(cancel(trade_id))
         
         if affected > 0:
-            print(f"[TRADE] Trade #{trade_id} annulé")
+            # L'EA qui détient le bail verra sa confirmation refusée (déjà terminée)
+            trade_notifier.notify()
+            log_trade.info('Trade #%s annulé', trade_id)
             return jsonify({'status': 'success', 'message': f'Trade #{trade_id} annulé'})
         else:
             return jsonify({'status': 'error', 'message': 'Trade non trouvé ou déjà traité'}), 404
@@ -779,24 +950,16 @@ def cancel_trade(trade_id):
 @app.route('/api/pending_trades_list', methods=['GET'])
 def pending_trades_list():
     """Liste les trades en attente pour affichage dans le dashboard"""
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM trades WHERE status = 'pending' ORDER BY created_at DESC")
-    trades = [dict(row) for row in c.fetchall()]
-    conn.close()
-    return jsonify({'trades': trades})
+    return jsonify(pending_trades_payload())
 
 @app.route('/api/clear_pending', methods=['POST'])
 def clear_pending():
-    """Supprimer tous les trades en attente"""
+    """Supprimer tous les trades en attente ou réservés"""
     try:
-        conn = get_db()
-        c = conn.cursor()
-        c.execute("UPDATE trades SET status = 'cancelled' WHERE status = 'pending'")
-        count = c.rowcount
-        conn.commit()
-        conn.close()
-        print(f"[TRADE] {count} trades en attente annulés")
+        count = db_write(cancel())
+        if count:
+            trade_notifier.notify()
+        log_trade.info('%d trades en attente annulés', count)
         return jsonify({'status': 'success', 'cleared': count})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 400
@@ -823,19 +986,50 @@ def clear_pending():
 
 @socketio.on('connect')
 def handle_connect():
-    print('[WS] Client connecté')
+    metrics.SOCKETIO_CLIENTS.inc()
+    log_ws.info('Client connecté', extra=RATE_LIMITED)
     emit('connected', {'status': 'ok', 'message': 'Connecté au serveur Crystal Heikin'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    print('[WS] Client déconnecté')
+    metrics.SOCKETIO_CLIENTS.dec()
+    log_ws.info('Client déconnecté', extra=RATE_LIMITED)
 
 @socketio.on('subscribe')
 def handle_subscribe(data):
-    """Abonnement à un symbole spécifique"""
-    symbol = data.get('symbol', 'ALL')
-    print(f'[WS] Abonnement: {symbol}')
-    emit('subscribed', {'symbol': symbol})
+    """
+    Abonnement à un symbole ({'symbol', 'timeframe'}), à plusieurs ({'symbols': [...]}) ou à ALL.
+    {'protocol': 'delta'} (+ 'encoding': 'binary'): snapshot puis signal_delta au lieu de new_signal.
+    """
+    protocol = parse_protocol(data)
+    subscriptions = parse_subscription(data)
+    subscribed = [{'symbol': symbol, 'timeframe': timeframe, 'protocol': protocol}
+                  for symbol, timeframe in subscriptions]
+    # Sous le verrou des flux: aucun delta ne peut s'intercaler entre l'abonnement et le snapshot
+    with signal_streams.lock:
+        with rooms_lock:
+            for symbol, timeframe in subscriptions:
+                join_room(room_for(symbol, timeframe, protocol))
+        emit('subscribed', subscribed[0] if len(subscribed) == 1 else {'subscriptions': subscribed})
+        if protocol != PROTOCOL_FULL:
+            send_snapshot(subscriptions, protocol == PROTOCOL_BINARY)
+    log_ws.info('Abonnement: %s (%s)', ', '.join(s['symbol'] for s in subscribed), protocol, extra=RATE_LIMITED)
+
+@socketio.on('unsubscribe')
+def handle_unsubscribe(data):
+    """Désabonnement (mêmes formats que subscribe)"""
+    protocol = parse_protocol(data)
+    with rooms_lock:
+        for symbol, timeframe in parse_subscription(data):
+            leave_room(room_for(symbol, timeframe, protocol))
+    emit('unsubscribed', data if isinstance(data, dict) else {'symbol': data})
+
+@socketio.on('resync')
+def handle_resync(data):
+    """Trou de séquence détecté par le client: snapshot du flux ({'symbol', 'timeframe', 'encoding'})"""
+    data = data if isinstance(data, dict) else {}
+    with signal_streams.lock:
+        send_snapshot(parse_subscription(data), data.get('encoding') == 'binary')
 
 # ============================================
 # MAIN
@@ -843,10 +1037,15 @@ def handle_subscribe(data):
 
 if __name__ == '__main__':
     init_db()
+    load_state_cache()
+    start_retention_thread()
+    dashboard_pusher.start()
     print("=" * 50)
     print("Crystal Heikin Ashi - Flask Bridge")
     print("=" * 50)
     print("Server démarré sur http://localhost:5000")
     print("En attente des signaux MT5...")
+    print("Mode développement (production: python server.py)")
     print("=" * 50)
-    socketio.run(app, host='0.0.0.0', port=5000, debug=True, allow_unsafe_werkzeug=True)
+    socketio.run(app, host='0.0.0.0', port=5000, debug=os.environ.get('FLASK_DEBUG') == '1',
+                 allow_unsafe_werkzeug=True)
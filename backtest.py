@@ -0,0 +1,272 @@
+"""
+Crystal Heikin Ashi - Replay et backtest de l'historique
+Rejoue les signaux stockés (SQLite + archives) dans la confluence vectorisée
+et simule les commandes BUY/SELL/CLOSE, un processus par symbole/timeframe
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import retention
+from confluence import FIELDS, FIELD_DEFAULTS, INDICATORS, STRONG_THRESHOLD, THRESHOLD, score_batch
+from signal_store import ENUM_FIELDS, ENUM_VALUES
+
+# Colonnes lues pour le replay (en plus des champs de la confluence)
+REPLAY_FIELDS = ['id', 'timestamp', 'ask'] + [f for f in FIELDS if f not in ('id', 'timestamp', 'ask')]
+
+# Codes du signal final (index dans FINAL_SIGNALS)
+BUY_CODES = (1, 2)
+SELL_CODES = (3, 4)
+STRONG_CODES = (1, 3)
+
+
+def _enum_labels(field):
+    """Table code -> libellé d'une énumération; le dernier élément (code -1/NULL) vaut le défaut"""
+    size = max(ENUM_VALUES) + 1
+    return np.array([ENUM_VALUES.get(code, '') for code in range(size)]
+                    + [FIELD_DEFAULTS.get(field, 'NEUTRAL')])
+
+
+def _numeric(values):
+    """Colonne REAL/INTEGER, NULL -> 0 (comme parse_signal)"""
+    return np.nan_to_num(np.array(values, dtype=np.float64), nan=0.0)
+
+
+def _enum(values, field):
+    """Colonne d'énumération codée -> libellés (NULL -> défaut du champ)"""
+    codes = np.nan_to_num(np.array(values, dtype=np.float64), nan=-1).astype(np.int64)
+    labels = _enum_labels(field)
+    codes[(codes < 0) | (codes >= len(labels) - 1)] = -1
+    return labels[codes]
+
+
+def _text(values, field):
+    """Colonne TEXT (NULL -> défaut du champ)"""
+    default = FIELD_DEFAULTS.get(field, '')
+    return np.array([default if v is None else v for v in values], dtype=str)
+
+
+def _columns(names, rows_by_column):
+    """Colonnes NumPy prêtes pour score_batch"""
+    columns = {}
+    for name, values in zip(names, rows_by_column):
+        if name in ENUM_FIELDS:
+            columns[name] = _enum(values, name)
+        elif name in ('timestamp', 'trend'):
+            columns[name] = _text(values, name)
+        else:
+            columns[name] = _numeric(values)
+    return columns
+
+
+def load_sqlite(db_path, symbol, timeframe):
+    """Signaux d'un symbole/timeframe encore dans SQLite, colonne par colonne"""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        available = {row[1] for row in conn.execute('PRAGMA table_info(signals)')}
+        names = [f for f in REPLAY_FIELDS if f in available]
+        rows = conn.execute(f'''
+            SELECT {', '.join(names)} FROM signals
+            WHERE symbol = ? AND timeframe = ?
+        ''', (symbol, timeframe)).fetchall()
+    finally:
+        conn.close()
+    columns = _columns(names, list(zip(*rows)) if rows else [[] for _ in names])
+    # Champs absents d'une base non migrée: valeurs par défaut
+    for name in REPLAY_FIELDS:
+        if name not in columns:
+            columns[name] = _columns([name], [[None] * len(rows)])[name]
+    return columns
+
+
+def load_archives(symbol, timeframe):
+    """Signaux archivés d'un symbole/timeframe (archives en memory-map)"""
+    parts = []
+    for _, _, path in sorted(retention.list_archives(symbol), key=lambda a: a[1]):
+        archive = retention.open_archive(path)
+        mask = (archive['symbol'] == symbol) & (archive['timeframe'] == timeframe)
+        if not mask.any():
+            continue
+        part = {}
+        for name in REPLAY_FIELDS:
+            values = archive.get(name)
+            if values is None:
+                part[name] = _columns([name], [[None] * int(mask.sum())])[name]
+            elif name in ENUM_FIELDS:
+                part[name] = _enum(values[mask], name)
+            elif values.dtype.kind == 'i':
+                part[name] = np.where(values[mask] == retention.INT_NULL, 0, values[mask]).astype(np.float64)
+            elif values.dtype.kind == 'f':
+                part[name] = np.nan_to_num(values[mask], nan=0.0)
+            else:
+                part[name] = np.array(values[mask])
+        parts.append(part)
+    return parts
+
+
+def load_signals(db_path, symbol, timeframe, archives=True):
+    """Historique complet d'un symbole/timeframe trié par timestamp (puis id)"""
+    parts = load_archives(symbol, timeframe) if archives else []
+    parts.append(load_sqlite(db_path, symbol, timeframe))
+    columns = {name: np.concatenate([part[name] for part in parts]) for name in REPLAY_FIELDS}
+    # Un id déjà archivé puis relu depuis SQLite (archivage interrompu) n'est rejoué qu'une fois
+    _, unique = np.unique(columns['id'], return_index=True)
+    order = unique[np.lexsort((columns['id'][unique], columns['timestamp'][unique]))]
+    return {name: values[order] for name, values in columns.items()}
+
+
+def simulate(columns, final_code, strong_only=False, exit_on_neutral=False, volume=1.0):
+    """
+    Simule les commandes que le dashboard enverrait via /api/trade:
+    BUY/SELL à l'arrivée d'un signal, CLOSE + inversion sur le signal opposé
+    (ou CLOSE sur NEUTRAL avec exit_on_neutral). Achat à l'ask, vente au bid;
+    une position encore ouverte en fin d'historique est valorisée au dernier prix.
+    """
+    n = len(final_code)
+    buy = np.isin(final_code, STRONG_CODES[:1] if strong_only else BUY_CODES)
+    sell = np.isin(final_code, STRONG_CODES[1:] if strong_only else SELL_CODES)
+    wanted = buy.astype(np.int8) - sell.astype(np.int8)
+
+    if exit_on_neutral:
+        position = wanted
+    else:
+        # Position conservée jusqu'au prochain signal directionnel (forward fill)
+        last = np.where(wanted != 0, np.arange(n), 0)
+        np.maximum.accumulate(last, out=last)
+        position = wanted[last] if n else wanted
+
+    bid = columns['bid']
+    ask = columns['ask']
+    previous = np.concatenate([[0], position[:-1]])
+    changes = np.flatnonzero(position != previous)
+
+    # Chaque changement ferme la position précédente et ouvre la nouvelle
+    entries = changes[position[changes] != 0]
+    exit_points = np.concatenate([changes, [n - 1]]) if n else changes
+    following = np.searchsorted(exit_points, entries, side='right')
+    exits = exit_points[np.minimum(following, len(exit_points) - 1)]
+    sides = position[entries]
+    pnl = np.where(sides > 0, bid[exits] - ask[entries], bid[entries] - ask[exits]) * volume
+
+    equity = np.cumsum(pnl)
+    peak = np.maximum.accumulate(np.concatenate([[0.0], equity]))[1:]
+    wins = int((pnl > 0).sum())
+    return {
+        'trades': len(pnl),
+        'buy': int((sides > 0).sum()),
+        'sell': int((sides < 0).sum()),
+        'close': int((previous[changes] != 0).sum()),
+        'wins': wins,
+        'hit_rate': round(wins / len(pnl) * 100, 1) if len(pnl) else 0.0,
+        'pnl': float(pnl.sum()),
+        'max_drawdown': float((peak - equity).max()) if len(pnl) else 0.0,
+    }
+
+
+def replay(job):
+    """Replay d'un symbole/timeframe (exécuté dans un processus du pool)"""
+    symbol, timeframe, options = job
+    retention.ARCHIVE_DIR = options['archive_dir']
+    start = time.perf_counter()
+    columns = load_signals(options['db'], symbol, timeframe, options['archives'])
+    scores = score_batch(columns, options['weights'], options['strong_threshold'], options['threshold'])
+    result = simulate(columns, scores['final_code'], options['strong_only'],
+                      options['exit_on_neutral'], options['volume'])
+    result.update({
+        'symbol': symbol,
+        'timeframe': timeframe,
+        'signals': len(columns['id']),
+        'seconds': time.perf_counter() - start,
+    })
+    return result
+
+
+def list_jobs(db_path, symbols=None, timeframe=None, archives=True):
+    """Couples (symbole, timeframe) à rejouer, les plus volumineux en premier"""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    counts = {(row[0], row[1]): row[2] for row in conn.execute(
+        'SELECT symbol, timeframe, COUNT(*) FROM signals GROUP BY symbol, timeframe')}
+    conn.close()
+    if archives:
+        for _, _, path in retention.list_archives():
+            archive = retention.open_archive(path)
+            keys, sizes = np.unique(np.char.add(np.char.add(archive['symbol'], '\t'), archive['timeframe']),
+                                    return_counts=True)
+            for key, size in zip(keys.tolist(), sizes.tolist()):
+                pair = tuple(key.split('\t', 1))
+                counts[pair] = counts.get(pair, 0) + size
+    jobs = [(pair, count) for pair, count in counts.items()
+            if (not symbols or pair[0] in symbols) and (timeframe is None or pair[1] == timeframe)]
+    jobs.sort(key=lambda j: j[1], reverse=True)
+    return [pair for pair, _ in jobs]
+
+
+def run_backtest(db_path='signals.db', symbols=None, timeframe=None, workers=None, archives=True,
+                 weights=None, strong_threshold=STRONG_THRESHOLD, threshold=THRESHOLD,
+                 strong_only=False, exit_on_neutral=False, volume=1.0):
+    """Rejoue l'historique en parallèle et retourne les résultats par symbole/timeframe"""
+    options = {
+        'db': db_path,
+        'archive_dir': retention.ARCHIVE_DIR,
+        'archives': archives,
+        'weights': weights,
+        'strong_threshold': strong_threshold,
+        'threshold': threshold,
+        'strong_only': strong_only,
+        'exit_on_neutral': exit_on_neutral,
+        'volume': volume,
+    }
+    jobs = [(symbol, tf, options) for symbol, tf in list_jobs(db_path, symbols, timeframe, archives)]
+    if workers == 1 or len(jobs) <= 1:
+        return [replay(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(replay, jobs))
+
+
+def _parse_weight(text):
+    """NOM=POIDS -> (nom, poids)"""
+    name, _, weight = text.rpartition('=')
+    if name not in {ind['name'] for ind in INDICATORS}:
+        raise argparse.ArgumentTypeError(f'Indicateur inconnu: {name}')
+    return name, float(weight)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Backtest de la confluence sur l'historique des signaux")
+    parser.add_argument('--db', default='signals.db')
+    parser.add_argument('--symbol', action='append', help='symbole à rejouer (répétable)')
+    parser.add_argument('--timeframe')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--no-archives', action='store_true', help='ignorer les archives de retention.py')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--strong-threshold', type=float, default=STRONG_THRESHOLD)
+    parser.add_argument('--weight', type=_parse_weight, action='append', default=[],
+                        help="poids d'un indicateur, ex: --weight 'Momentum Shift=1'")
+    parser.add_argument('--strong-only', action='store_true', help='trader seulement STRONG_BUY/STRONG_SELL')
+    parser.add_argument('--exit-on-neutral', action='store_true', help='CLOSE dès que le signal redevient NEUTRAL')
+    parser.add_argument('--volume', type=float, default=1.0)
+    parser.add_argument('--json', action='store_true', help='résultats en JSON')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    results = run_backtest(args.db, args.symbol, args.timeframe, args.workers, not args.no_archives,
+                           dict(args.weight) or None, args.strong_threshold, args.threshold,
+                           args.strong_only, args.exit_on_neutral, args.volume)
+    elapsed = time.perf_counter() - start
+    total = sum(r['signals'] for r in results)
+
+    if args.json:
+        print(json.dumps({'results': results, 'signals': total, 'seconds': elapsed}, indent=2))
+    else:
+        print(f"{'Symbole':<10} {'TF':<11} {'Signaux':>9} {'Trades':>7} {'Hit %':>6} {'PnL':>12} {'Drawdown':>12}")
+        for r in results:
+            print(f"{r['symbol']:<10} {r['timeframe']:<11} {r['signals']:>9} {r['trades']:>7} "
+                  f"{r['hit_rate']:>6.1f} {r['pnl']:>12.5f} {r['max_drawdown']:>12.5f}")
+        rate = total / elapsed * 60 if elapsed > 0 else 0
+        print(f"[BACKTEST] {total} signaux rejoués en {elapsed:.2f}s ({rate:,.0f} signaux/min)")
@@ -0,0 +1,100 @@
+"""
+Benchmark - débit du replay/backtest (backtest.py) sur une base synthétique
+Usage: python benchmarks/bench_backtest.py [--rows 1000000] [--workers N]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backtest import run_backtest
+from migrations import migrate
+from signal_store import INSERT_SQL, encode_signal, NUMERIC_FIELDS
+
+SYMBOLS = ['EURUSD', 'GBPUSD', 'USDJPY', 'XAUUSD', 'BTCUSD', 'USDCHF', 'AUDUSD', 'NZDUSD']
+TIMEFRAMES = ['PERIOD_M5', 'PERIOD_M15']
+DIRECTIONS = ['BULLISH', 'BEARISH', 'NEUTRAL']
+
+
+def populate(conn, rows):
+    """Remplit la base avec des signaux complets (indicateurs + confluence)"""
+    now = datetime.now()
+    step = timedelta(days=30) / rows
+    prices = {symbol: 1.0 + i for i, symbol in enumerate(SYMBOLS)}
+    batch = []
+    for i in range(rows):
+        symbol = SYMBOLS[i % len(SYMBOLS)]
+        price = prices[symbol] = prices[symbol] * (1 + random.gauss(0, 0.0005))
+        trend = random.choice(DIRECTIONS)
+        signal = {
+            'timestamp': (now - step * (rows - i)).isoformat(),
+            'symbol': symbol,
+            'timeframe': TIMEFRAMES[i % 2],
+            'signal_type': 'INDICATOR',
+            'ha_open': price, 'ha_high': price, 'ha_low': price, 'ha_close': price,
+            'trend': trend,
+            'momentum_shift': 1 if random.random() < 0.05 else 0,
+            'bid': price, 'ask': price * 1.0001, 'spread': 1.0,
+            'harmonic_pattern': random.choice(['NONE', 'BULLISH', 'BEARISH']),
+            'price_position': random.choice(['ABOVE_VWAP', 'BELOW_VWAP']),
+            'supertrend_direction': trend if random.random() < 0.7 else random.choice(DIRECTIONS),
+            'candle_pattern': random.choice(['NONE', 'BULLISH', 'BEARISH']),
+            'bollinger_direction': random.choice(DIRECTIONS),
+            'fvg_type': random.choice(['NONE', 'BULLISH', 'BEARISH']),
+            'macd_trend': trend if random.random() < 0.6 else random.choice(DIRECTIONS),
+            'mtf_trend': trend if random.random() < 0.5 else 'NEUTRAL',
+        }
+        for field in NUMERIC_FIELDS:
+            signal[field] = price * random.uniform(0.995, 1.005)
+        batch.append(encode_signal(signal))
+        if len(batch) == 50000:
+            conn.executemany(INSERT_SQL, batch)
+            batch = []
+    if batch:
+        conn.executemany(INSERT_SQL, batch)
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='crystal_bench_')
+    path = os.path.join(workdir, 'bench.db')
+    try:
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode = WAL')
+        migrate(conn)
+
+        print(f"Génération de {args.rows} signaux...")
+        start = time.perf_counter()
+        populate(conn, args.rows)
+        conn.close()
+        print(f"  {time.perf_counter() - start:.1f} s")
+
+        print()
+        print(f"{'Workers':<10}{'durée':>10}{'signaux/min':>16}{'trades':>10}")
+        for workers in sorted({1, args.workers}):
+            start = time.perf_counter()
+            results = run_backtest(path, workers=workers, archives=False)
+            elapsed = time.perf_counter() - start
+            total = sum(r['signals'] for r in results)
+            trades = sum(r['trades'] for r in results)
+            print(f"{workers:<10}{elapsed:>8.2f} s{total / elapsed * 60:>16,.0f}{trades:>10}")
+    finally:
+        # Base de plusieurs centaines de Mo: ne pas la laisser dans le dossier temporaire
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark - latence des requêtes du dashboard avant/après les index (migration 2)
+Usage: python benchmarks/bench_indexes.py [--rows 1000000] [--trades 100000]
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate
+
+SYMBOLS = ['EURUSD', 'GBPUSD', 'USDJPY', 'XAUUSD', 'BTCUSD']
+
+# Requêtes identiques à celles des routes de app.py
+QUERIES = {
+    'history (LIMIT 100)': (
+        'SELECT * FROM signals ORDER BY created_at DESC LIMIT ?', (100,)),
+    'history symbol (LIMIT 100)': (
+        'SELECT * FROM signals WHERE symbol = ? ORDER BY created_at DESC LIMIT ?', ('XAUUSD', 100)),
+    'stats trend 24h': (
+        "SELECT trend, COUNT(*) as count FROM signals "
+        "WHERE created_at > datetime('now', '-24 hours') GROUP BY trend", ()),
+    'stats momentum 24h': (
+        "SELECT COUNT(*) as count FROM signals "
+        "WHERE momentum_shift = 1 AND created_at > datetime('now', '-24 hours')", ()),
+    'pending trades': (
+        "SELECT * FROM trades WHERE status = 'pending' ORDER BY created_at ASC", ()),
+}
+
+
+def populate(conn, rows, trades):
+    """Remplit la base avec des signaux répartis sur 30 jours"""
+    now = datetime.utcnow()
+    step = timedelta(days=30) / rows
+    batch = []
+    for i in range(rows):
+        created = (now - step * (rows - i)).strftime('%Y-%m-%d %H:%M:%S')
+        bid = 1.1 + random.uniform(-0.01, 0.01)
+        batch.append((created, random.choice(SYMBOLS), 'M15', 'INDICATOR',
+                      bid, bid, bid, bid, random.choice(['BULLISH', 'BEARISH']),
+                      1 if random.random() < 0.05 else 0, bid, bid + 0.0001, 1.0, created))
+        if len(batch) == 50000:
+            conn.executemany('''
+                INSERT INTO signals (timestamp, symbol, timeframe, signal_type, ha_open, ha_high,
+                    ha_low, ha_close, trend, momentum_shift, bid, ask, spread, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+            batch = []
+    if batch:
+        conn.executemany('''
+            INSERT INTO signals (timestamp, symbol, timeframe, signal_type, ha_open, ha_high,
+                ha_low, ha_close, trend, momentum_shift, bid, ask, spread, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', batch)
+
+    # Historique de trades exécutés + quelques commandes en attente
+    conn.executemany('''
+        INSERT INTO trades (timestamp, symbol, action, volume, status, created_at)
+        VALUES (?, ?, 'BUY', 0.01, ?, ?)
+    ''', [(now.isoformat(), random.choice(SYMBOLS), 'pending' if i % 20000 == 0 else 'executed',
+           (now - timedelta(seconds=trades - i)).strftime('%Y-%m-%d %H:%M:%S'))
+          for i in range(trades)])
+    conn.commit()
+
+
+def measure(conn, repeat):
+    """Latence médiane (ms) de chaque requête"""
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql, params).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = timings[len(timings) // 2]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--trades', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode = WAL')
+    migrate(conn, target=1)
+
+    print(f"Génération de {args.rows} signaux et {args.trades} trades...")
+    start = time.perf_counter()
+    populate(conn, args.rows, args.trades)
+    print(f"  {time.perf_counter() - start:.1f} s")
+
+    before = measure(conn, args.repeat)
+
+    start = time.perf_counter()
+    migrate(conn)
+    index_time = time.perf_counter() - start
+    conn.execute('ANALYZE')
+
+    after = measure(conn, args.repeat)
+
+    print()
+    print(f"{'Requête':<30}{'sans index':>14}{'avec index':>14}{'gain':>10}")
+    for name in QUERIES:
+        gain = before[name] / after[name] if after[name] else float('inf')
+        print(f"{name:<30}{before[name]:>11.2f} ms{after[name]:>11.2f} ms{gain:>9.0f}x")
+    print()
+    print(f"Création des index (migration 2, à chaud): {index_time:.1f} s")
+    print(f"Taille de la base: {os.path.getsize(path) / 1e6:.0f} Mo")
+
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Benchmark - coût du parsing d'un signal par requête: lecture tri-format + float() par champ (avant)
+contre read_payload + schéma en une passe (après)
+Usage: python benchmarks/bench_parser.py [--iterations 20000]
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, request
+from werkzeug.test import EnvironBuilder
+
+import schema
+from schema import read_payload, validate, ValidationError, SIGNAL_SCHEMA
+from signal_store import NUMERIC_FIELDS
+
+
+def legacy_parse_signal(data):
+    """parse_signal d'origine: un float(data.get(x, 0) or 0) par champ"""
+    # Extraire les données avec valeurs par défaut
+    return {
+        'timestamp': data.get('timestamp', datetime.now().isoformat()),
+        'symbol': data.get('symbol', 'UNKNOWN'),
+        'timeframe': data.get('timeframe', 'M15'),
+        'signal_type': data.get('signal_type', 'UPDATE'),
+        'ha_open': float(data.get('ha_open', 0) or 0),
+        'ha_high': float(data.get('ha_high', 0) or 0),
+        'ha_low': float(data.get('ha_low', 0) or 0),
+        'ha_close': float(data.get('ha_close', 0) or 0),
+        'trend': data.get('trend', 'NEUTRAL'),
+        'momentum_shift': int(data.get('momentum_shift', 0) or 0),
+        'bid': float(data.get('bid', 0) or 0),
+        'ask': float(data.get('ask', 0) or 0),
+        'spread': float(data.get('spread', 0) or 0),
+        # Indicateurs
+        'resistance': float(data.get('resistance', 0) or 0),
+        'support': float(data.get('support', 0) or 0),
+        'supply_zone': float(data.get('supply_zone', 0) or 0),
+        'demand_zone': float(data.get('demand_zone', 0) or 0),
+        'vwap': float(data.get('vwap', 0) or 0),
+        'vwap_upper': float(data.get('vwap_upper', 0) or 0),
+        'vwap_lower': float(data.get('vwap_lower', 0) or 0),
+        'poc': float(data.get('poc', 0) or 0),
+        'harmonic_pattern': data.get('harmonic_pattern', 'NONE'),
+        'price_position': data.get('price_position', 'NEUTRAL'),
+        # Super Trend
+        'supertrend_up': float(data.get('supertrend_up', 0) or 0),
+        'supertrend_down': float(data.get('supertrend_down', 0) or 0),
+        'supertrend_direction': data.get('supertrend_direction', 'NEUTRAL'),
+        # Fibo Expansion
+        'fibo_level1': float(data.get('fibo_level1', 0) or 0),
+        'fibo_level2': float(data.get('fibo_level2', 0) or 0),
+        'fibo_level3': float(data.get('fibo_level3', 0) or 0),
+        # Nouveaux indicateurs
+        'anchored_vwap': float(data.get('anchored_vwap', 0) or 0),
+        'drawfib_level1': float(data.get('drawfib_level1', 0) or 0),
+        'drawfib_level2': float(data.get('drawfib_level2', 0) or 0),
+        'drawfib_level3': float(data.get('drawfib_level3', 0) or 0),
+        'candle_pattern': data.get('candle_pattern', 'NONE'),
+        'bollinger_signal': float(data.get('bollinger_signal', 0) or 0),
+        'bollinger_direction': data.get('bollinger_direction', 'NEUTRAL'),
+        'fvg_high': float(data.get('fvg_high', 0) or 0),
+        'fvg_low': float(data.get('fvg_low', 0) or 0),
+        'fvg_type': data.get('fvg_type', 'NONE'),
+        'macd_main': float(data.get('macd_main', 0) or 0),
+        'macd_signal': float(data.get('macd_signal', 0) or 0),
+        'macd_trend': data.get('macd_trend', 'NEUTRAL'),
+        'pro_resistance': float(data.get('pro_resistance', 0) or 0),
+        'pro_support': float(data.get('pro_support', 0) or 0)
+    }
+
+
+def legacy_read(req):
+    """Lecture d'origine: get_json, puis formulaire, puis texte brut"""
+    data = None
+    if req.is_json:
+        data = req.get_json(silent=True)
+    if data is None:
+        data = req.form.to_dict()
+    if not data or len(data) == 0:
+        raw = req.get_data(as_text=True).strip()
+        try:
+            if raw.startswith('{'):
+                data = json.loads(raw)
+        except json.JSONDecodeError:
+            data = {'symbol': 'UNKNOWN', 'trend': 'NEUTRAL'}
+    return data or {}
+
+
+def ea_payload():
+    """Corps envoyé par l'EA (tous les champs, nombres à 5 décimales)"""
+    signal = {'timestamp': datetime.now().isoformat(), 'symbol': 'EURUSD', 'timeframe': 'PERIOD_M15',
+              'signal_type': 'INDICATOR', 'ha_open': 1.08512, 'ha_high': 1.08601, 'ha_low': 1.08477,
+              'ha_close': 1.08588, 'trend': 'BULLISH', 'momentum_shift': 1, 'bid': 1.08590, 'ask': 1.08602,
+              'spread': 1.2, 'harmonic_pattern': 'NONE', 'price_position': 'ABOVE_VWAP',
+              'supertrend_direction': 'BULLISH', 'candle_pattern': 'NONE', 'bollinger_direction': 'NEUTRAL',
+              'fvg_type': 'BULLISH', 'macd_trend': 'BULLISH'}
+    for i, field in enumerate(NUMERIC_FIELDS):
+        signal[field] = round(1.08 + i / 10000, 5)
+    return json.dumps(signal).encode()
+
+
+def check_defaults():
+    """Le schéma garde la sémantique d'origine (data.get(x) or défaut): '' = valeur absente"""
+    empty = {'symbol': 'EURUSD', 'timeframe': '', 'signal_type': '', 'harmonic_pattern': '', 'trend': ''}
+    signal = validate(empty, SIGNAL_SCHEMA)
+    assert (signal['timeframe'], signal['signal_type'], signal['harmonic_pattern'], signal['trend']) == \
+        ('M15', 'UPDATE', 'NONE', 'NEUTRAL'), signal
+    for symbol in ('', None):
+        try:
+            validate({'symbol': symbol}, SIGNAL_SCHEMA)
+        except ValidationError as e:
+            assert e.errors[0]['field'] == 'symbol', e.errors
+        else:
+            raise AssertionError(f'symbol={symbol!r} accepté alors que le champ est requis')
+
+
+def measure(label, fn, iterations):
+    """Durée moyenne d'un appel (µs)"""
+    for _ in range(min(iterations, 1000)):
+        fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return label, (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    check_defaults()
+    body = ea_payload()
+    data = json.loads(body)
+    app = Flask(__name__)
+
+    def with_request(payload, content_type, read, parse):
+        """Requête POST complète: contexte Flask, lecture du corps et parsing"""
+        environ = EnvironBuilder(method='POST', data=payload, content_type=content_type).get_environ()
+
+        def run():
+            with app.request_context(dict(environ, **{'wsgi.input': io.BytesIO(payload)})):
+                return parse(read(request))
+        return run
+
+    raw = body + b'\0'     # WebRequest MT5 avec zéro terminal
+    new_parse = lambda d: validate(d, SIGNAL_SCHEMA)
+
+    print(f"Décodeur JSON: {'orjson' if schema.orjson else 'json'} - payload {len(body)} octets")
+    print()
+    print(f"{'Étape':<40}{'avant µs':>10}{'après µs':>10}{'gain':>8}")
+    rows = [
+        ('champs (dict déjà décodé)', lambda: legacy_parse_signal(data), lambda: new_parse(data)),
+        ('décodage JSON + champs', lambda: legacy_parse_signal(json.loads(body.decode())),
+         lambda: new_parse(schema._loads(body))),
+        ('requête Flask JSON', with_request(body, 'application/json', legacy_read, legacy_parse_signal),
+         with_request(body, 'application/json', read_payload, new_parse)),
+        ('requête Flask texte brut (MT5)', with_request(raw, 'text/plain', legacy_read, legacy_parse_signal),
+         with_request(raw, 'text/plain', read_payload, new_parse)),
+    ]
+    for label, before, after in rows:
+        _, before_us = measure(label, before, args.iterations)
+        _, after_us = measure(label, after, args.iterations)
+        print(f"{label:<40}{before_us:>10.2f}{after_us:>10.2f}{before_us / after_us:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
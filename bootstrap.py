@@ -0,0 +1,119 @@
+"""
+Crystal Heikin Ashi - État du dashboard
+Snapshot initial sérialisé une fois et partagé entre tous les dashboards (/api/bootstrap),
+puis diffusions Socket.IO des changements à la place du polling de chaque dashboard
+"""
+
+import json
+import os
+import threading
+import time
+
+from logs import get_logger
+
+log = get_logger('WS')
+
+# Durée de validité du snapshot partagé (secondes); reconstruit plus tôt si sa version change
+BOOTSTRAP_TTL = float(os.environ.get('BOOTSTRAP_TTL', 2))
+
+# Signaux de l'historique inclus dans le snapshot
+BOOTSTRAP_HISTORY = 50
+
+# Période de vérification des diffusions (secondes) et des statistiques
+PUSH_INTERVAL = float(os.environ.get('DASHBOARD_PUSH_INTERVAL', 1))
+STATS_PUSH_INTERVAL = float(os.environ.get('STATS_PUSH_INTERVAL', 5))
+
+
+class SnapshotCache:
+    """Réponse JSON construite au plus une fois par TTL et par version, quel que soit le nombre de clients"""
+
+    def __init__(self, build, ttl=BOOTSTRAP_TTL):
+        self.build = build
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._boot = os.urandom(4).hex()
+        self._entry = None      # (version, expiration, corps JSON, ETag)
+        self.stats = {'requests': 0, 'builds': 0}
+
+    def get(self, version=None, now=None):
+        """(corps JSON, ETag) du snapshot courant; un seul client le reconstruit, les autres attendent"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self.stats['requests'] += 1
+            entry = self._entry
+            if entry is None or entry[0] != version or entry[1] <= now:
+                self.stats['builds'] += 1
+                body = json.dumps(self.build(), separators=(',', ':'), ensure_ascii=False, default=str)
+                entry = self._entry = (version, now + self.ttl, body, f'"{self._boot}-{self.stats["builds"]}"')
+            return entry[2], entry[3]
+
+
+class PushSource:
+    """
+    Événement diffusé aux dashboards quand son contenu change.
+    version: compteur en mémoire vérifié avant de construire le payload (None: payload comparé au précédent)
+    """
+
+    __slots__ = ('event', 'build', 'version', 'interval', 'last_check', 'last_version', 'last_payload')
+
+    def __init__(self, event, build, version=None, interval=PUSH_INTERVAL):
+        self.event = event
+        self.build = build
+        self.version = version
+        self.interval = interval
+        self.last_check = float('-inf')
+        self.last_version = None
+        self.last_payload = None
+
+
+class DashboardPusher:
+    """Thread unique qui diffuse les changements (trades en attente, stats) à tous les dashboards à la fois"""
+
+    def __init__(self, send, sources, active=lambda: True, interval=PUSH_INTERVAL):
+        self.send = send            # send(événement, payload)
+        self.sources = sources
+        self.active = active        # au moins un dashboard connecté
+        self.interval = interval
+        self._thread = None
+        self.stats = {'pushed': 0}
+
+    def poll(self, now=None):
+        """Une vérification de toutes les sources; retourne les événements diffusés"""
+        now = time.monotonic() if now is None else now
+        if not self.active():
+            return []
+        pushed = []
+        for source in self.sources:
+            if now - source.last_check < source.interval:
+                continue
+            source.last_check = now
+            if source.version is not None:
+                version = source.version()
+                if version == source.last_version:
+                    continue
+                source.last_version = version
+            payload = source.build()
+            if source.version is None and payload == source.last_payload:
+                continue
+            source.last_payload = payload
+            self.send(source.event, payload)
+            pushed.append(source.event)
+        self.stats['pushed'] += len(pushed)
+        return pushed
+
+    def start(self):
+        """Lance la boucle de diffusion en arrière-plan"""
+        if self._thread is not None:
+            return self._thread
+
+        def loop():
+            while True:
+                try:
+                    self.poll()
+                except Exception as e:
+                    log.exception('dashboard push: %s', e)
+                time.sleep(self.interval)
+
+        self._thread = threading.Thread(target=loop, name='dashboard-push', daemon=True)
+        self._thread.start()
+        return self._thread
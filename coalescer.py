@@ -0,0 +1,153 @@
+"""
+Crystal Heikin Ashi - Coalescence des diffusions
+Limite la fréquence d'envoi des signaux par symbole (dernier état gagnant), sans retarder les changements importants
+"""
+
+from collections import deque
+import os
+import threading
+import time
+
+from logs import get_logger
+import metrics
+
+log = get_logger('WS')
+
+# Fréquence maximale de diffusion par symbole (Hz), 0 = pas de coalescence
+BROADCAST_MAX_HZ = float(os.environ.get('BROADCAST_MAX_HZ', 10))
+
+
+def is_priority(signal, last_final):
+    """Momentum shift ou changement de signal final: diffusé immédiatement"""
+    final = (signal.get('confluence') or {}).get('final_signal')
+    return bool(signal.get('momentum_shift')) or final != last_final
+
+
+class Coalescer:
+    """
+    Diffuse au plus `max_hz` fois par seconde et par symbole:
+    entre deux envois seul le dernier signal de chaque symbole/timeframe est conservé
+    """
+
+    def __init__(self, send, max_hz=BROADCAST_MAX_HZ):
+        self.send = send
+        self.interval = 1.0 / max_hz if max_hz > 0 else 0.0
+        self._cond = threading.Condition()
+        self._pending = {}      # (symbole, timeframe) -> dernier signal non diffusé
+        self._last_sent = {}    # symbole -> instant du dernier envoi
+        self._final = {}        # (symbole, timeframe) -> dernier signal final diffusé
+        self._outbox = deque()  # lots à émettre, dans l'ordre de leur sortie de la file
+        self._emitting = threading.Lock()
+        self._thread = None
+        self.stats = {'received': 0, 'sent': 0, 'priority': 0, 'coalesced': 0}
+
+    def submit(self, signals):
+        """Diffuse tout de suite ce qui peut l'être, met le reste en attente du prochain créneau"""
+        with self._cond:
+            self.stats['received'] += len(signals)
+            if self.interval:
+                self._schedule(signals)
+            else:
+                self._send(signals)
+        self._emit()
+
+    def _schedule(self, signals):
+        """Répartit un lot entre envoi immédiat et attente; à appeler sous self._cond"""
+        now = time.monotonic()
+        immediate = []
+        opened = set()
+        for signal in signals:
+            symbol = signal['symbol']
+            key = (symbol, signal['timeframe'])
+            if key not in self._final or is_priority(signal, self._final[key]):
+                self.stats['priority'] += 1
+            elif symbol not in opened and now - self._last_sent.get(symbol, -self.interval) < self.interval:
+                if key in self._pending:
+                    self._coalesced(1)
+                self._pending[key] = signal
+                continue
+            self._pending.pop(key, None)
+            opened.add(symbol)
+            immediate.append(signal)
+
+        # Un symbole diffusé emporte ses autres timeframes en attente
+        waiting = [key for key in self._pending if key[0] in opened]
+        immediate = [self._pending.pop(key) for key in waiting] + immediate
+        for symbol in opened:
+            self._last_sent[symbol] = now
+        if immediate:
+            self._send(immediate)
+        if self._pending:
+            self._start()
+            self._cond.notify()
+
+    def flush(self):
+        """Diffuse immédiatement tout ce qui est en attente (arrêt du serveur)"""
+        with self._cond:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            if pending:
+                self._send(pending)
+        self._emit(wait=True)
+
+    def _send(self, signals):
+        """Met un lot en sortie, sous le verrou: un signal en attente ne peut pas passer après un plus récent"""
+        for signal in signals:
+            self._final[(signal['symbol'], signal['timeframe'])] = (signal.get('confluence') or {}).get('final_signal')
+        self.stats['sent'] += len(signals)
+        self._outbox.append(signals)
+
+    def _emit(self, wait=False):
+        """
+        Émet les lots en sortie hors du verrou de la file, dans l'ordre: un seul thread émet à la fois,
+        les autres repartent aussitôt (leurs lots sont émis par celui qui tient le verrou d'émission)
+        """
+        while self._emitting.acquire(blocking=wait):
+            try:
+                while True:
+                    with self._cond:
+                        if not self._outbox:
+                            break
+                        signals = self._outbox.popleft()
+                    try:
+                        self.send(signals)
+                    except Exception as e:
+                        # Un emit en échec ne doit pas arrêter la diffusion des autres symboles
+                        log.exception('Diffusion: %s', e)
+            finally:
+                self._emitting.release()
+            # Lot ajouté entre la dernière lecture et la libération: le reprendre
+            with self._cond:
+                if not self._outbox:
+                    return
+
+    def _coalesced(self, count):
+        self.stats['coalesced'] += count
+        if metrics.METRICS_ENABLED:
+            metrics.SIGNALS_COALESCED.inc(count)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='broadcast-coalescer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        """Envoie les signaux en attente à l'ouverture du créneau de leur symbole"""
+        while True:
+            with self._cond:
+                while True:
+                    if not self._pending:
+                        self._cond.wait()
+                        continue
+                    now = time.monotonic()
+                    due = min(self._last_sent.get(symbol, now) + self.interval for symbol, _ in self._pending)
+                    if due > now:
+                        self._cond.wait(due - now)
+                        continue
+                    break
+                ready = [key for key in self._pending if self._last_sent.get(key[0], now) + self.interval <= now]
+                signals = [self._pending.pop(key) for key in ready]
+                for symbol, _ in ready:
+                    self._last_sent[symbol] = now
+                self._send(signals)
+            self._emit()
@@ -0,0 +1,306 @@
+"""
+Crystal Heikin Ashi - Moteur de confluence
+Score des indicateurs piloté par une table déclarative (chemin scalaire + chemin NumPy)
+"""
+
+import numpy as np
+
+# ============================================
+# TABLE DES INDICATEURS
+# ============================================
+# Types de règles:
+#   direction : champ BULLISH/BEARISH, toujours compté (NEUTRAL sinon)
+#   pattern   : comme direction, mais un motif non directionnel est affiché DETECTED
+#   optional  : compté seulement si BULLISH/BEARISH
+#   midpoint  : bid comparé au milieu de (support, résistance) si les deux sont > 0
+#   level     : bid comparé à un niveau si > 0
+#   momentum  : bonus sur la tendance Heikin Ashi, non compté dans le total
+
+INDICATORS = [
+    {'name': 'Heikin Ashi', 'rule': 'direction', 'fields': ('trend',), 'weight': 1},
+    {'name': 'Super Trend', 'rule': 'direction', 'fields': ('supertrend_direction',), 'weight': 1},
+    {'name': 'Harmonic', 'rule': 'pattern', 'fields': ('harmonic_pattern',), 'weight': 1},
+    {'name': 'Zone Position', 'rule': 'midpoint', 'fields': ('support', 'resistance'), 'weight': 1},
+    {'name': 'VWAP', 'rule': 'level', 'fields': ('vwap',), 'weight': 1},
+    {'name': 'Momentum Shift', 'rule': 'momentum', 'fields': ('momentum_shift', 'trend'), 'weight': 0.5},
+    {'name': 'Candle Pattern', 'rule': 'optional', 'fields': ('candle_pattern',), 'weight': 1},
+    {'name': 'Bollinger RSI', 'rule': 'optional', 'fields': ('bollinger_direction',), 'weight': 1},
+    {'name': 'FVG', 'rule': 'optional', 'fields': ('fvg_type',), 'weight': 1},
+    {'name': 'MACD', 'rule': 'optional', 'fields': ('macd_trend',), 'weight': 1},
+    {'name': 'Pro S/R', 'rule': 'midpoint', 'fields': ('pro_support', 'pro_resistance'), 'weight': 1},
+    {'name': 'MTF Alignment', 'rule': 'optional', 'fields': ('mtf_trend',), 'weight': 1},
+]
+
+# Valeurs par défaut des champs quand ils sont absents (identiques à parse_signal)
+FIELD_DEFAULTS = {
+    'trend': 'NEUTRAL',
+    'supertrend_direction': 'NEUTRAL',
+    'harmonic_pattern': 'NONE',
+    'candle_pattern': 'NONE',
+    'bollinger_direction': 'NEUTRAL',
+    'fvg_type': 'NONE',
+    'macd_trend': 'NEUTRAL',
+    'mtf_trend': 'NEUTRAL',
+}
+
+# Seuils du signal final, évalués dans l'ordre
+FINAL_SIGNALS = ['NEUTRAL', 'STRONG_BUY', 'BUY', 'STRONG_SELL', 'SELL']
+STRONG_THRESHOLD = 80
+THRESHOLD = 60
+
+# Détails d'indicateurs pré-construits une fois (partagés, ne pas modifier)
+_DETAILS = {
+    (ind['name'], sig): {'name': ind['name'], 'signal': sig, 'weight': ind['weight']}
+    for ind in INDICATORS
+    for sig in ('BULLISH', 'BEARISH', 'NEUTRAL', 'DETECTED')
+}
+
+
+def _field_names():
+    """Liste des champs lus par la table (bid inclus)"""
+    names = ['bid']
+    for ind in INDICATORS:
+        for field in ind['fields']:
+            if field not in names:
+                names.append(field)
+    return names
+
+FIELDS = _field_names()
+
+
+def final_signal_for(bullish_score, bearish_score):
+    """Détermine le signal final à partir des scores en %"""
+    if bullish_score >= STRONG_THRESHOLD:
+        return 'STRONG_BUY'
+    elif bullish_score >= THRESHOLD:
+        return 'BUY'
+    elif bearish_score >= STRONG_THRESHOLD:
+        return 'STRONG_SELL'
+    elif bearish_score >= THRESHOLD:
+        return 'SELL'
+    return 'NEUTRAL'
+
+# ============================================
+# CHEMIN SCALAIRE (signaux live)
+# ============================================
+
+def compute_confluence(signal):
+    """Calcule le score de confluence des indicateurs d'un signal"""
+    bullish_count = 0
+    bearish_count = 0
+    total_indicators = 0
+    indicator_details = []
+    bid = signal['bid']
+
+    for ind in INDICATORS:
+        rule = ind['rule']
+        name = ind['name']
+        weight = ind['weight']
+        direction = None
+
+        if rule == 'direction' or rule == 'pattern':
+            value = signal[ind['fields'][0]]
+            if value == 'BULLISH' or value == 'BEARISH':
+                direction = value
+            elif rule == 'direction':
+                indicator_details.append(_DETAILS[(name, 'NEUTRAL')])
+            elif value not in ('NONE', ''):
+                indicator_details.append(_DETAILS[(name, 'DETECTED')])
+            total_indicators += 1
+
+        elif rule == 'optional':
+            value = signal[ind['fields'][0]]
+            if value == 'BULLISH' or value == 'BEARISH':
+                direction = value
+                total_indicators += 1
+
+        elif rule == 'midpoint':
+            low = signal[ind['fields'][0]]
+            high = signal[ind['fields'][1]]
+            if low > 0 and high > 0 and bid > 0:
+                direction = 'BULLISH' if bid > (low + high) / 2 else 'BEARISH'
+                total_indicators += 1
+
+        elif rule == 'level':
+            level = signal[ind['fields'][0]]
+            if level > 0 and bid > 0:
+                direction = 'BULLISH' if bid > level else 'BEARISH'
+                total_indicators += 1
+
+        elif rule == 'momentum':
+            if signal[ind['fields'][0]]:
+                trend = signal[ind['fields'][1]]
+                if trend == 'BULLISH':
+                    bullish_count += weight
+                elif trend == 'BEARISH':
+                    bearish_count += weight
+                detail = _DETAILS.get((name, trend))
+                indicator_details.append(detail or {'name': name, 'signal': trend, 'weight': weight})
+            continue
+
+        if direction == 'BULLISH':
+            bullish_count += weight
+            indicator_details.append(_DETAILS[(name, 'BULLISH')])
+        elif direction == 'BEARISH':
+            bearish_count += weight
+            indicator_details.append(_DETAILS[(name, 'BEARISH')])
+
+    # Calculer le score
+    if total_indicators > 0:
+        bullish_score = (bullish_count / total_indicators) * 100
+        bearish_score = (bearish_count / total_indicators) * 100
+    else:
+        bullish_score = 0
+        bearish_score = 0
+
+    return {
+        'bullish_score': round(bullish_score, 1),
+        'bearish_score': round(bearish_score, 1),
+        'total_indicators': total_indicators,
+        'bullish_count': bullish_count,
+        'bearish_count': bearish_count,
+        'final_signal': final_signal_for(bullish_score, bearish_score),
+        'indicators': indicator_details
+    }
+
+# ============================================
+# CHEMIN VECTORISÉ (historique, backtest)
+# ============================================
+
+def columns_from_signals(signals):
+    """Convertit une liste de signaux (dicts ou sqlite3.Row) en colonnes NumPy"""
+    n = len(signals)
+    keys = set(signals[0].keys()) if n else set()
+    columns = {}
+    for field in FIELDS:
+        if field in FIELD_DEFAULTS:
+            default = FIELD_DEFAULTS[field]
+            if field in keys:
+                values = [default if s[field] is None else s[field] for s in signals]
+            else:
+                values = [default] * n
+            columns[field] = np.array(values, dtype=str)
+        else:
+            if field in keys:
+                values = [s[field] or 0 for s in signals]
+            else:
+                values = [0] * n
+            columns[field] = np.array(values, dtype=np.float64)
+    return columns
+
+
+def score_batch(columns, weights=None, strong_threshold=STRONG_THRESHOLD, threshold=THRESHOLD):
+    """
+    Score vectorisé de N signaux en un seul appel.
+    columns: dict champ -> tableau NumPy (voir columns_from_signals).
+    weights: poids par nom d'indicateur remplaçant ceux de la table (backtest).
+    Retourne des tableaux: bullish_count, bearish_count, total_indicators,
+    bullish_score, bearish_score (non arrondis) et final_code (index dans FINAL_SIGNALS).
+    """
+    n = len(columns['bid'])
+    bullish = np.zeros(n, dtype=np.float64)
+    bearish = np.zeros(n, dtype=np.float64)
+    total = np.zeros(n, dtype=np.int64)
+    bid = columns['bid']
+
+    for ind in INDICATORS:
+        rule = ind['rule']
+        weight = ind['weight'] if weights is None else weights.get(ind['name'], ind['weight'])
+
+        if rule == 'direction' or rule == 'pattern':
+            value = columns[ind['fields'][0]]
+            bullish += weight * (value == 'BULLISH')
+            bearish += weight * (value == 'BEARISH')
+            total += 1
+
+        elif rule == 'optional':
+            value = columns[ind['fields'][0]]
+            is_bull = value == 'BULLISH'
+            is_bear = value == 'BEARISH'
+            bullish += weight * is_bull
+            bearish += weight * is_bear
+            total += is_bull | is_bear
+
+        elif rule == 'midpoint':
+            low = columns[ind['fields'][0]]
+            high = columns[ind['fields'][1]]
+            active = (low > 0) & (high > 0) & (bid > 0)
+            is_bull = bid > (low + high) / 2
+            bullish += weight * (active & is_bull)
+            bearish += weight * (active & ~is_bull)
+            total += active
+
+        elif rule == 'level':
+            level = columns[ind['fields'][0]]
+            active = (level > 0) & (bid > 0)
+            is_bull = bid > level
+            bullish += weight * (active & is_bull)
+            bearish += weight * (active & ~is_bull)
+            total += active
+
+        elif rule == 'momentum':
+            shift = columns[ind['fields'][0]] != 0
+            trend = columns[ind['fields'][1]]
+            bullish += weight * (shift & (trend == 'BULLISH'))
+            bearish += weight * (shift & (trend == 'BEARISH'))
+
+    # Calculer le score (mêmes opérations flottantes que le chemin scalaire)
+    safe_total = np.where(total > 0, total, 1)
+    bullish_score = np.where(total > 0, (bullish / safe_total) * 100, 0.0)
+    bearish_score = np.where(total > 0, (bearish / safe_total) * 100, 0.0)
+
+    # Déterminer le signal final (le premier seuil atteint l'emporte)
+    final_code = np.select(
+        [bullish_score >= strong_threshold, bullish_score >= threshold,
+         bearish_score >= strong_threshold, bearish_score >= threshold],
+        [1, 2, 3, 4], default=0)
+
+    return {
+        'bullish_count': bullish,
+        'bearish_count': bearish,
+        'total_indicators': total,
+        'bullish_score': bullish_score,
+        'bearish_score': bearish_score,
+        'final_code': final_code,
+    }
+
+
+def score_signals(signals):
+    """Score une liste de signaux stockés et retourne la liste des signaux finaux"""
+    if not signals:
+        return []
+    result = score_batch(columns_from_signals(signals))
+    labels = np.array(FINAL_SIGNALS)
+    return labels[result['final_code']].tolist()
+
+
+if __name__ == '__main__':
+    # Re-score de tout l'historique et vérification contre le chemin scalaire
+    import sqlite3
+    import time
+    from collections import Counter
+
+    conn = sqlite3.connect('signals.db')
+    conn.row_factory = sqlite3.Row
+    rows = conn.execute('SELECT * FROM signals').fetchall()
+    conn.close()
+
+    # Directions stockées en entiers depuis la migration 3
+    from signal_store import decode_row
+    rows = [decode_row(row) for row in rows]
+
+    start = time.perf_counter()
+    columns = columns_from_signals(rows)
+    batch = score_batch(columns)
+    elapsed = time.perf_counter() - start
+    labels = np.array(FINAL_SIGNALS)[batch['final_code']]
+
+    mismatches = 0
+    for i, row in enumerate(rows):
+        signal = {field: columns[field][i].item() for field in FIELDS}
+        if compute_confluence(signal)['final_signal'] != labels[i]:
+            mismatches += 1
+
+    print(f"{len(rows)} signaux re-scorés en {elapsed * 1000:.1f} ms")
+    print(f"Écarts scalaire/vectorisé: {mismatches}")
+    print(dict(Counter(labels.tolist())))
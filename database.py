@@ -0,0 +1,378 @@
+"""
+Crystal Heikin Ashi - Accès SQLite
+Connexions de lecture réutilisées (WAL) et écrivain unique avec group commit
+En mode asynchrone (server.py), les appels SQLite s'exécutent dans un pool de threads natifs
+"""
+
+from concurrent.futures import Future
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+from migrations import migrate
+
+# Base de données pour stocker l'historique des signaux
+DB_PATH = 'signals.db'
+
+# Pragmas appliqués à chaque connexion
+PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',      # sûr en WAL, un seul fsync par checkpoint
+    'PRAGMA busy_timeout = 5000',
+    'PRAGMA cache_size = -16000',       # 16 Mo
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA mmap_size = 268435456',     # 256 Mo
+)
+
+# Écrivain: fenêtre de group commit, taille max d'un lot et de la file
+COMMIT_INTERVAL = 0.005
+MAX_BATCH = 500
+MAX_QUEUE = 5000
+SUBMIT_TIMEOUT = 0.5
+WRITE_TIMEOUT = 10
+
+# Connexions de lecture inactives conservées dans le pool
+MAX_IDLE_READERS = 16
+
+
+class WriterOverloaded(Exception):
+    """La file d'écriture est pleine (backpressure)"""
+
+
+# Appelés (thread de l'écrivain) après l'annulation d'une écriture ou d'un lot: caches d'écriture à invalider
+_rollback_hooks = []
+
+
+def on_rollback(hook):
+    """Enregistre hook() à appeler après chaque ROLLBACK de l'écrivain"""
+    _rollback_hooks.append(hook)
+
+
+def _rolled_back():
+    for hook in _rollback_hooks:
+        hook()
+
+
+# ============================================
+# APPELS BLOQUANTS - hors de la boucle d'événements
+# ============================================
+
+# Exécuteur natif installé par server.py (eventlet tpool / threadpool gevent); None = appel direct
+_offload = None
+
+
+def set_offload(executor):
+    """Installe l'exécuteur des appels bloquants: executor(fn, *args) -> résultat"""
+    global _offload
+    _offload = executor
+
+
+def run_blocking(fn, *args):
+    """Exécute fn dans un thread natif en mode asynchrone (directement sinon)"""
+    if _offload is None:
+        return fn(*args)
+    return _offload(fn, *args)
+
+
+class OffloadedCursor:
+    """Curseur dont les exécutions et lectures passent par run_blocking"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, *args):
+        run_blocking(self._cursor.execute, *args)
+        return self
+
+    def executemany(self, *args):
+        run_blocking(self._cursor.executemany, *args)
+        return self
+
+    def fetchone(self):
+        return run_blocking(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return run_blocking(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return run_blocking(self._cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class OffloadedConnection:
+    """Connexion de lecture du mode asynchrone (close() reste dans le thread appelant)"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return OffloadedCursor(self._conn.cursor())
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def commit(self):
+        run_blocking(self._conn.commit)
+
+    def close(self):
+        self._conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _connect(factory=sqlite3.Connection):
+    """Ouvre une connexion configurée"""
+    conn = sqlite3.connect(DB_PATH, factory=factory, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def init_db():
+    """Initialise la base de données SQLite (migrations versionnées)"""
+    conn = _connect()
+    conn.execute('PRAGMA journal_mode = WAL')
+    migrate(conn)
+    conn.close()
+
+# ============================================
+# LECTURES - pool de connexions
+# ============================================
+
+_readers = queue.LifoQueue()
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connexion de lecture: close() la rend au pool au lieu de la fermer"""
+
+    def close(self):
+        if _readers.qsize() < MAX_IDLE_READERS:
+            _readers.put(self)
+        else:
+            super().close()
+
+
+def get_db():
+    """Connexion de lecture (réutilisée, lecture seule)"""
+    try:
+        conn = _readers.get_nowait()
+    except queue.Empty:
+        conn = _connect(PooledConnection)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA query_only = ON')
+    return conn if _offload is None else OffloadedConnection(conn)
+
+
+def close_readers():
+    """Ferme les connexions de lecture inactives"""
+    while True:
+        try:
+            sqlite3.Connection.close(_readers.get_nowait())
+        except queue.Empty:
+            return
+
+# ============================================
+# ÉCRITURES - écrivain unique avec group commit
+# ============================================
+
+class DBWriter(threading.Thread):
+    """Thread unique qui exécute les écritures en file et les valide par lots"""
+
+    def __init__(self):
+        super().__init__(name='db-writer', daemon=True)
+        self.queue = queue.Queue(maxsize=MAX_QUEUE)
+        self.stats = {
+            'submitted': 0,
+            'committed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'batches': 0,
+            'max_batch': 0,
+            'max_queue': 0,
+            'last_commit_ms': 0.0,
+        }
+        self._stopping = False
+        self._stats_lock = threading.Lock()
+
+    def submit(self, fn):
+        """Met une écriture en file; fn(cursor) est exécutée dans la transaction du lot"""
+        if self._stopping:
+            raise WriterOverloaded("Écrivain arrêté")
+        future = Future()
+        try:
+            self.queue.put((fn, future, time.perf_counter()), timeout=SUBMIT_TIMEOUT)
+        except queue.Full:
+            with self._stats_lock:
+                self.stats['rejected'] += 1
+            raise WriterOverloaded(f"File d'écriture pleine ({MAX_QUEUE})")
+        with self._stats_lock:
+            self.stats['submitted'] += 1
+            self.stats['max_queue'] = max(self.stats['max_queue'], self.queue.qsize())
+        return future
+
+    def stop(self, timeout=None):
+        """Arrête l'écrivain après avoir vidé la file (plus aucune écriture acceptée)"""
+        self._stopping = True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # File pleine: elle ne fait plus que se vider, réessayer jusqu'à l'échéance
+        while True:
+            try:
+                self.queue.put(None, timeout=SUBMIT_TIMEOUT)
+                break
+            except queue.Full:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return
+        self.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def run(self):
+        conn = _connect()
+        conn.isolation_level = None
+        running = True
+        while running:
+            item = self.queue.get()
+            if item is None:
+                break
+            batch = [item]
+
+            # Regrouper les écritures arrivées pendant la fenêtre
+            deadline = time.monotonic() + COMMIT_INTERVAL
+            while len(batch) < MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+
+            self._commit(conn, batch)
+        conn.close()
+
+        # Écritures mises en file pendant l'arrêt: refusées plutôt que laissées sans réponse
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].set_exception(WriterOverloaded("Écrivain arrêté"))
+
+    def _commit(self, conn, batch):
+        """Exécute un lot (hors de la boucle d'événements) puis résout les futures"""
+        start = time.perf_counter()
+        for fn, future, submitted in batch:
+            metrics.DB_QUEUE_WAIT.observe(start - submitted)
+        results, error, lock_wait = run_blocking(self._execute, conn, batch)
+        if error is not None:
+            self.stats['failed'] += len(batch)
+            for fn, future, submitted in batch:
+                future.set_exception(error)
+            return
+
+        self.stats['batches'] += 1
+        self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+        self.stats['last_commit_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        metrics.DB_LOCK_WAIT.observe(lock_wait)
+        metrics.DB_COMMIT.observe(time.perf_counter() - start)
+        metrics.DB_BATCH_SIZE.observe(len(batch))
+        for future, result, error in results:
+            if error is None:
+                self.stats['committed'] += 1
+                future.set_result(result)
+            else:
+                self.stats['failed'] += 1
+                future.set_exception(error)
+
+    @staticmethod
+    def _execute(conn, batch):
+        """Transaction du lot, chaque écriture dans son savepoint (SQLite uniquement, aucun verrou Python)"""
+        results = []
+        c = conn.cursor()
+        try:
+            start = time.perf_counter()
+            c.execute('BEGIN IMMEDIATE')
+            locked = time.perf_counter()
+            for fn, future, submitted in batch:
+                c.execute('SAVEPOINT item')
+                try:
+                    results.append((future, fn(c), None))
+                    c.execute('RELEASE item')
+                except Exception as e:
+                    c.execute('ROLLBACK TO item')
+                    c.execute('RELEASE item')
+                    _rolled_back()
+                    results.append((future, None, e))
+            c.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            _rolled_back()
+            return None, e, None
+        return results, None, locked - start
+
+
+_writer = None
+_writer_lock = threading.Lock()
+_stopped = False
+
+
+def get_writer():
+    """Écrivain unique du processus (démarré à la première écriture)"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _stopped:
+                raise WriterOverloaded("Écrivain arrêté")
+            if _writer is None:
+                _writer = DBWriter()
+                _writer.start()
+    return _writer
+
+
+def db_write(fn, timeout=WRITE_TIMEOUT):
+    """Exécute fn(cursor) via l'écrivain et attend le commit du lot"""
+    return get_writer().submit(fn).result(timeout)
+
+
+def stop_writer(timeout=None):
+    """Vide la file d'écriture et arrête l'écrivain; les écritures suivantes sont refusées (WriterOverloaded)"""
+    global _writer, _stopped
+    with _writer_lock:
+        _stopped = True
+        if _writer is not None:
+            _writer.stop(timeout)
+            _writer = None
+
+
+def writer_stats():
+    """Statistiques de l'écrivain et de la file (backpressure)"""
+    writer = _writer
+    if writer is None:
+        return {'running': False, 'queue_size': 0, 'queue_capacity': MAX_QUEUE}
+    stats = dict(writer.stats)
+    stats.update({
+        'running': writer.is_alive(),
+        'queue_size': writer.queue.qsize(),
+        'queue_capacity': MAX_QUEUE,
+        'avg_batch': round(stats['committed'] / stats['batches'], 2) if stats['batches'] else 0,
+    })
+    return stats
+
+
+atexit.register(stop_writer, 5)
+
+metrics.Gauge('crystal_db_write_queue_size', "Écritures en attente dans la file de l'écrivain",
+              collect=lambda: _writer.queue.qsize() if _writer is not None else 0)
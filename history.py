@@ -0,0 +1,181 @@
+"""
+Crystal Heikin Ashi - Historique des signaux
+Filtres (symbole, timeframe, tendance, plage de temps), pagination par curseur sur (created_at, id)
+et export en flux NDJSON/CSV (SQLite puis archives) à mémoire constante
+"""
+
+import base64
+import calendar
+import csv
+from datetime import datetime, timezone
+import io
+import json
+import math
+
+from retention import iter_archived
+from signal_store import COLUMNS, CONFLUENCE_FIELDS, decode_row
+
+# Taille maximale d'une page et des lectures en flux
+MAX_PAGE = 1000
+FETCH_SIZE = 1000
+
+# Colonnes de l'export CSV (confluence à plat)
+EXPORT_FIELDS = ('id', 'created_at') + COLUMNS + ('bar_time', 'revision', 'updates')
+
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M', '%Y-%m-%d')
+
+# Plus grand epoch convertible en created_at (9999-12-31 23:59:59 UTC)
+MAX_EPOCH = 253402300799
+
+
+def parse_time(value):
+    """Epoch ou date ISO (UTC, comme created_at) -> epoch; ValueError si illisible ou hors plage (inf, nan)"""
+    try:
+        epoch = float(value)
+    except ValueError:
+        epoch = None
+        for fmt in TIME_FORMATS:
+            try:
+                epoch = calendar.timegm(datetime.strptime(value.rstrip('Z'), fmt).timetuple())
+                break
+            except ValueError:
+                continue
+    # Avant 1970, datetime.fromtimestamp échoue sous Windows (OSError): même plage pour les dates ISO
+    if epoch is None or not math.isfinite(epoch) or not 0 <= epoch <= MAX_EPOCH:
+        raise ValueError(f'date invalide: {value}')
+    return epoch
+
+
+def created_at(epoch):
+    """Epoch -> format de la colonne created_at (CURRENT_TIMESTAMP, UTC)"""
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def encode_cursor(signal):
+    """Curseur opaque de la clé (created_at, id) d'un signal"""
+    return base64.urlsafe_b64encode(f"{signal['created_at']}|{signal['id']}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Curseur -> (created_at, id); ValueError si invalide"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        stamp, _, row_id = raw.rpartition('|')
+        return stamp, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('curseur invalide')
+
+
+class HistoryQuery:
+    """Filtres d'une requête d'historique (paramètres symbol, timeframe, trend, from, to)"""
+
+    def __init__(self, symbol=None, timeframe=None, trend=None, start=None, end=None):
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.trend = trend
+        self.start = start      # epoch inclus
+        self.end = end          # epoch exclu
+
+    @classmethod
+    def from_args(cls, args):
+        """Depuis request.args; ValueError si une date est invalide"""
+        start, end = args.get('from'), args.get('to')
+        return cls(symbol=args.get('symbol') or None, timeframe=args.get('timeframe') or None,
+                   trend=args.get('trend') or None,
+                   start=parse_time(start) if start else None, end=parse_time(end) if end else None)
+
+    def where(self, after=None, before=None):
+        """Clause WHERE et paramètres; after/before: clé (created_at, id) exclue"""
+        clauses, params = [], []
+        for column, value in (('symbol', self.symbol), ('timeframe', self.timeframe), ('trend', self.trend)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                params.append(value)
+        if self.start is not None:
+            clauses.append('created_at >= ?')
+            params.append(created_at(self.start))
+        if self.end is not None:
+            clauses.append('created_at < ?')
+            params.append(created_at(self.end))
+        if after is not None:
+            clauses.append('(created_at, id) > (?, ?)')
+            params += after
+        if before is not None:
+            clauses.append('(created_at, id) < (?, ?)')
+            params += before
+        return ('WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def archived(self, descending, key=None):
+        """Signaux archivés correspondant aux filtres, après/avant la clé (created_at, id)"""
+        bound = (parse_time(key[0]), key[1]) if key else None
+        return iter_archived(self.symbol, self.timeframe, self.trend, self.start, self.end,
+                             after=None if descending else bound, before=bound if descending else None,
+                             descending=descending)
+
+
+def page(conn, query, cursor=None, limit=100):
+    """Page du plus récent au plus ancien: (signaux, curseur suivant ou None); SQLite puis archives"""
+    limit = max(1, min(limit, MAX_PAGE))
+    before = decode_cursor(cursor) if cursor else None
+    where, params = query.where(before=before)
+    rows = conn.execute(f'''
+        SELECT * FROM signals {where} ORDER BY created_at DESC, id DESC LIMIT ?
+    ''', (*params, limit + 1)).fetchall()
+    signals = [decode_row(row) for row in rows[:limit]]
+
+    # Base épuisée pour ces filtres: suite dans les archives (jours plus anciens que toute ligne SQLite)
+    if len(rows) <= limit:
+        key = (signals[-1]['created_at'], signals[-1]['id']) if signals else before
+        for signal in query.archived(descending=True, key=key):
+            signals.append(signal)
+            if len(signals) > limit:
+                break
+
+    more = len(signals) > limit or len(rows) > limit
+    signals = signals[:limit]
+    return signals, encode_cursor(signals[-1]) if more and signals else None
+
+
+def iter_signals(conn, query, cursor=None):
+    """Tous les signaux filtrés, du plus ancien au plus récent: archives puis SQLite par paquets (fetchmany)"""
+    after = decode_cursor(cursor) if cursor else None
+    yield from query.archived(descending=False, key=after)
+    where, params = query.where(after=after)
+    c = conn.execute(f'SELECT * FROM signals {where} ORDER BY created_at, id', params)
+    while True:
+        rows = c.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        for row in rows:
+            yield decode_row(row)
+
+
+def flatten(signal):
+    """Signal décodé -> dict à plat (confluence dépliée) pour l'export CSV"""
+    flat = dict(signal)
+    confluence = flat.pop('confluence', None) or {}
+    for field in CONFLUENCE_FIELDS:
+        flat[field] = confluence.get(field)
+    return flat
+
+
+def to_ndjson(signals):
+    """Une ligne JSON par signal"""
+    for signal in signals:
+        yield json.dumps(signal, separators=(',', ':'), ensure_ascii=False) + '\n'
+
+
+def to_csv(signals, chunk=FETCH_SIZE):
+    """En-tête puis lignes CSV, émises par paquets"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for signal in signals:
+        writer.writerow(flatten(signal))
+        count += 1
+        if count % chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,97 @@
+"""
+Crystal Heikin Ashi - Requêtes idempotentes
+Réponses récentes par clé d'idempotence: une requête rejouée par l'EA (timeout WebRequest) n'est traitée qu'une fois
+"""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+
+# Durée de mémorisation d'une réponse (secondes) et nombre maximal de clés
+IDEMPOTENCY_TTL = float(os.environ.get('IDEMPOTENCY_TTL', 600))
+IDEMPOTENCY_MAX_KEYS = 10000
+
+# Attente maximale d'un doublon reçu pendant le traitement de l'original (secondes, puis 409)
+IDEMPOTENCY_WAIT = float(os.environ.get('IDEMPOTENCY_WAIT', 5))
+
+
+class RequestInFlight(Exception):
+    """La requête originale de cette clé est toujours en cours de traitement"""
+
+
+class ResponseCache:
+    """Réponse (payload, code HTTP) de chaque clé déjà traitée, LRU avec expiration, et clés en cours"""
+
+    def __init__(self, ttl=IDEMPOTENCY_TTL, max_keys=IDEMPOTENCY_MAX_KEYS, wait=IDEMPOTENCY_WAIT):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._responses = OrderedDict()     # clé -> (expiration, payload, code)
+        self._in_flight = set()
+        self.replayed = 0
+
+    def _stored(self, key, now):
+        entry = self._responses.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        self.replayed += 1
+        return entry[1], entry[2]
+
+    def get(self, key, now=None):
+        """Réponse déjà envoyée pour cette clé, None si inconnue ou expirée"""
+        if not key:
+            return None
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return self._stored(key, now)
+
+    def begin(self, key):
+        """
+        Réserve la clé avant le traitement: None si l'appelant doit traiter la requête (puis put() ou release()),
+        sinon la réponse mémorisée. Un doublon concurrent attend la réponse de l'original, RequestInFlight au-delà
+        """
+        if not key:
+            return None
+        deadline = time.monotonic() + self.wait
+        with self._lock:
+            while True:
+                response = self._stored(key, time.monotonic())
+                if response is not None:
+                    return response
+                if key not in self._in_flight:
+                    self._in_flight.add(key)
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise RequestInFlight(f'requête {key} en cours de traitement')
+                self._done.wait(remaining)
+
+    def release(self, key):
+        """Libère une clé réservée sans réponse mémorisée (échec): le prochain envoi sera traité"""
+        if not key:
+            return
+        with self._lock:
+            if key in self._in_flight:
+                self._in_flight.discard(key)
+                self._done.notify_all()
+
+    def put(self, key, payload, status=200, now=None):
+        """Mémorise la réponse d'une requête traitée"""
+        if not key:
+            return
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._in_flight.discard(key)
+            self._done.notify_all()
+            self._responses[key] = (now + self.ttl, payload, status)
+            self._responses.move_to_end(key)
+            while self._responses and (len(self._responses) > self.max_keys
+                                       or next(iter(self._responses.values()))[0] <= now):
+                self._responses.popitem(last=False)
+
+
+# Réponses des routes d'ingestion des signaux
+signal_responses = ResponseCache()
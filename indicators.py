@@ -0,0 +1,331 @@
+"""
+Crystal Heikin Ashi - Moteur d'indicateurs incrémental
+VWAP + bandes, SuperTrend, MACD, Bollinger/RSI et POC calculés côté serveur à partir du flux bid,
+en O(1) par mise à jour (tampons circulaires array), pour compléter les indicateurs absents avant la confluence
+"""
+
+from array import array
+import math
+import os
+import threading
+import time
+
+from retention import timeframe_seconds
+
+INDICATORS_ENABLED = os.environ.get('INDICATORS_ENABLED', '1') != '0'
+
+# Paramètres (valeurs usuelles MT5)
+VWAP_BAND = 1.0             # bandes à ±1 écart-type pondéré
+VWAP_MIN_SAMPLES = 10       # prix de la session avant de publier le VWAP (au premier tick vwap == bid)
+SUPERTREND_PERIOD = 10
+SUPERTREND_MULTIPLIER = 3.0
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+BOLLINGER_PERIOD, BOLLINGER_DEVIATION = 20, 2.0
+RSI_PERIOD = 14
+POC_BARS = 50               # fenêtre du profil de volume (bougies)
+POC_BIN_BPS = 5             # largeur d'un niveau de prix du profil (points de base du premier prix)
+
+# Historique rejoué au démarrage pour amorcer les indicateurs
+WARMUP_HOURS = int(os.environ.get('INDICATOR_WARMUP_HOURS', 48))
+
+
+class RingBuffer:
+    """Tampon circulaire de flottants de taille fixe (array), somme et somme des carrés tenues à jour"""
+
+    __slots__ = ('values', 'size', 'count', 'index', 'total', 'squares')
+
+    def __init__(self, size):
+        self.values = array('d', bytes(8 * size))
+        self.size = size
+        self.count = 0
+        self.index = 0
+        self.total = 0.0
+        self.squares = 0.0
+
+    def push(self, value):
+        """Ajoute une valeur (la plus ancienne sort quand le tampon est plein)"""
+        if self.count == self.size:
+            old = self.values[self.index]
+            self.total -= old
+            self.squares -= old * old
+        else:
+            self.count += 1
+        self.values[self.index] = value
+        self.index = (self.index + 1) % self.size
+        self.total += value
+        self.squares += value * value
+
+
+class IndicatorState:
+    """État incrémental d'un flux (symbole, timeframe): bougies OHLC du bid, indicateurs des bougies closes"""
+
+    def __init__(self, bar_seconds):
+        self.bar_seconds = bar_seconds
+        self.bar_time = None
+        self.open = self.high = self.low = self.close = 0.0
+        self.bars = 0                   # bougies closes
+
+        # VWAP de session (jour UTC), pondéré par tick
+        self.session = None
+        self.vwap_weight = self.vwap_sum = self.vwap_squares = 0.0
+
+        # SuperTrend (ATR de Wilder) sur les bougies closes
+        self.prev_close = None
+        self.atr = 0.0
+        self.st_upper = self.st_lower = 0.0
+        self.st_bullish = True
+
+        # MACD (EMA des clôtures), RSI (Wilder)
+        self.ema_fast = self.ema_slow = self.macd_signal = 0.0
+        self.avg_gain = self.avg_loss = 0.0
+
+        # Bollinger: clôtures des period - 1 dernières bougies, bandes de la dernière bougie close
+        self.closes = RingBuffer(BOLLINGER_PERIOD - 1)
+        self.bb_upper = self.bb_lower = 0.0
+
+        # Profil de volume: ticks par niveau sur POC_BARS bougies (niveaux de chaque bougie pour l'éviction)
+        self.bin_size = 0.0
+        self.profile = {}
+        self.bar_profiles = [None] * POC_BARS
+        self.bar_profile = {}
+        self.poc_bin = None
+
+    # ---------- mise à jour par tick ----------
+
+    def update(self, price, bar_time):
+        """Nouveau prix (bid) dans la bougie bar_time; une nouvelle bougie clôt la précédente"""
+        if bar_time != self.bar_time:
+            if self.bar_time is not None:
+                if bar_time < self.bar_time:
+                    return False    # bougie passée (envoi en retard): ignorée
+                self._close_bar()
+            self.bar_time = bar_time
+            self.open = self.high = self.low = price
+            session = int(bar_time // 86400)
+            if session != self.session:
+                self.session = session
+                self.vwap_weight = self.vwap_sum = self.vwap_squares = 0.0
+        self.high = max(self.high, price)
+        self.low = min(self.low, price)
+        self.close = price
+
+        self.vwap_weight += 1.0
+        self.vwap_sum += price
+        self.vwap_squares += price * price
+
+        if not self.bin_size:
+            self.bin_size = price * POC_BIN_BPS / 10000.0
+        level = int(price // self.bin_size)
+        self.bar_profile[level] = self.bar_profile.get(level, 0) + 1
+        volume = self.profile.get(level, 0) + 1
+        self.profile[level] = volume
+        if self.poc_bin is None or volume > self.profile.get(self.poc_bin, 0):
+            self.poc_bin = level
+        return True
+
+    def _close_bar(self):
+        """Intègre la bougie terminée dans l'état des indicateurs (mêmes formules que values())"""
+        close = self.close
+        if self.prev_close is None:
+            self.ema_fast = self.ema_slow = close
+        else:
+            st = self._supertrend()
+            self.atr, self.st_upper, self.st_lower, self.st_bullish = st
+            self.ema_fast, self.ema_slow, self.macd_signal = self._macd()
+            self.avg_gain, self.avg_loss = self._rsi()[1:]
+        bands = self._bollinger()
+        if bands is not None:
+            self.bb_upper, self.bb_lower = bands[1], bands[2]
+        self.closes.push(close)
+        self.prev_close = close
+        self.bars += 1
+
+        # Profil: la bougie la plus ancienne sort de la fenêtre
+        slot = self.bars % POC_BARS
+        evicted = self.bar_profiles[slot]
+        self.bar_profiles[slot] = self.bar_profile
+        self.bar_profile = {}
+        if evicted:
+            for level, count in evicted.items():
+                remaining = self.profile[level] - count
+                if remaining:
+                    self.profile[level] = remaining
+                else:
+                    del self.profile[level]
+            if self.poc_bin in evicted:
+                # Rare (le niveau dominant quitte la fenêtre): nouveau maximum sur les niveaux restants
+                self.poc_bin = max(self.profile, key=self.profile.get) if self.profile else None
+
+    # ---------- valeurs de la bougie en cours (sans modifier l'état) ----------
+
+    def _supertrend(self):
+        high, low, close, prev_close = self.high, self.low, self.close, self.prev_close
+        true_range = max(high - low, abs(high - prev_close), abs(low - prev_close))
+        n = min(self.bars, SUPERTREND_PERIOD)
+        atr = (self.atr * n + true_range) / (n + 1) if n < SUPERTREND_PERIOD else \
+            (self.atr * (SUPERTREND_PERIOD - 1) + true_range) / SUPERTREND_PERIOD
+        middle = (high + low) / 2
+        upper = middle + SUPERTREND_MULTIPLIER * atr
+        lower = middle - SUPERTREND_MULTIPLIER * atr
+        if self.bars > 1:
+            if not (upper < self.st_upper or prev_close > self.st_upper):
+                upper = self.st_upper
+            if not (lower > self.st_lower or prev_close < self.st_lower):
+                lower = self.st_lower
+        bullish = self.st_bullish
+        if bullish and close < lower:
+            bullish = False
+        elif not bullish and close > upper:
+            bullish = True
+        return atr, upper, lower, bullish
+
+    def _macd(self):
+        close = self.close
+        fast = self.ema_fast + 2 / (MACD_FAST + 1) * (close - self.ema_fast)
+        slow = self.ema_slow + 2 / (MACD_SLOW + 1) * (close - self.ema_slow)
+        main = fast - slow
+        signal = main if self.bars <= 1 else self.macd_signal + 2 / (MACD_SIGNAL + 1) * (main - self.macd_signal)
+        return fast, slow, signal
+
+    def _rsi(self):
+        change = self.close - self.prev_close
+        n = min(self.bars, RSI_PERIOD - 1)
+        gain = (self.avg_gain * n + max(change, 0.0)) / (n + 1)
+        loss = (self.avg_loss * n + max(-change, 0.0)) / (n + 1)
+        rsi = 100.0 if loss == 0 else 100.0 - 100.0 / (1.0 + gain / loss)
+        return rsi, gain, loss
+
+    def _bollinger(self):
+        if self.closes.count < self.closes.size:
+            return None
+        close = self.close
+        mean = (self.closes.total + close) / BOLLINGER_PERIOD
+        variance = max((self.closes.squares + close * close) / BOLLINGER_PERIOD - mean * mean, 0.0)
+        deviation = BOLLINGER_DEVIATION * math.sqrt(variance)
+        return mean, mean + deviation, mean - deviation
+
+    def values(self):
+        """Indicateurs de la bougie en cours; un groupe absent tant que son historique est insuffisant"""
+        close = self.close
+        result = {}
+
+        # Prix sur le VWAP: la règle 'level' voterait BEARISH, le groupe est omis
+        vwap = self.vwap_sum / self.vwap_weight
+        if self.bars >= 1 and self.vwap_weight >= VWAP_MIN_SAMPLES and close != vwap:
+            band = VWAP_BAND * math.sqrt(max(self.vwap_squares / self.vwap_weight - vwap * vwap, 0.0))
+            result['vwap'] = {'vwap': vwap, 'vwap_upper': vwap + band, 'vwap_lower': vwap - band,
+                              'price_position': 'ABOVE_VWAP' if close > vwap else 'BELOW_VWAP'}
+
+        if self.poc_bin is not None and self.bars >= 1:
+            result['poc'] = {'poc': (self.poc_bin + 0.5) * self.bin_size}
+
+        if self.prev_close is None:
+            return result
+
+        if self.bars >= SUPERTREND_PERIOD:
+            _, upper, lower, bullish = self._supertrend()
+            result['supertrend'] = {'supertrend_up': lower if bullish else 0.0,
+                                    'supertrend_down': 0.0 if bullish else upper,
+                                    'supertrend_direction': 'BULLISH' if bullish else 'BEARISH'}
+
+        if self.bars >= MACD_SLOW:
+            fast, slow, signal = self._macd()
+            main = fast - slow
+            result['macd'] = {'macd_main': main, 'macd_signal': signal,
+                              'macd_trend': 'BULLISH' if main > signal else 'BEARISH' if main < signal else 'NEUTRAL'}
+
+        bands = self._bollinger()
+        if bands is not None and self.bars >= max(RSI_PERIOD, BOLLINGER_PERIOD) and self.bb_upper:
+            _, upper, lower = bands
+            rsi = self._rsi()[0]
+            # Réintégration des bandes: clôture précédente dehors, prix courant revenu dedans, RSI confirmant
+            direction = 'NEUTRAL'
+            if self.prev_close < self.bb_lower and lower < close < upper and rsi < 50:
+                direction = 'BULLISH'
+            elif self.prev_close > self.bb_upper and lower < close < upper and rsi > 50:
+                direction = 'BEARISH'
+            result['bollinger'] = {'bollinger_signal': {'BULLISH': 1.0, 'BEARISH': -1.0}.get(direction, 0.0),
+                                   'bollinger_direction': direction}
+        return result
+
+
+# Un groupe est complété seulement si l'EA n'a rien envoyé pour lui (indicateur non chargé dans MT5)
+MISSING = {
+    'vwap': lambda s: not s['vwap'],
+    'poc': lambda s: not s['poc'],
+    'supertrend': lambda s: not s['supertrend_up'] and not s['supertrend_down'],
+    'macd': lambda s: not s['macd_main'] and not s['macd_signal'],
+    'bollinger': lambda s: not s['bollinger_signal'] and s['bollinger_direction'] in ('NEUTRAL', ''),
+}
+
+
+class IndicatorEngine:
+    """États de tous les flux; update() complète un signal (dict SIGNAL_SCHEMA) avant la confluence"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+        self.stats = {'updates': 0, 'filled': 0}
+
+    def _feed(self, signal, now):
+        """Met à jour l'état du flux du signal; retourne l'état (None si pas de prix ou timeframe inconnu)"""
+        price = signal['bid']
+        bar_seconds = timeframe_seconds(signal['timeframe'])
+        if price <= 0 or not bar_seconds:
+            return None
+        key = (signal['symbol'], signal['timeframe'])
+        state = self._states.get(key)
+        if state is None:
+            state = self._states[key] = IndicatorState(bar_seconds)
+        bar_time = signal.get('bar_time') or int(now // bar_seconds * bar_seconds)
+        return state if state.update(price, bar_time) else None
+
+    def update(self, signal, now=None):
+        """Intègre le prix du signal et complète ses indicateurs absents; retourne les groupes complétés"""
+        if not INDICATORS_ENABLED:
+            return []
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self._feed(signal, now)
+            if state is None:
+                return []
+            values = state.values()
+            self.stats['updates'] += 1
+        filled = [group for group, fields in values.items() if MISSING[group](signal)]
+        for group in filled:
+            signal.update(values[group])
+        if filled:
+            self.stats['filled'] += 1
+        return filled
+
+    def warm_up(self, conn, hours=WARMUP_HOURS):
+        """Rejoue les prix récents stockés (une mise à jour par envoi fusionné dans la ligne)"""
+        if not INDICATORS_ENABLED:
+            return 0
+        rows = conn.execute('''
+            SELECT symbol, timeframe, bar_time, bid, updates, CAST(strftime('%s', created_at) AS INTEGER) AS epoch
+            FROM signals WHERE created_at >= datetime('now', ?) ORDER BY created_at, id
+        ''', (f'-{int(hours)} hours',)).fetchall()
+        with self._lock:
+            self._states = {}
+            for row in rows:
+                signal = {'symbol': row['symbol'], 'timeframe': row['timeframe'], 'bid': row['bid'] or 0.0,
+                          'bar_time': row['bar_time']}
+                for _ in range(min(row['updates'] or 1, 100)):
+                    if self._feed(signal, row['epoch']) is None:
+                        break
+        return len(rows)
+
+    def snapshot(self, symbol, timeframe):
+        """Indicateurs calculés de la bougie en cours d'un flux (API)"""
+        with self._lock:
+            state = self._states.get((symbol, timeframe))
+            if state is None or state.bar_time is None:
+                return None
+            groups = state.values()
+            return {'bar_time': state.bar_time, 'bars': state.bars,
+                    'indicators': {field: value for fields in groups.values() for field, value in fields.items()}}
+
+
+# Moteur unique du processus
+indicator_engine = IndicatorEngine()
@@ -0,0 +1,190 @@
+"""
+Crystal Heikin Ashi - Journalisation structurée
+Écriture console dans un thread dédié (file bornée) et limitation des messages répétitifs
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')     # text | json
+LOG_QUEUE_SIZE = 10000
+
+# Limitation des messages marqués RATE_LIMITED: `burst` par gabarit et par intervalle
+RATE_LIMIT_INTERVAL = float(os.environ.get('LOG_RATE_INTERVAL', 10))
+RATE_LIMIT_BURST = int(os.environ.get('LOG_RATE_BURST', 5))
+
+# extra= des messages répétitifs (poll des trades, signaux reçus...)
+RATE_LIMITED = {'rate_limit': True}
+
+# Attributs standard d'un LogRecord (le reste est exporté en champs structurés)
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+_listener = None
+_handler = None
+_setup_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """Laisse passer `burst` occurrences d'un même gabarit par intervalle, compte les autres"""
+
+    def __init__(self, interval=RATE_LIMIT_INTERVAL, burst=RATE_LIMIT_BURST):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._windows = {}      # (logger, gabarit) -> [début de fenêtre, occurrences]
+
+    def filter(self, record):
+        if not getattr(record, 'rate_limit', False):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                if window is not None and window[1] > self.burst:
+                    record.suppressed = window[1] - self.burst
+                self._windows[key] = [now, 1]
+                return True
+            window[1] += 1
+            return window[1] <= self.burst
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler qui ne bloque jamais: file pleine -> message perdu et compté.
+    SimpleQueue: put() réentrant (un handler de signal peut journaliser pendant un put du thread principal)
+    """
+
+    def __init__(self, log_queue, maxsize=LOG_QUEUE_SIZE):
+        super().__init__(log_queue)
+        self.maxsize = maxsize
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Le formatage est laissé au thread d'écriture; seule la trace d'exception est figée ici
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.queue.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            notice = logging.LogRecord('LOG', logging.WARNING, __file__, 0,
+                                       '%d messages perdus (console saturée)', (dropped,), None)
+            self.queue.put_nowait(notice)
+
+
+class TextFormatter(logging.Formatter):
+    """2025-01-01 12:00:00 INFO  [TAG] message (+N similaires) champ=valeur"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-5s [%(name)s] %(message)s', '%Y-%m-%d %H:%M:%S')
+
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            text += f' (+{record.suppressed} similaires)'
+        fields = _fields(record)
+        if fields:
+            text += ' ' + ' '.join(f'{k}={v}' for k, v in fields.items())
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Une ligne JSON par message (ingestion par un collecteur de logs)"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(_fields(record))
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class NativeQueueListener(logging.handlers.QueueListener):
+    """QueueListener sur un vrai thread du système (modules threading/queue non patchés par eventlet)"""
+
+    def __init__(self, log_queue, *handlers, threading_module=threading):
+        super().__init__(log_queue, *handlers)
+        self.threading = threading_module
+
+    def start(self):
+        self._thread = self.threading.Thread(target=self._monitor, name='log-writer', daemon=True)
+        self._thread.start()
+
+
+def _native_modules():
+    """
+    (threading, queue) d'origine: sous eventlet, le thread d'écriture serait sinon un green thread
+    et chaque écriture console bloquerait le hub
+    """
+    eventlet = sys.modules.get('eventlet')
+    if eventlet is not None:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('thread'):
+            return patcher.original('threading'), patcher.original('queue')
+    return threading, queue
+
+
+def _fields(record):
+    """Champs structurés passés via extra= (hors marqueurs internes)"""
+    return {k: v for k, v in vars(record).items()
+            if k not in _RECORD_FIELDS and k not in ('rate_limit', 'suppressed')}
+
+
+def setup_logging(level=None, fmt=None, stream=None):
+    """Installe le handler en file sur le logger racine (idempotent)"""
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        console = logging.StreamHandler(stream or sys.stdout)
+        console.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == 'json' else TextFormatter())
+
+        native_threading, native_queue = _native_modules()
+        _handler = DroppingQueueHandler(native_queue.SimpleQueue())
+        _handler.addFilter(RateLimitFilter())
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(level or LOG_LEVEL)
+
+        _listener = NativeQueueListener(_handler.queue, console, threading_module=native_threading)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Vide la file et arrête le thread d'écriture"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+            logging.getLogger().removeHandler(_handler)
+
+
+def get_logger(tag):
+    """Logger d'une catégorie ([SIGNAL], [TRADE]...), journalisation installée au premier appel"""
+    setup_logging()
+    return logging.getLogger(tag)
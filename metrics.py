@@ -0,0 +1,224 @@
+"""
+Crystal Heikin Ashi - Métriques du processus
+Compteurs, jauges et histogrammes en mémoire, exposés au format texte Prometheus
+"""
+
+from bisect import bisect_left
+import os
+import threading
+import time
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+# Bornes des histogrammes de latence (secondes)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value):
+    """Échappement d'une valeur de label"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    """{a="x",b="y"} (+ label supplémentaire déjà formaté)"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    """Valeur numérique au format Prometheus"""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Métrique nommée avec des séries par combinaison de labels"""
+    kind = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def labels(self, *values):
+        """Série d'une combinaison de labels (créée au premier usage)"""
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(values, self._new_series())
+        return series
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for values, series in sorted(self._series.items()):
+            lines += series.render(self.name, self.labelnames, values)
+        return lines
+
+
+class _Value:
+    """Valeur d'un compteur ou d'une jauge"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, labelnames, values):
+        return [f'{name}{_labels(labelnames, values)} {_number(self.value)}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_series(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """Jauge; avec `collect`, la valeur est lue au moment de l'export"""
+    kind = 'gauge'
+
+    def __init__(self, name, description, labelnames=(), collect=None):
+        super().__init__(name, description, labelnames)
+        self.collect = collect
+
+    def _new_series(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def render(self):
+        if self.collect is not None:
+            try:
+                self.labels().set(self.collect())
+            except Exception:
+                pass
+        return super().render()
+
+
+class _HistogramSeries:
+    """Compteurs par borne (non cumulés en mémoire), somme et total"""
+
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self, name, labelnames, values):
+        with self._lock:
+            counts = list(self.counts)
+            total_sum = self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = 'le="%s"' % _number(bound)
+            lines.append(f'{name}_bucket{_labels(labelnames, values, le)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labelnames, values)} {_number(total_sum)}')
+        lines.append(f'{name}_count{_labels(labelnames, values)} {cumulative}')
+        return lines
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(float(b) for b in buckets)
+        super().__init__(name, description, labelnames)
+
+    def _new_series(self):
+        return _HistogramSeries(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class StageTimer:
+    """Chronomètre par étapes: mark(étape) enregistre le temps écoulé depuis la marque précédente"""
+
+    __slots__ = ('histogram', 'last')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.last = time.perf_counter()
+
+    def mark(self, stage):
+        now = time.perf_counter()
+        if METRICS_ENABLED:
+            self.histogram.labels(stage).observe(now - self.last)
+        self.last = now
+
+
+REGISTRY = []
+
+
+def render():
+    """Toutes les métriques au format texte Prometheus (version 0.0.4)"""
+    lines = []
+    for metric in list(REGISTRY):
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+# ============================================
+# MÉTRIQUES DE L'APPLICATION
+# ============================================
+
+HTTP_REQUESTS = Counter('crystal_http_requests_total', 'Requêtes HTTP par route, méthode et statut',
+                        ('route', 'method', 'status'))
+HTTP_LATENCY = Histogram('crystal_http_request_duration_seconds', 'Durée des requêtes HTTP par route',
+                         ('route', 'method'))
+SIGNAL_STAGES = Histogram('crystal_signal_stage_seconds',
+                          'Durée des étapes de réception des signaux (parse, score, db, broadcast)', ('stage',))
+EMIT_LATENCY = Histogram('crystal_socketio_emit_seconds', "Durée d'un emit Socket.IO (sérialisation + fan-out)",
+                         ('event',))
+SIGNALS_COALESCED = Counter('crystal_signals_coalesced_total',
+                            'Signaux remplacés par un plus récent avant diffusion (coalescence par symbole)')
+SOCKETIO_CLIENTS = Gauge('crystal_socketio_clients', 'Clients Socket.IO connectés')
+
+DB_LOCK_WAIT = Histogram('crystal_sqlite_lock_wait_seconds', "Attente du verrou d'écriture SQLite (BEGIN IMMEDIATE)")
+DB_COMMIT = Histogram('crystal_sqlite_commit_seconds', "Durée d'un lot de l'écrivain (BEGIN à COMMIT)")
+DB_QUEUE_WAIT = Histogram('crystal_db_write_queue_seconds', "Attente d'une écriture dans la file de l'écrivain")
+DB_BATCH_SIZE = Histogram('crystal_db_write_batch_size', 'Écritures par lot (group commit)', buckets=SIZE_BUCKETS)
+
+
+def observe_request(route, method, status, seconds):
+    """Enregistre une requête HTTP terminée"""
+    HTTP_REQUESTS.labels(route, method, status).inc()
+    HTTP_LATENCY.labels(route, method).observe(seconds)
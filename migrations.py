@@ -0,0 +1,273 @@
+"""
+Crystal Heikin Ashi - Migrations du schéma SQLite
+Versionnées via PRAGMA user_version, applicables à chaud sur une base existante
+"""
+
+import sqlite3
+import sys
+
+from logs import get_logger
+
+log = get_logger('DB')
+
+# (version, description, instructions SQL) - ne jamais modifier une migration publiée
+MIGRATIONS = [
+    (1, 'Schéma initial', [
+        '''
+        CREATE TABLE IF NOT EXISTS signals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            timeframe TEXT NOT NULL,
+            signal_type TEXT NOT NULL,
+            ha_open REAL,
+            ha_high REAL,
+            ha_low REAL,
+            ha_close REAL,
+            trend TEXT,
+            momentum_shift INTEGER DEFAULT 0,
+            bid REAL,
+            ask REAL,
+            spread REAL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS trades (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            action TEXT NOT NULL,
+            volume REAL,
+            price REAL,
+            sl REAL,
+            tp REAL,
+            status TEXT DEFAULT 'pending',
+            ticket INTEGER,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS positions (
+            ticket INTEGER PRIMARY KEY,
+            symbol TEXT NOT NULL,
+            type TEXT NOT NULL,
+            volume REAL,
+            open_price REAL,
+            current_price REAL,
+            sl REAL DEFAULT 0,
+            tp REAL DEFAULT 0,
+            profit REAL DEFAULT 0,
+            open_time TEXT,
+            status TEXT DEFAULT 'open',
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (2, 'Index historique, stats 24h et trades en attente', [
+        # Historique filtré par symbole (ORDER BY created_at DESC)
+        'CREATE INDEX IF NOT EXISTS idx_signals_symbol_created ON signals (symbol, created_at)',
+        # Historique global + agrégats 24h (index couvrant: trend et momentum_shift inclus)
+        'CREATE INDEX IF NOT EXISTS idx_signals_created_trend ON signals (created_at, trend, momentum_shift)',
+        # File des trades en attente, interrogée chaque seconde par l'EA
+        'CREATE INDEX IF NOT EXISTS idx_trades_status_created ON trades (status, created_at)',
+        'CREATE INDEX IF NOT EXISTS idx_positions_status_open ON positions (status, open_time)',
+    ]),
+    (3, 'Indicateurs et confluence persistés (niveaux REAL, directions codées INTEGER)', [
+        # ADD COLUMN ne réécrit pas la table: applicable à chaud
+        'ALTER TABLE signals ADD COLUMN resistance REAL',
+        'ALTER TABLE signals ADD COLUMN support REAL',
+        'ALTER TABLE signals ADD COLUMN supply_zone REAL',
+        'ALTER TABLE signals ADD COLUMN demand_zone REAL',
+        'ALTER TABLE signals ADD COLUMN vwap REAL',
+        'ALTER TABLE signals ADD COLUMN vwap_upper REAL',
+        'ALTER TABLE signals ADD COLUMN vwap_lower REAL',
+        'ALTER TABLE signals ADD COLUMN poc REAL',
+        'ALTER TABLE signals ADD COLUMN supertrend_up REAL',
+        'ALTER TABLE signals ADD COLUMN supertrend_down REAL',
+        'ALTER TABLE signals ADD COLUMN fibo_level1 REAL',
+        'ALTER TABLE signals ADD COLUMN fibo_level2 REAL',
+        'ALTER TABLE signals ADD COLUMN fibo_level3 REAL',
+        'ALTER TABLE signals ADD COLUMN anchored_vwap REAL',
+        'ALTER TABLE signals ADD COLUMN drawfib_level1 REAL',
+        'ALTER TABLE signals ADD COLUMN drawfib_level2 REAL',
+        'ALTER TABLE signals ADD COLUMN drawfib_level3 REAL',
+        'ALTER TABLE signals ADD COLUMN bollinger_signal REAL',
+        'ALTER TABLE signals ADD COLUMN fvg_high REAL',
+        'ALTER TABLE signals ADD COLUMN fvg_low REAL',
+        'ALTER TABLE signals ADD COLUMN macd_main REAL',
+        'ALTER TABLE signals ADD COLUMN macd_signal REAL',
+        'ALTER TABLE signals ADD COLUMN pro_resistance REAL',
+        'ALTER TABLE signals ADD COLUMN pro_support REAL',
+        'ALTER TABLE signals ADD COLUMN harmonic_pattern INTEGER',
+        'ALTER TABLE signals ADD COLUMN price_position INTEGER',
+        'ALTER TABLE signals ADD COLUMN supertrend_direction INTEGER',
+        'ALTER TABLE signals ADD COLUMN candle_pattern INTEGER',
+        'ALTER TABLE signals ADD COLUMN bollinger_direction INTEGER',
+        'ALTER TABLE signals ADD COLUMN fvg_type INTEGER',
+        'ALTER TABLE signals ADD COLUMN macd_trend INTEGER',
+        'ALTER TABLE signals ADD COLUMN bullish_score REAL',
+        'ALTER TABLE signals ADD COLUMN bearish_score REAL',
+        'ALTER TABLE signals ADD COLUMN total_indicators INTEGER',
+        'ALTER TABLE signals ADD COLUMN final_signal INTEGER',
+    ]),
+    (4, 'Rollups minute/bougie des signaux archivés', [
+        '''
+        CREATE TABLE IF NOT EXISTS signal_rollups (
+            symbol TEXT NOT NULL,
+            timeframe TEXT NOT NULL,
+            period TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            signals INTEGER,
+            bullish INTEGER,
+            bearish INTEGER,
+            momentum_shifts INTEGER,
+            last_trend TEXT,
+            last_final_signal INTEGER,
+            PRIMARY KEY (symbol, timeframe, period, bucket)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (5, 'Historique des positions (ouverture, fermeture, snapshots PnL)', [
+        'ALTER TABLE positions ADD COLUMN closed_at TEXT',
+        '''
+        CREATE TABLE IF NOT EXISTS position_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket INTEGER NOT NULL,
+            symbol TEXT NOT NULL,
+            event TEXT NOT NULL,
+            type TEXT,
+            volume REAL,
+            price REAL,
+            sl REAL,
+            tp REAL,
+            profit REAL,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_position_history_ticket ON position_history (ticket, id)',
+        'CREATE INDEX IF NOT EXISTS idx_position_history_created ON position_history (created_at)',
+    ]),
+    (6, 'Série temporelle du compte (snapshots bruts, agrégats minute/heure)', [
+        '''
+        CREATE TABLE IF NOT EXISTS account_snapshots (
+            ts INTEGER PRIMARY KEY,
+            balance REAL,
+            equity REAL,
+            margin REAL,
+            free_margin REAL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS account_rollups (
+            resolution INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            balance REAL,
+            equity_open REAL,
+            equity_min REAL,
+            equity_max REAL,
+            equity_last REAL,
+            margin_max REAL,
+            free_margin REAL,
+            samples INTEGER,
+            PRIMARY KEY (resolution, bucket)
+        ) WITHOUT ROWID
+        ''',
+    ]),
+    (7, "File de trades: bail par consommateur, clés d'idempotence", [
+        'ALTER TABLE trades ADD COLUMN consumer TEXT',
+        'ALTER TABLE trades ADD COLUMN lease_owner TEXT',
+        'ALTER TABLE trades ADD COLUMN lease_expires REAL DEFAULT 0',
+        'ALTER TABLE trades ADD COLUMN attempts INTEGER DEFAULT 0',
+        'ALTER TABLE trades ADD COLUMN idempotency_key TEXT',
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_trades_idempotency ON trades (idempotency_key) WHERE idempotency_key IS NOT NULL',
+    ]),
+    (8, 'Une ligne par bougie et par transition (upsert des signaux)', [
+        'ALTER TABLE signals ADD COLUMN bar_time INTEGER',
+        'ALTER TABLE signals ADD COLUMN revision INTEGER DEFAULT 0',
+        'ALTER TABLE signals ADD COLUMN updates INTEGER DEFAULT 1',
+        # Les signaux sans heure de bougie (anciens EA) restent en insertion simple
+        '''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_signals_bar
+        ON signals (symbol, timeframe, bar_time, signal_type, revision) WHERE bar_time IS NOT NULL
+        ''',
+    ]),
+    (9, 'Alignement multi-timeframe Heikin Ashi', [
+        'ALTER TABLE signals ADD COLUMN mtf_trend INTEGER',
+    ]),
+    (10, 'Consommateur (EA) propriétaire de chaque position', [
+        'ALTER TABLE positions ADD COLUMN consumer TEXT',
+    ]),
+    (11, 'Snapshots du compte en ajout seul (plusieurs snapshots par milliseconde)', [
+        '''
+        CREATE TABLE account_snapshots_append (
+            id INTEGER PRIMARY KEY,
+            ts INTEGER NOT NULL,
+            balance REAL,
+            equity REAL,
+            margin REAL,
+            free_margin REAL
+        )
+        ''',
+        '''
+        INSERT INTO account_snapshots_append (ts, balance, equity, margin, free_margin)
+        SELECT ts, balance, equity, margin, free_margin FROM account_snapshots ORDER BY ts
+        ''',
+        'DROP TABLE account_snapshots',
+        'ALTER TABLE account_snapshots_append RENAME TO account_snapshots',
+        'CREATE INDEX IF NOT EXISTS idx_account_snapshots_ts ON account_snapshots (ts)',
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    """Version actuelle du schéma"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target=LATEST_VERSION):
+    """Applique les migrations manquantes, une transaction par version"""
+    current = get_version(conn)
+    applied = []
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for version, description, statements in MIGRATIONS:
+            if version <= current or version > target:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for sql in statements:
+                    if callable(sql):
+                        sql(conn)
+                    else:
+                        conn.execute(sql)
+                conn.execute(f'PRAGMA user_version = {int(version)}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            log.info('Migration %d appliquée: %s', version, description)
+            applied.append(version)
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+if __name__ == '__main__':
+    # Migration à chaud: python migrations.py [chemin/vers/signals.db]
+    path = sys.argv[1] if len(sys.argv) > 1 else 'signals.db'
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA busy_timeout = 10000')
+    conn.execute('PRAGMA journal_mode = WAL')
+    print(f"[DB] {path}: version {get_version(conn)} -> {LATEST_VERSION}")
+    applied = migrate(conn)
+    if not applied:
+        print("[DB] Schéma déjà à jour")
+    conn.close()
@@ -0,0 +1,155 @@
+"""
+Crystal Heikin Ashi - Heikin Ashi multi-timeframe
+Bougies Heikin Ashi des timeframes supérieurs agrégées côté serveur à partir du bid de chaque signal,
+tendance par timeframe et alignement (mtf_trend) pour la confluence et le dashboard
+"""
+
+from array import array
+import os
+import threading
+import time
+
+from retention import timeframe_seconds
+
+# Timeframes agrégés (ceux supérieurs au timeframe de l'EA sont calculés pour chaque signal)
+MTF_TIMEFRAMES = tuple(tf.strip() for tf in os.environ.get('MTF_TIMEFRAMES', 'M15,H1,H4').split(',')
+                       if timeframe_seconds(tf.strip()))
+
+# Bougies closes conservées par symbole/timeframe
+MTF_BARS = int(os.environ.get('MTF_BARS', 100))
+
+# Valeurs d'une bougie dans le tampon: heure d'ouverture, HA open/high/low/close
+BAR_WIDTH = 5
+
+# Historique rejoué au démarrage
+WARMUP_HOURS = int(os.environ.get('MTF_WARMUP_HOURS', 48))
+
+
+class HeikinAshiSeries:
+    """Bougies Heikin Ashi d'un timeframe: bougie en cours (OHLC brut du bid) + MTF_BARS bougies closes (array)"""
+
+    __slots__ = ('seconds', 'bars', 'count', 'start', 'open', 'high', 'low', 'close', 'ha_prev')
+
+    def __init__(self, seconds, size=MTF_BARS):
+        self.seconds = seconds
+        self.bars = array('d', bytes(8 * BAR_WIDTH * size))
+        self.count = 0              # bougies closes depuis le début
+        self.start = None           # heure d'ouverture de la bougie en cours
+        self.open = self.high = self.low = self.close = 0.0
+        self.ha_prev = None         # (HA open, HA close) de la dernière bougie close
+
+    def update(self, price, when):
+        """Prix à l'instant when (epoch, heure du serveur MT5 si connue); False si bougie déjà close"""
+        start = int(when) // self.seconds * self.seconds
+        if start != self.start:
+            if self.start is not None:
+                if start < self.start:
+                    return False
+                self._close_bar()
+            self.start = start
+            self.open = self.high = self.low = self.close = price
+            return True
+        if price > self.high:
+            self.high = price
+        elif price < self.low:
+            self.low = price
+        self.close = price
+        return True
+
+    def current(self):
+        """Bougie HA en cours: (heure, open, high, low, close)"""
+        ha_close = (self.open + self.high + self.low + self.close) / 4
+        ha_open = (self.open + self.close) / 2 if self.ha_prev is None else sum(self.ha_prev) / 2
+        return self.start, ha_open, max(self.high, ha_open, ha_close), min(self.low, ha_open, ha_close), ha_close
+
+    def _close_bar(self):
+        bar = self.current()
+        size = len(self.bars) // BAR_WIDTH
+        offset = self.count % size * BAR_WIDTH
+        self.bars[offset:offset + BAR_WIDTH] = array('d', bar)
+        self.count += 1
+        self.ha_prev = (bar[1], bar[4])
+
+    def trend(self):
+        """Tendance de la bougie HA en cours; NEUTRAL tant qu'aucune bougie n'est close (HA non amorcé)"""
+        if self.ha_prev is None:
+            return 'NEUTRAL'
+        _, ha_open, _, _, ha_close = self.current()
+        return 'BULLISH' if ha_close > ha_open else 'BEARISH' if ha_close < ha_open else 'NEUTRAL'
+
+    def history(self, limit=MTF_BARS):
+        """Bougies closes (les plus anciennes d'abord) puis la bougie en cours, en dicts"""
+        size = len(self.bars) // BAR_WIDTH
+        kept = min(self.count, size, limit)
+        rows = []
+        for index in range(self.count - kept, self.count):
+            offset = index % size * BAR_WIDTH
+            rows.append(tuple(self.bars[offset:offset + BAR_WIDTH]))
+        if self.start is not None:
+            rows.append(self.current())
+        return [{'time': int(t), 'ha_open': o, 'ha_high': h, 'ha_low': l, 'ha_close': c} for t, o, h, l, c in rows]
+
+
+class MultiTimeframe:
+    """Séries HA de chaque symbole; update() ajoute mtf (tendance par timeframe) et mtf_trend à un signal"""
+
+    def __init__(self, timeframes=MTF_TIMEFRAMES):
+        self.timeframes = sorted(timeframes, key=timeframe_seconds)
+        self._lock = threading.Lock()
+        self._series = {}       # (symbole, timeframe) -> HeikinAshiSeries
+
+    def _feed(self, symbol, timeframe, price, bar_time, now):
+        """
+        Met à jour les timeframes supérieurs à celui du signal; retourne [(timeframe, série)].
+        L'heure de la bougie (heure du serveur MT5) place le prix dans les bougies supérieures,
+        à défaut l'heure de réception
+        """
+        own = timeframe_seconds(timeframe)
+        if price <= 0 or not own:
+            return []
+        when = bar_time or now
+        updated = []
+        for tf in self.timeframes:
+            seconds = timeframe_seconds(tf)
+            if seconds <= own:
+                continue
+            series = self._series.get((symbol, tf))
+            if series is None:
+                series = self._series[(symbol, tf)] = HeikinAshiSeries(seconds)
+            if series.update(price, when):
+                updated.append((tf, series))
+        return updated
+
+    def update(self, signal, now=None):
+        """Intègre le bid du signal; mtf_trend = tendance commune au timeframe de l'EA et aux supérieurs"""
+        now = time.time() if now is None else now
+        with self._lock:
+            updated = self._feed(signal['symbol'], signal['timeframe'], signal['bid'], signal.get('bar_time'), now)
+            trends = {tf: series.trend() for tf, series in updated}
+        signal['mtf'] = dict({signal['timeframe']: signal['trend']}, **trends)
+        higher = set(trends.values())
+        signal['mtf_trend'] = signal['trend'] if len(higher) == 1 and signal['trend'] in higher else 'NEUTRAL'
+        return signal['mtf']
+
+    def warm_up(self, conn, hours=WARMUP_HOURS):
+        """Rejoue les prix récents stockés (ordre d'arrivée)"""
+        rows = conn.execute('''
+            SELECT symbol, timeframe, bar_time, bid, CAST(strftime('%s', created_at) AS INTEGER) AS epoch
+            FROM signals WHERE created_at >= datetime('now', ?) ORDER BY created_at, id
+        ''', (f'-{int(hours)} hours',)).fetchall()
+        with self._lock:
+            self._series = {}
+            for row in rows:
+                self._feed(row['symbol'], row['timeframe'], row['bid'] or 0.0, row['bar_time'], row['epoch'])
+        return len(rows)
+
+    def snapshot(self, symbol, limit=MTF_BARS):
+        """Tendance et bougies HA de chaque timeframe agrégé d'un symbole (API)"""
+        with self._lock:
+            return {tf: {'trend': series.trend(), 'bars': series.history(limit)}
+                    for tf in self.timeframes
+                    for series in [self._series.get((symbol, tf))] if series is not None}
+
+
+# Agrégateur unique du processus
+multi_timeframe = MultiTimeframe()
@@ -0,0 +1,180 @@
+"""
+Crystal Heikin Ashi - Synchronisation des positions
+Diff entre les positions envoyées par l'EA et les positions ouvertes en cache, historique des événements
+"""
+
+import os
+import threading
+import time
+
+# Intervalle minimal entre deux snapshots PnL d'une même position (secondes)
+PNL_SNAPSHOT_INTERVAL = float(os.environ.get('PNL_SNAPSHOT_INTERVAL', 60))
+
+# Champs comparés: une différence = mise à jour de la ligne
+COMPARED_FIELDS = ('symbol', 'type', 'volume', 'current_price', 'sl', 'tp', 'profit')
+
+# Changement de ces champs = événement 'update' dans l'historique (le reste: snapshot PnL périodique)
+EVENT_FIELDS = ('type', 'volume', 'sl', 'tp')
+
+INSERT_POSITION_SQL = '''
+    INSERT OR REPLACE INTO positions
+    (ticket, symbol, type, volume, open_price, current_price, sl, tp, profit, open_time, status,
+     updated_at, closed_at, consumer)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'open', CURRENT_TIMESTAMP, NULL, ?)
+'''
+UPDATE_POSITION_SQL = '''
+    UPDATE positions SET symbol = ?, type = ?, volume = ?, current_price = ?, sl = ?, tp = ?, profit = ?,
+                         consumer = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE ticket = ?
+'''
+CLOSE_POSITION_SQL = '''
+    UPDATE positions SET status = 'closed', closed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+    WHERE ticket = ?
+'''
+INSERT_HISTORY_SQL = '''
+    INSERT INTO position_history (ticket, symbol, event, type, volume, price, sl, tp, profit)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def history_row(position, event):
+    """Ligne de position_history d'un événement"""
+    return (position['ticket'], position['symbol'], event, position['type'], position['volume'],
+            position['current_price'], position['sl'], position['tp'], position['profit'])
+
+
+class PositionDiff:
+    """Changements d'une synchronisation: ouvertes, modifiées, fermées et lignes d'historique"""
+
+    __slots__ = ('opened', 'updated', 'closed', 'events', 'snapshots')
+
+    def __init__(self):
+        self.opened = []
+        self.updated = []
+        self.closed = []
+        self.events = []
+        self.snapshots = {}     # ticket -> instant du snapshot PnL
+
+    def __bool__(self):
+        return bool(self.opened or self.updated or self.closed)
+
+    def write(self, c):
+        """Applique le diff dans la transaction de l'écrivain"""
+        if self.opened:
+            c.executemany(INSERT_POSITION_SQL, [
+                (p['ticket'], p['symbol'], p['type'], p['volume'], p['open_price'], p['current_price'],
+                 p['sl'], p['tp'], p['profit'], p['open_time'], p['consumer']) for p in self.opened])
+        if self.updated:
+            c.executemany(UPDATE_POSITION_SQL, [
+                (p['symbol'], p['type'], p['volume'], p['current_price'], p['sl'], p['tp'], p['profit'],
+                 p['consumer'], p['ticket']) for p in self.updated])
+        if self.closed:
+            c.executemany(CLOSE_POSITION_SQL, [(p['ticket'],) for p in self.closed])
+        if self.events:
+            c.executemany(INSERT_HISTORY_SQL, self.events)
+
+    def message(self, symbol=None):
+        """Payload positions_changed (filtré par symbole)"""
+        keep = (lambda p: True) if symbol is None else (lambda p: p['symbol'] == symbol)
+        message = {
+            'upserted': [p for p in self.opened + self.updated if keep(p)],
+            'closed': [p['ticket'] for p in self.closed if keep(p)],
+        }
+        if symbol is not None:
+            message['symbol'] = symbol
+        return message
+
+    def symbols(self):
+        return {p['symbol'] for p in self.opened + self.updated + self.closed}
+
+
+class PositionBook:
+    """Positions ouvertes connues (ticket -> position), miroir de la table positions"""
+
+    def __init__(self, snapshot_interval=PNL_SNAPSHOT_INTERVAL):
+        self.snapshot_interval = snapshot_interval
+        self.lock = threading.Lock()    # une synchronisation à la fois (diff, écriture, application)
+        self._open = {}
+        self._snapshots = {}            # ticket -> instant du dernier snapshot PnL
+        self.loaded = False
+        self.version = 0                # incrémenté à chaque changement des positions ouvertes
+
+    def load(self, conn):
+        """Positions ouvertes depuis la base (au démarrage)"""
+        rows = conn.execute("SELECT * FROM positions WHERE status = 'open'").fetchall()
+        with self.lock:
+            self._open = {row['ticket']: {k: row[k] for k in row.keys()
+                                          if k not in ('status', 'updated_at', 'closed_at')} for row in rows}
+            self._snapshots = {}
+            self.loaded = True
+            self.version += 1
+        return len(rows)
+
+    def positions(self):
+        """Positions ouvertes (copie)"""
+        return [dict(p) for p in self._open.values()]
+
+    def consumer(self, ticket):
+        """EA qui a déclaré la position (None: inconnue ou envoyée sans ?consumer=)"""
+        position = self._open.get(ticket)
+        return None if position is None else position.get('consumer')
+
+    def consumers(self):
+        """EA identifiés qui détiennent au moins une position ouverte"""
+        return sorted({p['consumer'] for p in list(self._open.values()) if p.get('consumer')})
+
+    def symbol_consumers(self, symbol):
+        """EA identifiés qui détiennent une position ouverte sur `symbol`"""
+        return sorted({p['consumer'] for p in list(self._open.values())
+                       if p.get('consumer') and p['symbol'] == symbol})
+
+    def diff(self, positions, consumer=None, now=None):
+        """
+        Compare les positions reçues (POSITION_SCHEMA) de `consumer` à l'état connu; à appeler sous self.lock.
+        Seules les positions de ce consommateur absentes de l'envoi sont fermées (plusieurs EA, plusieurs comptes)
+        """
+        now = time.monotonic() if now is None else now
+        result = PositionDiff()
+        seen = set()
+        for position in positions:
+            position = dict(position, consumer=consumer)
+            ticket = position['ticket']
+            seen.add(ticket)
+            known = self._open.get(ticket)
+            if known is None:
+                result.opened.append(position)
+                result.events.append(history_row(position, 'open'))
+                result.snapshots[ticket] = now
+                continue
+            if all(known[f] == position[f] for f in COMPARED_FIELDS) and known.get('consumer') == consumer:
+                continue
+            # L'heure d'ouverture ne change pas (absente du payload = heure de réception)
+            position = dict(position, open_price=known['open_price'], open_time=known['open_time'])
+            result.updated.append(position)
+            if any(known[f] != position[f] for f in EVENT_FIELDS):
+                result.events.append(history_row(position, 'update'))
+                result.snapshots[ticket] = now
+            elif now - self._snapshots.get(ticket, float('-inf')) >= self.snapshot_interval:
+                result.events.append(history_row(position, 'pnl'))
+                result.snapshots[ticket] = now
+
+        for ticket, known in self._open.items():
+            if ticket not in seen and known.get('consumer') == consumer:
+                result.closed.append(known)
+                result.events.append(history_row(known, 'close'))
+        return result
+
+    def apply(self, result):
+        """Met à jour l'état connu après l'écriture du diff; à appeler sous self.lock"""
+        for position in result.opened + result.updated:
+            self._open[position['ticket']] = position
+        for position in result.closed:
+            self._open.pop(position['ticket'], None)
+            self._snapshots.pop(position['ticket'], None)
+        self._snapshots.update(result.snapshots)
+        if result:
+            self.version += 1
+
+
+# Positions uniques du processus
+position_book = PositionBook()
@@ -0,0 +1,391 @@
+"""
+Crystal Heikin Ashi - Rétention des signaux
+Les jours complets plus anciens que RETENTION_DAYS quittent SQLite vers des archives
+colonnaires compressées (une par symbole et par jour), avec rollups minute/bougie en base.
+"""
+
+from datetime import datetime, timedelta, timezone
+import argparse
+import os
+import re
+import shutil
+import threading
+import time
+
+import numpy as np
+
+import database
+from database import get_db, db_write, run_blocking
+from logs import get_logger
+from signal_store import decode_row
+
+# Configuration (variables d'environnement)
+# Désactivé par défaut: l'archivage supprime des lignes de signals.db, il doit être demandé explicitement
+RETENTION_DAYS = int(os.environ.get('RETENTION_DAYS', 0))         # 0 = désactivé
+RETENTION_INTERVAL = int(os.environ.get('RETENTION_INTERVAL', 3600))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+
+# Valeur stockée pour NULL dans les colonnes entières d'une archive
+INT_NULL = -1
+
+log = get_logger('RETENTION')
+
+_TIMEFRAME_RE = re.compile(r'^(?:PERIOD_)?(M|H|D|W|MN)(\d+)$')
+_TIMEFRAME_UNITS = {'M': 60, 'H': 3600, 'D': 86400, 'W': 7 * 86400, 'MN': 30 * 86400}
+
+
+def timeframe_seconds(timeframe):
+    """Durée d'une bougie MT5 ('M15', 'PERIOD_H1'...) en secondes, None si inconnue"""
+    match = _TIMEFRAME_RE.match(timeframe or '')
+    if not match:
+        return None
+    return _TIMEFRAME_UNITS[match.group(1)] * int(match.group(2))
+
+# ============================================
+# ÉCRITURE DES ARCHIVES
+# ============================================
+
+def archive_path(symbol, day):
+    """Chemin de l'archive compressée d'un symbole pour un jour (YYYY-MM-DD)"""
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', symbol)
+    return os.path.join(ARCHIVE_DIR, safe, f'{day}.npz')
+
+
+def _column_types(conn):
+    """Type déclaré de chaque colonne de signals"""
+    return {row[1]: (row[2] or 'TEXT').upper() for row in conn.execute('PRAGMA table_info(signals)')}
+
+
+def _to_columns(rows, types):
+    """Lignes SQLite -> tableaux NumPy par colonne (+ epoch pour les filtres de plage)"""
+    columns = {}
+    for name, kind in types.items():
+        values = [row[name] for row in rows]
+        if name == 'id' or kind == 'INTEGER':
+            columns[name] = np.array([INT_NULL if v is None else v for v in values], dtype=np.int64)
+        elif kind == 'REAL':
+            columns[name] = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        else:
+            columns[name] = np.array(['' if v is None else str(v) for v in values], dtype=str)
+    columns['epoch'] = np.array([row['epoch'] for row in rows], dtype=np.int64)
+    return columns
+
+
+def _null_column(dtype, n):
+    """Colonne de n valeurs NULL pour un type d'archive"""
+    if dtype.kind == 'i':
+        return np.full(n, INT_NULL, dtype=dtype)
+    if dtype.kind == 'f':
+        return np.full(n, np.nan, dtype=dtype)
+    return np.full(n, '', dtype=dtype)
+
+
+def _write_archive(symbol, day, columns):
+    """Écrit (ou fusionne) l'archive d'un jour; écriture atomique par renommage. Retourne les colonnes écrites"""
+    path = archive_path(symbol, day)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Un run interrompu a pu archiver une partie du jour: fusion par id
+    if os.path.exists(path):
+        with np.load(path) as archive:
+            existing = {name: archive[name] for name in archive.files}
+        known = ~np.isin(columns['id'], existing['id'])
+        merged = {}
+        for name in set(columns) | set(existing):
+            old = existing.get(name)
+            new = columns.get(name)
+            # Colonne ajoutée par une migration entre deux archivages
+            if old is None:
+                old = _null_column(new.dtype, len(existing['id']))
+            if new is None:
+                new = _null_column(old.dtype, len(columns['id']))
+            merged[name] = np.concatenate([old, new[known]])
+        columns = merged
+        order = np.lexsort((columns['id'], columns['epoch']))
+        columns = {name: values[order] for name, values in columns.items()}
+
+    tmp = path + '.tmp.npz'
+    np.savez_compressed(tmp, **columns)
+    os.replace(tmp, path)
+    _drop_cache(path, keep=_generation(path))
+    return columns
+
+# ============================================
+# ROLLUPS MINUTE / BOUGIE
+# ============================================
+
+def _rollups(symbol, columns):
+    """Agrégats par minute et par bougie du timeframe (une ligne par bucket)"""
+    rows = []
+    timeframes = columns['timeframe']
+    for timeframe in np.unique(timeframes):
+        mask = timeframes == timeframe
+        epoch = columns['epoch'][mask]
+        bar = timeframe_seconds(str(timeframe))
+        periods = [('M1', 60)] + ([('BAR', bar)] if bar and bar != 60 else [])
+        for period, seconds in periods:
+            buckets = epoch // seconds * seconds
+            starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+            ends = np.r_[starts[1:], len(buckets)]
+            bid = columns['bid'][mask]
+            trend = columns['trend'][mask]
+            momentum = columns['momentum_shift'][mask]
+            final = columns['final_signal'][mask] if 'final_signal' in columns else None
+            for start, end in zip(starts, ends):
+                rows.append((
+                    symbol, str(timeframe), period, int(buckets[start]),
+                    float(bid[start]), float(np.nanmax(bid[start:end])),
+                    float(np.nanmin(bid[start:end])), float(bid[end - 1]),
+                    int(end - start),
+                    int(np.count_nonzero(trend[start:end] == 'BULLISH')),
+                    int(np.count_nonzero(trend[start:end] == 'BEARISH')),
+                    int(np.count_nonzero(momentum[start:end] == 1)),
+                    str(trend[end - 1]),
+                    None if final is None or final[end - 1] == INT_NULL else int(final[end - 1]),
+                ))
+    return rows
+
+
+def _build_archive(symbol, day, rows, types):
+    """
+    Fichier d'archive et rollups d'un jour (calcul et disque, hors de la boucle d'événements).
+    Les rollups portent sur l'archive fusionnée: un run repris après un archivage partiel les remplace complets
+    """
+    columns = _write_archive(symbol, day, _to_columns(rows, types))
+    return _rollups(symbol, columns)
+
+
+def _archive_day(symbol, day, types):
+    """Archive un jour d'un symbole puis le retire de SQLite (rollups dans la même transaction)"""
+    start = f'{day} 00:00:00'
+    end = (datetime.strptime(day, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00')
+
+    conn = get_db()
+    rows = conn.execute('''
+        SELECT *, CAST(strftime('%s', created_at) AS INTEGER) AS epoch FROM signals
+        WHERE symbol = ? AND created_at >= ? AND created_at < ?
+        ORDER BY created_at, id
+    ''', (symbol, start, end)).fetchall()
+    conn.close()
+    if not rows:
+        return 0
+
+    rollups = run_blocking(_build_archive, symbol, day, rows, types)
+    max_id = max(row['id'] for row in rows)
+
+    def move(c):
+        c.executemany('''
+            INSERT OR REPLACE INTO signal_rollups
+            (symbol, timeframe, period, bucket, open, high, low, close,
+             signals, bullish, bearish, momentum_shifts, last_trend, last_final_signal)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rollups)
+        c.execute('''
+            DELETE FROM signals
+            WHERE symbol = ? AND created_at >= ? AND created_at < ? AND id <= ?
+        ''', (symbol, start, end, max_id))
+    db_write(move)
+    return len(rows)
+
+
+def run_retention(days=None):
+    """Archive tous les jours complets plus anciens que `days` jours"""
+    days = RETENTION_DAYS if days is None else days
+    if days <= 0:
+        return 0
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d 00:00:00')
+
+    conn = get_db()
+    groups = conn.execute('''
+        SELECT DISTINCT symbol, date(created_at) AS day FROM signals
+        WHERE created_at < ? ORDER BY day
+    ''', (cutoff,)).fetchall()
+    types = _column_types(conn)
+    conn.close()
+
+    archived = 0
+    for symbol, day in groups:
+        archived += _archive_day(symbol, day, types)
+    if archived:
+        log.info('%d signaux archivés (%d jours/symboles) dans %s/', archived, len(groups), ARCHIVE_DIR)
+    return archived
+
+
+def start_retention_thread():
+    """Lance l'archivage périodique en arrière-plan (si RETENTION_DAYS > 0)"""
+    if RETENTION_DAYS <= 0:
+        log.info('Archivage désactivé (RETENTION_DAYS=0): signals.db conserve tout l\'historique')
+        return None
+    log.warning('Archivage activé: les signaux de plus de %d jours quittent signals.db pour %s/',
+                RETENTION_DAYS, ARCHIVE_DIR)
+
+    def loop():
+        while True:
+            try:
+                run_retention()
+            except Exception as e:
+                log.exception('retention: %s', e)
+            time.sleep(RETENTION_INTERVAL)
+
+    thread = threading.Thread(target=loop, name='retention', daemon=True)
+    thread.start()
+    return thread
+
+# ============================================
+# LECTURE DES ARCHIVES (mmap)
+# ============================================
+
+_cache_lock = threading.Lock()
+
+
+def _cache_root(path):
+    """Répertoire des colonnes décompressées d'une archive (une génération par version de l'archive)"""
+    return os.path.join(ARCHIVE_DIR, '.cache', os.path.relpath(path, ARCHIVE_DIR)[:-len('.npz')])
+
+
+def _generation(path):
+    """Génération courante d'une archive: change à chaque réécriture (os.replace)"""
+    stat = os.stat(path)
+    return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+
+def _drop_cache(path, keep=None):
+    """
+    Supprime les générations périmées d'une archive réécrite.
+    Une génération encore ouverte en memory-map (PermissionError sous Windows) reste pour un prochain passage
+    """
+    root = _cache_root(path)
+    if not os.path.isdir(root):
+        return
+    with _cache_lock:
+        for name in os.listdir(root):
+            if name == keep:
+                continue
+            entry = os.path.join(root, name)
+            try:
+                if os.path.isdir(entry):
+                    shutil.rmtree(entry)
+                else:
+                    os.remove(entry)    # ancien cache sans génération
+            except OSError:
+                continue
+
+
+def open_archive(path):
+    """Colonnes d'une archive en memory-map (décompressées une fois en .npy, jamais réécrites une fois mappées)"""
+    generation = _generation(path)
+    directory = os.path.join(_cache_root(path), generation)
+    marker = os.path.join(directory, '.complete')
+    built = False
+    with _cache_lock:
+        if not os.path.exists(marker):
+            os.makedirs(directory, exist_ok=True)
+            with np.load(path) as archive:
+                for name in archive.files:
+                    np.save(os.path.join(directory, f'{name}.npy'), archive[name])
+            open(marker, 'w').close()
+            built = True
+    if built:
+        _drop_cache(path, keep=generation)
+    return {name[:-4]: np.load(os.path.join(directory, name), mmap_mode='r')
+            for name in os.listdir(directory) if name.endswith('.npy')}
+
+
+def list_archives(symbol=None):
+    """Archives disponibles [(symbol, day, path)], de la plus récente à la plus ancienne"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    archives = []
+    for folder in os.listdir(ARCHIVE_DIR):
+        directory = os.path.join(ARCHIVE_DIR, folder)
+        if folder.startswith('.') or not os.path.isdir(directory):
+            continue
+        for name in os.listdir(directory):
+            if name.endswith('.npz') and not name.endswith('.tmp.npz'):
+                archives.append((folder, name[:-4], os.path.join(directory, name)))
+    if symbol is not None:
+        safe = re.sub(r'[^A-Za-z0-9_.-]', '_', symbol)
+        archives = [a for a in archives if a[0] == safe]
+    archives.sort(key=lambda a: a[1], reverse=True)
+    return archives
+
+
+def _rows(columns, indexes):
+    """Lignes d'une archive (indices donnés) sous forme de signaux décodés"""
+    names = [name for name in columns if name != 'epoch']
+    values = []
+    for name in names:
+        column = columns[name]
+        data = column[indexes].tolist()
+        if column.dtype.kind == 'i':
+            data = [None if v == INT_NULL else v for v in data]
+        elif column.dtype.kind == 'f':
+            data = [None if v != v else v for v in data]
+        values.append(data)
+    return [decode_row(dict(zip(names, row))) for row in zip(*values)]
+
+
+def _day(epoch):
+    """Jour UTC (YYYY-MM-DD) d'un epoch, comme date(created_at)"""
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d')
+
+
+def iter_archived(symbol=None, timeframe=None, trend=None, start=None, end=None, after=None, before=None,
+                  descending=True, chunk=500):
+    """
+    Signaux archivés filtrés, triés par (epoch, id), décodés par paquets de `chunk`:
+    mémoire bornée par les index d'un jour. start/end: epoch [start, end[; after/before: clé (epoch, id) exclue
+    """
+    archives = list_archives(symbol)
+    days = sorted({day for _, day, _ in archives}, reverse=descending)
+    low = max(start if start is not None else float('-inf'), after[0] if after else float('-inf'))
+    high = min(end if end is not None else float('inf'), before[0] if before else float('inf'))
+    for day in days:
+        if (low != float('-inf') and day < _day(low)) or (high != float('inf') and day > _day(high)):
+            continue
+
+        candidates = []
+        for _, archive_day, path in archives:
+            if archive_day != day:
+                continue
+            columns = open_archive(path)
+            epoch, ids = columns['epoch'], columns['id']
+            mask = np.ones(len(ids), dtype=bool)
+            if symbol is not None:
+                mask &= columns['symbol'] == symbol
+            if timeframe is not None:
+                mask &= columns['timeframe'] == timeframe
+            if trend is not None:
+                mask &= columns['trend'] == trend
+            if start is not None:
+                mask &= epoch >= start
+            if end is not None:
+                mask &= epoch < end
+            if after is not None:
+                mask &= (epoch > after[0]) | ((epoch == after[0]) & (ids > after[1]))
+            if before is not None:
+                mask &= (epoch < before[0]) | ((epoch == before[0]) & (ids < before[1]))
+            for i in np.flatnonzero(mask):
+                candidates.append((int(epoch[i]), int(ids[i]), path, int(i)))
+        candidates.sort(reverse=descending)
+
+        for offset in range(0, len(candidates), chunk):
+            batch = candidates[offset:offset + chunk]
+            decoded = {}
+            for path in {path for _, _, path, _ in batch}:
+                indexes = [i for _, _, p, i in batch if p == path]
+                decoded.update(zip(((path, i) for i in indexes), _rows(open_archive(path), np.array(indexes))))
+            for _, _, path, i in batch:
+                yield decoded[(path, i)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Archive les signaux anciens hors de SQLite')
+    parser.add_argument('--db', default='signals.db')
+    parser.add_argument('--days', type=int, required=not RETENTION_DAYS, default=RETENTION_DAYS or None)
+    args = parser.parse_args()
+
+    database.DB_PATH = args.db
+    database.init_db()
+    run_retention(args.days)
+    database.stop_writer()
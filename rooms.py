@@ -0,0 +1,81 @@
+"""
+Crystal Heikin Ashi - Rooms Socket.IO
+Abonnements par symbole / symbole+timeframe, ALL explicite, protocole de diffusion négocié
+"""
+
+import threading
+
+ALL = 'ALL'
+
+# Sérialise les join/leave et les lectures des rooms du manager Socket.IO (dict partagé entre threads)
+rooms_lock = threading.Lock()
+
+# Protocoles des signaux: complet (new_signal), delta JSON ou delta binaire (signal_delta)
+PROTOCOL_FULL = 'full'
+PROTOCOL_DELTA = 'delta'
+PROTOCOL_BINARY = 'delta-bin'
+PROTOCOLS = (PROTOCOL_FULL, PROTOCOL_DELTA, PROTOCOL_BINARY)
+
+
+def room_for(symbol, timeframe=None, protocol=PROTOCOL_FULL):
+    """Nom de la room d'un abonnement (ALL, symbole ou symbole+timeframe) pour un protocole"""
+    if symbol == ALL:
+        room = 'all'
+    elif timeframe:
+        room = f'symbol:{symbol}:{timeframe}'
+    else:
+        room = f'symbol:{symbol}'
+    return room if protocol == PROTOCOL_FULL else f'{room}|{protocol}'
+
+
+def rooms_for(symbol, timeframe=None, protocol=PROTOCOL_FULL):
+    """Rooms intéressées par un message d'un symbole (hors ALL)"""
+    rooms = [room_for(symbol, protocol=protocol)]
+    if timeframe:
+        rooms.append(room_for(symbol, timeframe, protocol))
+    return rooms
+
+
+# Rooms ALL de tous les protocoles (événements hors signaux)
+ALL_ROOMS = [room_for(ALL, protocol=protocol) for protocol in PROTOCOLS]
+ALL_ROOM = ALL_ROOMS[0]
+
+
+def parse_protocol(data):
+    """Protocole demandé: {'protocol': 'delta', 'encoding': 'binary'|'json'} (complet par défaut)"""
+    if not isinstance(data, dict) or data.get('protocol') != PROTOCOL_DELTA:
+        return PROTOCOL_FULL
+    return PROTOCOL_BINARY if data.get('encoding') == 'binary' else PROTOCOL_DELTA
+
+
+def parse_subscription(data):
+    """[(symbole, timeframe)] depuis {'symbol', 'timeframe'} ou {'symbols': [...]}"""
+    data = data if isinstance(data, dict) else {'symbol': data}
+    timeframe = data.get('timeframe') or None
+    symbols = data.get('symbols')
+    if symbols is None:
+        symbols = [data.get('symbol') or ALL]
+    elif isinstance(symbols, str):
+        symbols = [symbols]
+    entries = []
+    for symbol in map(str, symbols):
+        if symbol.upper() == ALL:
+            entries.append((ALL, None))
+        else:
+            entries.append((symbol, timeframe))
+    return entries
+
+
+def open_rooms(manager, namespace='/'):
+    """Instantané des rooms ouvertes (les rooms vides sont supprimées par Socket.IO)"""
+    with rooms_lock:
+        return list(manager.rooms.get(namespace, {}))
+
+
+def symbol_rooms(manager, namespace='/'):
+    """{symbole: [rooms ouvertes]} pour les rooms symbole et symbole+timeframe, tous protocoles"""
+    symbols = {}
+    for room in open_rooms(manager, namespace):
+        if isinstance(room, str) and room.startswith('symbol:'):
+            symbols.setdefault(room.split('|')[0].split(':')[1], []).append(room)
+    return symbols
@@ -0,0 +1,245 @@
+"""
+Crystal Heikin Ashi - Schémas des payloads de l'EA
+Lecture unique du corps (JSON rapide, formulaire, texte brut) et validation champ par champ en une passe
+"""
+
+from datetime import datetime
+import json
+import math
+
+from confluence import FIELD_DEFAULTS
+from signal_store import NUMERIC_FIELDS
+from trade_queue import CONFIRM_STATUSES
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+FORM_MIMETYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+
+class PayloadError(ValueError):
+    """Corps de requête illisible (JSON invalide)"""
+
+
+class ValidationError(ValueError):
+    """Champs invalides: errors = [{'field', 'error', 'value'?}]"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(f"{e['field']}: {e['error']}" for e in errors))
+
+# ============================================
+# LECTURE DU CORPS
+# ============================================
+
+def read_payload(request):
+    """Corps de la requête -> objet Python: formulaire, sinon JSON (quel que soit le Content-Type de l'EA)"""
+    if request.mimetype in FORM_MIMETYPES:
+        form = request.form.to_dict()
+        if form:
+            return form
+    # WebRequest MT5: le tampon peut contenir le zéro terminal de la chaîne
+    raw = request.get_data(cache=True).strip(b' \t\r\n\0')
+    if not raw:
+        return {}
+    try:
+        return _loads(raw)
+    except ValueError as e:
+        raise PayloadError(f'JSON invalide: {e}')
+
+# ============================================
+# CONVERTISSEURS
+# ============================================
+
+def to_float(value):
+    if type(value) is float:
+        if math.isfinite(value):
+            return value
+    elif isinstance(value, (int, str)) and not isinstance(value, bool):
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError('nombre attendu')
+        if math.isfinite(number):
+            return number
+    else:
+        raise ValueError('nombre attendu')
+    raise ValueError('nombre fini attendu')
+
+
+def to_int(value):
+    if type(value) is int:
+        return value
+    if isinstance(value, bool):
+        return int(value)
+    number = to_float(value)
+    if not number.is_integer():
+        raise ValueError('entier attendu')
+    return int(number)
+
+
+def to_str(value):
+    if type(value) is str:
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError('texte attendu')
+
+
+def choice(*values):
+    """Texte limité à une liste de valeurs"""
+    allowed = frozenset(values)
+
+    def convert(value):
+        if value not in allowed:
+            raise ValueError(f"valeur attendue parmi {', '.join(values)}")
+        return value
+    return convert
+
+
+def now():
+    return datetime.now().isoformat()
+
+
+# Type accepté tel quel par chaque convertisseur (float fini: x - x == 0)
+FAST_TYPES = {to_float: float, to_int: int, to_str: str}
+
+# Défaut d'un champ obligatoire
+REQUIRED = object()
+
+
+def fields(*entries):
+    """Schéma compilé: (champ, convertisseur, défaut) -> (champ, type rapide, convertisseur, défaut)"""
+    return tuple((field, FAST_TYPES.get(convert), convert, default) for field, convert, default in entries)
+
+# ============================================
+# SCHÉMAS: (champ, convertisseur, défaut); défaut appelable = calculé à chaque requête
+# ============================================
+
+SIGNAL_SCHEMA = fields(
+    ('timestamp', to_str, now),
+    ('symbol', to_str, REQUIRED),
+    ('timeframe', to_str, 'M15'),
+    ('signal_type', to_str, 'UPDATE'),
+    ('ha_open', to_float, 0.0),
+    ('ha_high', to_float, 0.0),
+    ('ha_low', to_float, 0.0),
+    ('ha_close', to_float, 0.0),
+    ('trend', choice('BULLISH', 'BEARISH', 'NEUTRAL'), 'NEUTRAL'),
+    ('momentum_shift', to_int, 0),
+    ('bid', to_float, 0.0),
+    ('ask', to_float, 0.0),
+    ('spread', to_float, 0.0),
+    ('bar_time', to_int, 0),
+    *((field, to_float, 0.0) for field in NUMERIC_FIELDS),
+    ('harmonic_pattern', to_str, FIELD_DEFAULTS['harmonic_pattern']),
+    ('price_position', to_str, 'NEUTRAL'),
+    ('supertrend_direction', to_str, FIELD_DEFAULTS['supertrend_direction']),
+    ('candle_pattern', to_str, FIELD_DEFAULTS['candle_pattern']),
+    ('bollinger_direction', to_str, FIELD_DEFAULTS['bollinger_direction']),
+    ('fvg_type', to_str, FIELD_DEFAULTS['fvg_type']),
+    ('macd_trend', to_str, FIELD_DEFAULTS['macd_trend']),
+    ('mtf_trend', to_str, FIELD_DEFAULTS['mtf_trend']),
+)
+
+TRADE_CONFIRM_SCHEMA = fields(
+    ('status', choice(*CONFIRM_STATUSES), 'executed'),
+    ('ticket', to_int, 0),
+)
+
+# Commandes du dashboard (/api/trade, /api/close_position, /api/modify_position, /api/close_all)
+TRADE_SCHEMA = fields(
+    ('symbol', to_str, REQUIRED),
+    ('action', choice('BUY', 'SELL', 'CLOSE', 'CLOSE_ALL', 'MODIFY'), REQUIRED),
+    ('volume', to_float, 0.01),
+    ('price', to_float, 0.0),
+    ('sl', to_float, 0.0),
+    ('tp', to_float, 0.0),
+    ('consumer', to_str, None),
+    ('idempotency_key', to_str, None),
+)
+
+TICKET_COMMAND_SCHEMA = fields(
+    ('ticket', to_int, REQUIRED),
+    ('sl', to_float, None),
+    ('tp', to_float, None),
+    ('consumer', to_str, None),
+)
+
+CLOSE_ALL_SCHEMA = fields(
+    ('consumer', to_str, None),
+)
+
+POSITION_SCHEMA = fields(
+    ('ticket', to_int, REQUIRED),
+    ('symbol', to_str, REQUIRED),
+    ('type', to_str, ''),
+    ('volume', to_float, 0.0),
+    ('open_price', to_float, 0.0),
+    ('current_price', to_float, 0.0),
+    ('sl', to_float, 0.0),
+    ('tp', to_float, 0.0),
+    ('profit', to_float, 0.0),
+    ('open_time', to_str, now),
+)
+
+ACCOUNT_SCHEMA = fields(
+    ('balance', to_float, 0.0),
+    ('equity', to_float, 0.0),
+    ('margin', to_float, 0.0),
+    ('free_margin', to_float, 0.0),
+)
+
+# ============================================
+# VALIDATION
+# ============================================
+
+def validate(data, schema, prefix=''):
+    """Dict brut -> dict typé selon le schéma; ValidationError avec toutes les erreurs (champ absent/vide = défaut)"""
+    if not isinstance(data, dict):
+        raise ValidationError([{'field': prefix.rstrip('.') or '$', 'error': 'objet JSON attendu'}])
+    result = {}
+    errors = None
+    get = data.get
+    for field, fast, convert, default in schema:
+        value = get(field)
+        # Chemin rapide: valeur déjà du bon type (cas de l'EA); '' prend le défaut comme une valeur absente
+        if type(value) is fast and value != '':
+            if fast is not float or value - value == 0.0:
+                result[field] = value
+                continue
+        if value is None or value == '':
+            if default is REQUIRED:
+                errors = errors or []
+                errors.append({'field': prefix + field, 'error': 'champ requis'})
+            else:
+                result[field] = default() if callable(default) else default
+            continue
+        try:
+            result[field] = convert(value)
+        except ValueError as e:
+            errors = errors or []
+            errors.append({'field': prefix + field, 'error': str(e), 'value': value})
+    if errors:
+        raise ValidationError(errors)
+    return result
+
+
+def validate_list(items, schema, name):
+    """Liste de dicts (positions...) validés; erreurs préfixées par name[index]"""
+    if not isinstance(items, list):
+        raise ValidationError([{'field': name, 'error': 'liste attendue'}])
+    results = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            results.append(validate(item, schema, f'{name}[{index}].'))
+        except ValidationError as e:
+            errors += e.errors
+    if errors:
+        raise ValidationError(errors)
+    return results
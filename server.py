@@ -0,0 +1,118 @@
+"""
+Crystal Heikin Ashi - Serveur de production
+Worker asynchrone coopératif (eventlet ou gevent), SQLite dans un pool de threads natifs, arrêt propre sur SIGTERM
+Usage: python server.py [--host 0.0.0.0] [--port 5000] [--async-mode eventlet|gevent] [--db-threads 8]
+"""
+
+import argparse
+import os
+import signal
+import sys
+
+SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('SERVER_PORT', 5000))
+DB_THREADS = int(os.environ.get('DB_THREADS', 8))                  # threads natifs pour SQLite
+MAX_CONNECTIONS = int(os.environ.get('MAX_CONNECTIONS', 1000))     # greenlets (requêtes + WebSockets)
+DRAIN_TIMEOUT = float(os.environ.get('DRAIN_TIMEOUT', 10))
+
+
+def detect_async_mode():
+    """eventlet si installé, sinon gevent"""
+    for mode in ('eventlet', 'gevent'):
+        try:
+            __import__(mode)
+            return mode
+        except ImportError:
+            continue
+    sys.exit("Mode production: installer eventlet (pip install eventlet) ou gevent + gevent-websocket")
+
+
+def patch(mode, db_threads):
+    """Monkey patching (avant l'import de l'application); retourne l'exécuteur natif des appels SQLite"""
+    if mode == 'eventlet':
+        os.environ['EVENTLET_THREADPOOL_SIZE'] = str(db_threads)
+        import eventlet
+        eventlet.monkey_patch()
+        from eventlet import tpool
+        return tpool.execute
+
+    from gevent import monkey
+    monkey.patch_all()
+    from gevent.threadpool import ThreadPool
+    pool = ThreadPool(db_threads)
+    return lambda fn, *args: pool.apply(fn, args)
+
+
+def stop_server(mode, socketio, main):
+    """Arrête la boucle d'acceptation du serveur WSGI"""
+    if mode == 'gevent':
+        socketio.wsgi_server.stop()
+    else:
+        import eventlet.hubs
+        eventlet.hubs.get_hub().schedule_call_global(0, main.throw, SystemExit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default=SERVER_HOST)
+    parser.add_argument('--port', type=int, default=SERVER_PORT)
+    parser.add_argument('--async-mode', choices=['eventlet', 'gevent'], default=os.environ.get('ASYNC_MODE'))
+    parser.add_argument('--db-threads', type=int, default=DB_THREADS)
+    parser.add_argument('--max-connections', type=int, default=MAX_CONNECTIONS)
+    parser.add_argument('--drain-timeout', type=float, default=DRAIN_TIMEOUT)
+    args = parser.parse_args()
+
+    mode = args.async_mode if args.async_mode in ('eventlet', 'gevent') else detect_async_mode()
+    executor = patch(mode, args.db_threads)
+    os.environ['ASYNC_MODE'] = mode
+
+    import greenlet
+    import database
+    database.set_offload(executor)
+    import app as bridge
+    from logs import get_logger
+    from retention import start_retention_thread
+
+    log = get_logger('APP')
+    bridge.init_db()
+    bridge.load_state_cache()
+    start_retention_thread()
+    bridge.dashboard_pusher.start()
+
+    main_greenlet = greenlet.getcurrent()
+    stopping = []
+
+    def shutdown():
+        abandoned = bridge.drain(args.drain_timeout)
+        if abandoned:
+            log.warning('Arrêt: %d requêtes encore en cours après %.0f s', abandoned, args.drain_timeout)
+        log.info('Signaux diffusés et sauvegardés, arrêt du serveur')
+        stop_server(mode, bridge.socketio, main_greenlet)
+
+    def on_signal(signum, frame):
+        if not stopping:
+            stopping.append(signum)
+            log.info('Signal %d reçu: arrêt propre (drain %.0f s max)', signum, args.drain_timeout)
+            bridge.socketio.start_background_task(shutdown)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    def heartbeat():
+        # Les handlers de signaux Python ne s'exécutent qu'au réveil du thread principal (hub inactif = jamais)
+        while not stopping:
+            bridge.socketio.sleep(0.5)
+
+    bridge.socketio.start_background_task(heartbeat)
+
+    options = {'max_size': args.max_connections} if mode == 'eventlet' else {'spawn': args.max_connections}
+    log.info('Serveur %s sur http://%s:%d (SQLite: %d threads, %d connexions max)',
+             mode, args.host, args.port, args.db_threads, args.max_connections)
+    try:
+        bridge.socketio.run(bridge.app, host=args.host, port=args.port, log_output=False, **options)
+    except SystemExit:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""
+Crystal Heikin Ashi - Stockage compact des signaux
+Colonnes typées pour les niveaux, énumérations codées en entiers, résultat de confluence,
+une ligne par bougie mise à jour sur place (upsert) et une nouvelle ligne par transition
+"""
+
+import os
+
+from confluence import FINAL_SIGNALS, FIELD_DEFAULTS
+from database import on_rollback
+
+# 'upsert': une ligne par (symbole, timeframe, bougie, type) et par transition; 'append': une ligne par envoi
+SIGNAL_INGEST_MODE = os.environ.get('SIGNAL_INGEST_MODE', 'upsert')
+
+# Colonnes historiques (schéma initial)
+BASE_FIELDS = ('timestamp', 'symbol', 'timeframe', 'signal_type',
+               'ha_open', 'ha_high', 'ha_low', 'ha_close', 'trend', 'momentum_shift',
+               'bid', 'ask', 'spread')
+
+# Niveaux des indicateurs (REAL: une valeur entière comme 0 est stockée sur 0 octet)
+NUMERIC_FIELDS = ('resistance', 'support', 'supply_zone', 'demand_zone',
+                  'vwap', 'vwap_upper', 'vwap_lower', 'poc',
+                  'supertrend_up', 'supertrend_down',
+                  'fibo_level1', 'fibo_level2', 'fibo_level3',
+                  'anchored_vwap', 'drawfib_level1', 'drawfib_level2', 'drawfib_level3',
+                  'bollinger_signal', 'fvg_high', 'fvg_low',
+                  'macd_main', 'macd_signal', 'pro_resistance', 'pro_support')
+
+# Directions des indicateurs (INTEGER codé, voir ENUM_CODES)
+ENUM_FIELDS = ('harmonic_pattern', 'price_position', 'supertrend_direction',
+               'candle_pattern', 'bollinger_direction', 'fvg_type', 'macd_trend', 'mtf_trend')
+
+# Résultat de la confluence
+CONFLUENCE_FIELDS = ('bullish_score', 'bearish_score', 'total_indicators', 'final_signal')
+
+# Valeurs envoyées par l'EA; une valeur inconnue est stockée NULL
+ENUM_CODES = {
+    'NEUTRAL': 0,
+    'BULLISH': 1,
+    'BEARISH': 2,
+    'NONE': 3,
+    'DETECTED': 4,
+    'ABOVE_VWAP': 5,
+    'BELOW_VWAP': 6,
+    '': 7,
+}
+ENUM_VALUES = {code: value for value, code in ENUM_CODES.items()}
+FINAL_CODES = {value: code for code, value in enumerate(FINAL_SIGNALS)}
+
+COLUMNS = BASE_FIELDS + NUMERIC_FIELDS + ENUM_FIELDS + CONFLUENCE_FIELDS
+
+INSERT_SQL = f'''
+    INSERT INTO signals ({', '.join(COLUMNS)})
+    VALUES ({', '.join('?' * len(COLUMNS))})
+'''
+
+# Ligne de la bougie en cours: mise à jour sur place tant que l'état (TRANSITION_FIELDS) ne change pas
+BAR_KEY = ('symbol', 'timeframe', 'bar_time', 'signal_type', 'revision')
+UPSERT_SQL = f'''
+    INSERT INTO signals ({', '.join(COLUMNS)}, bar_time, revision)
+    VALUES ({', '.join('?' * (len(COLUMNS) + 2))})
+    ON CONFLICT ({', '.join(BAR_KEY)}) WHERE bar_time IS NOT NULL DO UPDATE SET
+        {', '.join(f'{f} = excluded.{f}' for f in COLUMNS if f not in BAR_KEY)}, updates = updates + 1
+'''
+
+# Changement d'un de ces champs dans une bougie = transition, conservée comme ligne distincte
+TRANSITION_FIELDS = ('trend', 'momentum_shift', 'final_signal')
+
+
+def encode_signal(signal):
+    """Tuple de valeurs pour INSERT_SQL (signal issu de parse_signal)"""
+    confluence = signal.get('confluence') or {}
+    return (tuple(signal[f] for f in BASE_FIELDS)
+            + tuple(signal[f] for f in NUMERIC_FIELDS)
+            + tuple(ENUM_CODES.get(signal.get(f)) for f in ENUM_FIELDS)     # absent (replay, import): NULL
+            + (confluence.get('bullish_score'), confluence.get('bearish_score'),
+               confluence.get('total_indicators'), FINAL_CODES.get(confluence.get('final_signal'))))
+
+
+def save_signals(c, signals):
+    """Enregistre une liste de signaux (commit à la charge de l'appelant, exécuté par l'écrivain)"""
+    if SIGNAL_INGEST_MODE != 'upsert':
+        c.executemany(INSERT_SQL, [encode_signal(s) for s in signals])
+        return
+    appended = [encode_signal(s) for s in signals if not s.get('bar_time')]
+    upserted = [encode_signal(s) + (s['bar_time'], bar_revisions.resolve(c, s)) for s in signals if s.get('bar_time')]
+    if appended:
+        c.executemany(INSERT_SQL, appended)
+    if upserted:
+        c.executemany(UPSERT_SQL, upserted)
+
+
+class BarRevisions:
+    """
+    Révision courante de la bougie de chaque flux (symbole, timeframe, type).
+    Utilisé uniquement par l'écrivain (thread unique): pas de verrou
+    """
+
+    def __init__(self):
+        self._streams = {}      # (symbole, timeframe, type) -> (bar_time, révision, état)
+
+    def resolve(self, c, signal):
+        """Révision à écrire: la même tant que l'état est inchangé, la suivante à chaque transition"""
+        stream = (signal['symbol'], signal['timeframe'], signal['signal_type'])
+        bar_time = signal['bar_time']
+        confluence = signal.get('confluence') or {}
+        state = (signal['trend'], signal['momentum_shift'], FINAL_CODES.get(confluence.get('final_signal')))
+
+        current = self._streams.get(stream)
+        if current is None or current[0] != bar_time:
+            # Bougie inconnue du cache (nouvelle bougie ou redémarrage): dernière révision en base
+            row = c.execute(f'''
+                SELECT revision, {', '.join(TRANSITION_FIELDS)} FROM signals
+                WHERE symbol = ? AND timeframe = ? AND bar_time = ? AND signal_type = ?
+                ORDER BY revision DESC LIMIT 1
+            ''', (stream[0], stream[1], bar_time, stream[2])).fetchone()
+            current = (bar_time, row[0], tuple(row[1:])) if row else (bar_time, 0, state)
+
+        revision = current[1] if current[2] == state else current[1] + 1
+        self._streams[stream] = (bar_time, revision, state)
+        return revision
+
+    def clear(self):
+        """Écriture annulée (savepoint ou lot): le cache peut contenir des révisions absentes de la base"""
+        self._streams.clear()
+
+
+# Révisions uniques du processus (état de l'écrivain)
+bar_revisions = BarRevisions()
+on_rollback(bar_revisions.clear)
+
+
+def decode_row(row):
+    """Dict d'un signal stocké, énumérations décodées et confluence regroupée"""
+    signal = dict(row)
+    for field in ENUM_FIELDS:
+        if field in signal:
+            value = signal[field]
+            signal[field] = FIELD_DEFAULTS.get(field, 'NEUTRAL') if value is None else ENUM_VALUES.get(value, value)
+    if signal.get('final_signal') is not None:
+        signal['confluence'] = {
+            'bullish_score': signal.pop('bullish_score'),
+            'bearish_score': signal.pop('bearish_score'),
+            'total_indicators': signal.pop('total_indicators'),
+            'final_signal': FINAL_SIGNALS[signal.pop('final_signal')],
+        }
+    else:
+        for field in CONFLUENCE_FIELDS:
+            signal.pop(field, None)
+    return signal
+
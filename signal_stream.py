@@ -0,0 +1,187 @@
+"""
+Crystal Heikin Ashi - Flux delta des signaux
+État courant par symbole/timeframe, numéros de séquence et encodage binaire compact des deltas
+"""
+
+import json
+import struct
+import threading
+
+from confluence import FINAL_SIGNALS
+from signal_store import COLUMNS, CONFLUENCE_FIELDS, ENUM_CODES
+
+# Champs d'un signal aplati (confluence.* pour le résultat de la confluence); id = index (uint8)
+FIELDS = [f for f in COLUMNS if f not in CONFLUENCE_FIELDS] + [
+    'confluence.bullish_score', 'confluence.bearish_score', 'confluence.total_indicators',
+    'confluence.bullish_count', 'confluence.bearish_count', 'confluence.final_signal', 'confluence.indicators',
+]
+FIELD_IDS = {field: i for i, field in enumerate(FIELDS)}
+UNKNOWN_FIELD = 255
+
+# Chaînes fréquentes codées sur un octet
+DICTIONARY = list(ENUM_CODES) + [s for s in FINAL_SIGNALS if s not in ENUM_CODES]
+DICTIONARY_CODES = {value: i for i, value in enumerate(DICTIONARY)}
+
+# Types de valeur de l'encodage binaire
+T_FLOAT, T_DICT, T_STR, T_INT, T_NULL, T_JSON = range(6)
+
+_MISSING = object()
+
+
+def stream_key(symbol, timeframe):
+    return f'{symbol}|{timeframe}'
+
+
+def flatten(signal):
+    """Signal imbriqué -> dict plat (confluence.*)"""
+    flat = {k: v for k, v in signal.items() if k != 'confluence'}
+    for key, value in (signal.get('confluence') or {}).items():
+        flat[f'confluence.{key}'] = value
+    return flat
+
+
+def unflatten(flat):
+    """Dict plat -> signal imbriqué (format de new_signal)"""
+    signal = {}
+    confluence = {}
+    for key, value in flat.items():
+        if key.startswith('confluence.'):
+            confluence[key[len('confluence.'):]] = value
+        else:
+            signal[key] = value
+    if confluence:
+        signal['confluence'] = confluence
+    return signal
+
+
+def encode_changes(changes):
+    """Champs modifiés -> bytes: [id u8][type u8][valeur], id 255 suivi du nom pour un champ hors table"""
+    out = bytearray()
+    for field, value in changes.items():
+        field_id = FIELD_IDS.get(field)
+        if field_id is None:
+            name = field.encode('utf-8')[:255]
+            out += struct.pack('<BB', UNKNOWN_FIELD, len(name)) + name
+        else:
+            out.append(field_id)
+
+        if value is None:
+            out.append(T_NULL)
+        elif isinstance(value, bool):
+            out += struct.pack('<Bi', T_INT, int(value))
+        elif isinstance(value, int) and -2**31 <= value < 2**31:
+            out += struct.pack('<Bi', T_INT, value)
+        elif isinstance(value, (int, float)):
+            out += struct.pack('<Bd', T_FLOAT, value)
+        elif isinstance(value, str) and value in DICTIONARY_CODES:
+            out += struct.pack('<BB', T_DICT, DICTIONARY_CODES[value])
+        elif isinstance(value, str):
+            data = value.encode('utf-8')
+            out += struct.pack('<BH', T_STR, len(data)) + data
+        else:
+            data = json.dumps(value, separators=(',', ':')).encode('utf-8')
+            out += struct.pack('<BI', T_JSON, len(data)) + data
+    return bytes(out)
+
+
+def decode_changes(data):
+    """Inverse de encode_changes (clients Python, tests)"""
+    changes = {}
+    offset = 0
+    while offset < len(data):
+        field_id = data[offset]
+        offset += 1
+        if field_id == UNKNOWN_FIELD:
+            length = data[offset]
+            field = data[offset + 1:offset + 1 + length].decode('utf-8')
+            offset += 1 + length
+        else:
+            field = FIELDS[field_id]
+        kind = data[offset]
+        offset += 1
+        if kind == T_NULL:
+            value = None
+        elif kind == T_INT:
+            value = struct.unpack_from('<i', data, offset)[0]
+            offset += 4
+        elif kind == T_FLOAT:
+            value = struct.unpack_from('<d', data, offset)[0]
+            offset += 8
+        elif kind == T_DICT:
+            value = DICTIONARY[data[offset]]
+            offset += 1
+        elif kind == T_STR:
+            length = struct.unpack_from('<H', data, offset)[0]
+            value = data[offset + 2:offset + 2 + length].decode('utf-8')
+            offset += 2 + length
+        else:
+            length = struct.unpack_from('<I', data, offset)[0]
+            value = json.loads(data[offset + 4:offset + 4 + length].decode('utf-8'))
+            offset += 4 + length
+        changes[field] = value
+    return changes
+
+
+class SignalStreams:
+    """Dernier état connu et séquence de chaque flux symbole/timeframe"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._streams = {}      # clé -> [seq, signal aplati]
+
+    def update(self, signal):
+        """Applique un signal; retourne le delta {symbol, timeframe, seq, changes}"""
+        flat = flatten(signal)
+        key = stream_key(signal['symbol'], signal['timeframe'])
+        with self.lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                stream = self._streams[key] = [0, {}]
+            previous = stream[1]
+            changes = {k: v for k, v in flat.items() if previous.get(k, _MISSING) != v}
+            for k in previous.keys() - flat.keys():
+                changes[k] = None
+            stream[0] += 1
+            stream[1] = flat
+            return {'symbol': signal['symbol'], 'timeframe': signal['timeframe'], 'seq': stream[0],
+                    'changes': changes}
+
+    def seed(self, signals):
+        """État initial (derniers signaux stockés) au démarrage, séquence 0"""
+        with self.lock:
+            for signal in signals:
+                flat = {k: v for k, v in flatten(signal).items() if k not in ('id', 'created_at')}
+                self._streams.setdefault(stream_key(signal['symbol'], signal['timeframe']), [0, flat])
+
+    def snapshot(self, symbol=None, timeframe=None):
+        """État complet des flux (tous, d'un symbole ou d'un symbole/timeframe)"""
+        with self.lock:
+            streams = []
+            for key, (seq, flat) in self._streams.items():
+                if symbol is not None and flat.get('symbol') != symbol:
+                    continue
+                if timeframe is not None and flat.get('timeframe') != timeframe:
+                    continue
+                streams.append({'symbol': flat.get('symbol'), 'timeframe': flat.get('timeframe'),
+                                'seq': seq, 'signal': unflatten(flat)})
+            return streams
+
+
+def snapshot_message(streams, binary=False):
+    """Message signal_snapshot (table des champs et dictionnaire pour les clients binaires)"""
+    message = {'streams': streams}
+    if binary:
+        message.update({'fields': FIELDS, 'dictionary': DICTIONARY})
+    return message
+
+
+def delta_message(deltas, binary=False):
+    """Message signal_delta: changements en JSON ou encodés (champ data)"""
+    if not binary:
+        return {'deltas': deltas}
+    return {'deltas': [{'symbol': d['symbol'], 'timeframe': d['timeframe'], 'seq': d['seq'],
+                        'data': encode_changes(d['changes'])} for d in deltas]}
+
+
+# Flux unique du processus
+signal_streams = SignalStreams()
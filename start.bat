@@ -20,12 +20,15 @@ if not exist "venv" (
     pip install -r requirements.txt
 ) else (
     call venv\Scripts\activate
+    REM Environnement existant: ajouter eventlet (server.py) s'il manque
+    python -c "import eventlet" >nul 2>&1 || pip install -r requirements.txt
 )
 
 echo.
 echo Demarrage du serveur...
 echo Dashboard: http://localhost:5000
 echo.
-python app.py
+REM Serveur de production (eventlet); python app.py pour le mode developpement
+python server.py
 
 pause
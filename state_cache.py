@@ -0,0 +1,129 @@
+"""
+Crystal Heikin Ashi - Cache d'état en mémoire
+Dernier signal par symbole/timeframe et compteurs glissants 24h (buckets d'une minute)
+"""
+
+from collections import deque
+import threading
+import time
+
+from confluence import FINAL_SIGNALS
+
+WINDOW_SECONDS = 24 * 3600
+BUCKET_SECONDS = 60
+
+# Champs conservés pour le dernier signal de chaque symbole/timeframe
+LATEST_FIELDS = ('symbol', 'timeframe', 'trend', 'momentum_shift', 'bid', 'ask', 'timestamp')
+
+
+class SignalStateCache:
+    """État partagé du processus, mis à jour à chaque signal reçu"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest = {}           # (symbol, timeframe) -> dict
+        self._buckets = deque()     # [bucket, {trend: count}, momentum_count]
+        self._trend_totals = {}
+        self._momentum_total = 0
+        self.loaded = False
+
+    def record(self, signal, now=None):
+        """Enregistre un signal (dict issu de parse_signal)"""
+        now = time.time() if now is None else now
+        latest = {field: signal.get(field) for field in LATEST_FIELDS}
+        if 'confluence' in signal:
+            latest['final_signal'] = signal['confluence']['final_signal']
+        latest['received_at'] = now
+        with self._lock:
+            self._latest[(signal['symbol'], signal['timeframe'])] = latest
+            self._add(int(now // BUCKET_SECONDS), signal.get('trend'), 1, 1 if signal.get('momentum_shift') == 1 else 0)
+            self._expire(now)
+
+    def _add(self, bucket, trend, count, momentum):
+        """Ajoute des compteurs au bucket (les buckets restent triés)"""
+        if self._buckets and self._buckets[-1][0] == bucket:
+            entry = self._buckets[-1]
+        elif not self._buckets or self._buckets[-1][0] < bucket:
+            entry = [bucket, {}, 0]
+            self._buckets.append(entry)
+        else:
+            # Bucket plus ancien (reconstruction): recherche depuis la fin
+            entry = None
+            for candidate in reversed(self._buckets):
+                if candidate[0] == bucket:
+                    entry = candidate
+                    break
+                if candidate[0] < bucket:
+                    break
+            if entry is None:
+                entry = [bucket, {}, 0]
+                self._buckets.append(entry)
+                self._buckets = deque(sorted(self._buckets, key=lambda b: b[0]))
+        entry[1][trend] = entry[1].get(trend, 0) + count
+        entry[2] += momentum
+        self._trend_totals[trend] = self._trend_totals.get(trend, 0) + count
+        self._momentum_total += momentum
+
+    def _expire(self, now):
+        """Retire les buckets sortis de la fenêtre de 24h"""
+        oldest = int((now - WINDOW_SECONDS) // BUCKET_SECONDS)
+        while self._buckets and self._buckets[0][0] <= oldest:
+            bucket, trends, momentum = self._buckets.popleft()
+            for trend, count in trends.items():
+                remaining = self._trend_totals.get(trend, 0) - count
+                if remaining > 0:
+                    self._trend_totals[trend] = remaining
+                else:
+                    self._trend_totals.pop(trend, None)
+            self._momentum_total -= momentum
+
+    def stats(self, now=None):
+        """Compteurs 24h et dernier signal par symbole/timeframe, sans accès SQLite"""
+        now = time.time() if now is None else now
+        with self._lock:
+            self._expire(now)
+            latest = sorted(self._latest.values(), key=lambda s: s['received_at'], reverse=True)
+            return {
+                'trend_stats': dict(self._trend_totals),
+                'momentum_shifts_24h': self._momentum_total,
+                'latest_by_symbol': [{k: v for k, v in s.items() if k != 'received_at'} for s in latest],
+            }
+
+    def rebuild(self, conn):
+        """Reconstruit le cache depuis la base (au démarrage)"""
+        rows = conn.execute('''
+            SELECT s.symbol, s.timeframe, s.trend, s.momentum_shift, s.bid, s.ask, s.timestamp, s.final_signal,
+                   CAST(strftime('%s', s.created_at) AS INTEGER) AS created
+            FROM signals s
+            JOIN (SELECT MAX(id) AS id FROM signals GROUP BY symbol, timeframe) last ON last.id = s.id
+        ''').fetchall()
+        # Une ligne par bougie/transition (upsert): updates = nombre d'envois fusionnés, comptés comme en direct
+        buckets = conn.execute(f'''
+            SELECT CAST(strftime('%s', created_at) AS INTEGER) / {BUCKET_SECONDS} AS bucket, trend,
+                   SUM(COALESCE(updates, 1)) AS count, SUM((momentum_shift = 1) * COALESCE(updates, 1)) AS momentum
+            FROM signals
+            WHERE created_at > datetime('now', '-24 hours')
+            GROUP BY bucket, trend
+            ORDER BY bucket
+        ''').fetchall()
+
+        with self._lock:
+            self._latest = {}
+            self._buckets = deque()
+            self._trend_totals = {}
+            self._momentum_total = 0
+            for row in rows:
+                latest = {field: row[field] for field in LATEST_FIELDS}
+                if row['final_signal'] is not None:
+                    latest['final_signal'] = FINAL_SIGNALS[row['final_signal']]
+                latest['received_at'] = row['created'] or 0
+                self._latest[(row['symbol'], row['timeframe'])] = latest
+            for row in buckets:
+                self._add(row['bucket'], row['trend'], row['count'], row['momentum'] or 0)
+            self._expire(time.time())
+            self.loaded = True
+        return len(rows)
+
+
+# Cache unique du processus
+state_cache = SignalStateCache()
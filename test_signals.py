@@ -1,16 +1,32 @@
 """
 Script de test - Simule l'envoi de signaux comme le ferait l'EA MT5
 Utile pour tester le dashboard sans MT5
+
+    python test_signals.py            # séquence de signaux toutes les 2-5 s
+    python test_signals.py --single   # un seul signal
+    python test_signals.py --bench    # benchmark de charge (voir --bench --help)
+
+Dépendances (requests, websocket-client): pip install -r requirements-dev.txt
 """
 
+import argparse
+import http.client
+import json
+import os
 import requests
+import subprocess
+import sys
+import tempfile
+import threading
 import time
 import random
+import shutil
 from datetime import datetime
+from urllib.parse import urlsplit
 
 FLASK_URL = "http://localhost:5000"
 
-def generate_signal(trend=None, momentum_shift=False):
+def generate_signal(trend=None, momentum_shift=False, symbol="USDCHF"):
     """Génère un signal simulé"""
     
     if trend is None:
@@ -22,7 +38,7 @@ def generate_signal(trend=None, momentum_shift=False):
     
     signal = {
         "timestamp": datetime.now().isoformat(),
-        "symbol": "USDCHF",
+        "symbol": symbol,
         "timeframe": "H1",
         "signal_type": "MOMENTUM_SHIFT" if momentum_shift else "NEW_BAR",
         "ha_open": base_price + random.uniform(-0.001, 0.001),
@@ -97,10 +113,373 @@ def send_single_signal():
     signal = generate_signal("BULLISH", momentum_shift=True)
     send_signal(signal)
 
+# ============================================
+# BENCHMARK DE CHARGE
+# ============================================
+
+SYMBOLS = ["EURUSD", "GBPUSD", "USDJPY", "USDCHF", "XAUUSD", "AUDUSD", "NZDUSD", "USDCAD"]
+
+
+def bench_symbols(count):
+    """Liste de `count` symboles (réels puis synthétiques)"""
+    return [SYMBOLS[i] if i < len(SYMBOLS) else f"SYM{i:03d}" for i in range(count)]
+
+
+def percentile(values, p):
+    """Percentile (rang le plus proche) d'une liste triée"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class LatencyRecorder:
+    """Latences (ms) et erreurs par opération, partagées entre les threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def add(self, operation, latency_ms):
+        with self._lock:
+            self.samples.setdefault(operation, []).append(latency_ms)
+
+    def error(self, operation):
+        with self._lock:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def summary(self, duration):
+        """p50/p95/p99, débit et taux d'erreur par opération"""
+        results = {}
+        with self._lock:
+            operations = sorted(set(self.samples) | set(self.errors))
+            for operation in operations:
+                values = sorted(self.samples.get(operation, []))
+                errors = self.errors.get(operation, 0)
+                total = len(values) + errors
+                results[operation] = {
+                    'count': len(values),
+                    'errors': errors,
+                    'error_rate': round(errors / total * 100, 2) if total else 0.0,
+                    'throughput': round(len(values) / duration, 1) if duration else 0.0,
+                    'p50_ms': round(percentile(values, 50), 2),
+                    'p95_ms': round(percentile(values, 95), 2),
+                    'p99_ms': round(percentile(values, 99), 2),
+                    'max_ms': round(values[-1], 2) if values else 0.0,
+                }
+        return results
+
+
+class HttpClient:
+    """Connexion HTTP keep-alive (une par thread), bibliothèque standard uniquement"""
+
+    def __init__(self, url, timeout=10):
+        parts = urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """Retourne (status, headers, corps décodé JSON ou None)"""
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in (1, 2):
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # Connexion keep-alive fermée par le serveur: une seule reconnexion
+                self.connection.close()
+                if attempt == 2:
+                    raise
+        try:
+            payload = json.loads(data) if data else None
+        except ValueError:
+            payload = None
+        return response.status, response.headers, payload
+
+    def close(self):
+        self.connection.close()
+
+
+class Pacer:
+    """Cadence globale partagée par les workers (0 = le plus vite possible)"""
+
+    def __init__(self, rate, deadline):
+        self._lock = threading.Lock()
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self.deadline = deadline
+
+    def wait(self):
+        """Attend le prochain créneau; False une fois la durée écoulée"""
+        with self._lock:
+            slot = self._next
+            self._next = max(self._next, time.monotonic() - 1.0) + self._interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        return time.monotonic() < self.deadline
+
+
+class LoadGenerator:
+    """Pilote /api/signal, /api/pending_trades, /api/trade + confirm et des abonnés Socket.IO"""
+
+    def __init__(self, args):
+        self.args = args
+        self.recorder = LatencyRecorder()
+        self.symbols = bench_symbols(args.symbols)
+        self.sent_signals = 0
+        self.received_events = 0
+        self.trade_started = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _timed(self, client, operation, method, path, body=None, headers=None, expected=(200,)):
+        start = time.perf_counter()
+        try:
+            status, response_headers, payload = client.request(method, path, body, headers)
+        except Exception:
+            self.recorder.error(operation)
+            return None, None, None
+        if status not in expected:
+            self.recorder.error(operation)
+            return status, response_headers, payload
+        self.recorder.add(operation, (time.perf_counter() - start) * 1000)
+        return status, response_headers, payload
+
+    def signal_worker(self, pacer):
+        """Envoie des signaux (unitaires ou par lot) à la cadence partagée"""
+        client = HttpClient(self.args.url)
+        batch = self.args.batch
+        while not self._stop.is_set() and pacer.wait():
+            signals = [generate_signal(random.choice(["BULLISH", "BEARISH"]), random.random() < 0.1,
+                                       random.choice(self.symbols)) for _ in range(batch)]
+            if batch > 1:
+                status, _, _ = self._timed(client, 'signals_batch', 'POST', '/api/signals/batch', signals)
+            else:
+                status, _, _ = self._timed(client, 'signal', 'POST', '/api/signal', signals[0])
+            if status == 200:
+                with self._lock:
+                    self.sent_signals += batch
+        client.close()
+
+    def trade_worker(self, pacer):
+        """Met des commandes en file comme le dashboard"""
+        client = HttpClient(self.args.url)
+        while not self._stop.is_set() and pacer.wait():
+            trade = {'symbol': random.choice(self.symbols), 'action': random.choice(['BUY', 'SELL']),
+                     'volume': 0.01}
+            started = time.perf_counter()
+            _, _, payload = self._timed(client, 'trade', 'POST', '/api/trade', trade)
+            if payload and payload.get('trade'):
+                with self._lock:
+                    self.trade_started[payload['trade']['id']] = started
+        client.close()
+
+    def ea_poller(self):
+        """Boucle de l'EA: poll des trades en attente (ETag/long-poll) puis confirmation"""
+        client = HttpClient(self.args.url, timeout=self.args.poll_wait + 10)
+        etag = None
+        consumer = f'bench-{threading.get_ident()}'
+        path = f'/api/pending_trades?consumer={consumer}'
+        if self.args.poll_wait:
+            path += f'&wait={self.args.poll_wait}'
+        while not self._stop.is_set():
+            headers = {'If-None-Match': etag} if etag else {}
+            status, response_headers, payload = self._timed(client, 'pending_trades', 'GET', path,
+                                                            headers=headers, expected=(200, 304))
+            if response_headers is not None:
+                etag = response_headers.get('ETag', etag)
+            for trade in (payload or {}).get('trades', []) if status == 200 else []:
+                self._timed(client, 'confirm_trade', 'POST', f"/api/confirm_trade/{trade['id']}?consumer={consumer}",
+                            {'status': 'executed', 'ticket': trade['id']})
+                with self._lock:
+                    started = self.trade_started.pop(trade['id'], None)
+                if started is not None:
+                    self.recorder.add('trade_round_trip', (time.perf_counter() - started) * 1000)
+            if not self.args.poll_wait:
+                self._stop.wait(self.args.poll_interval)
+        client.close()
+
+    def subscriber(self, ready):
+        """Client Socket.IO du dashboard: latence de diffusion des signaux"""
+        import socketio
+
+        sio = socketio.Client(reconnection=False)
+
+        def on_signal(signal):
+            sent = datetime.fromisoformat(signal['timestamp'])
+            self.recorder.add('socketio_delivery', (datetime.now() - sent).total_seconds() * 1000)
+            with self._lock:
+                self.received_events += 1
+
+        sio.on('new_signal', on_signal)
+        sio.on('new_signals', lambda data: [on_signal(s) for s in data['signals']])
+        sio.on('connect', lambda: sio.emit('subscribe', {'symbol': 'ALL'}))
+        try:
+            sio.connect(self.args.url, transports=['websocket'], wait_timeout=10)
+        except Exception:
+            self.recorder.error('socketio_connect')
+            ready.release()
+            return
+        ready.release()
+        self._stop.wait()
+        time.sleep(self.args.drain)
+        sio.disconnect()
+
+    def run(self):
+        """Lance tous les acteurs pendant la durée demandée et retourne le rapport"""
+        args = self.args
+        threads = []
+
+        ready = threading.Semaphore(0)
+        for _ in range(args.subscribers):
+            threads.append(threading.Thread(target=self.subscriber, args=(ready,), daemon=True))
+            threads[-1].start()
+        for _ in range(args.subscribers):
+            ready.acquire()
+
+        start = time.monotonic()
+        deadline = start + args.duration
+        signal_pacer = Pacer(args.rate / args.batch if args.rate else 0, deadline)
+        trade_pacer = Pacer(args.trade_rate, deadline)
+        workers = [threading.Thread(target=self.signal_worker, args=(signal_pacer,), daemon=True)
+                   for _ in range(args.concurrency)]
+        if args.trade_rate > 0:
+            workers.append(threading.Thread(target=self.trade_worker, args=(trade_pacer,), daemon=True))
+        workers += [threading.Thread(target=self.ea_poller, daemon=True) for _ in range(args.pollers)]
+        for worker in workers:
+            worker.start()
+
+        time.sleep(args.duration)
+        self._stop.set()
+        elapsed = time.monotonic() - start
+        for worker in workers + threads:
+            worker.join(timeout=args.poll_wait + args.drain + 15)
+
+        expected = self.sent_signals * args.subscribers
+        return {
+            'config': {k: v for k, v in vars(args).items() if k not in ('json', 'baseline')},
+            'started_at': datetime.now().isoformat(),
+            'duration_s': round(elapsed, 2),
+            'signals_sent': self.sent_signals,
+            'signals_per_s': round(self.sent_signals / args.duration, 1),
+            'socketio_delivery_ratio': round(self.received_events / expected, 4) if expected else None,
+            'trades_unconfirmed': len(self.trade_started),
+            'operations': self.recorder.summary(args.duration),
+        }
+
+
+def spawn_server(url, mode='dev'):
+    """Démarre app.py (dev) ou server.py (eventlet/gevent) dans un répertoire temporaire (base vierge)"""
+    workdir = tempfile.mkdtemp(prefix='crystal_bench_')
+    root = os.path.dirname(os.path.abspath(__file__))
+    if mode == 'dev':
+        command = [sys.executable, os.path.join(root, 'app.py')]
+    else:
+        command = [sys.executable, os.path.join(root, 'server.py'), '--async-mode', mode,
+                   '--port', str(urlsplit(url).port or 5000)]
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT,
+                               start_new_session=(os.name != 'nt'))
+    process.workdir, process.log = workdir, log
+    client = HttpClient(url, timeout=1)
+    for _ in range(100):
+        try:
+            if client.request('GET', '/api/test')[0] == 200:
+                print(f"Serveur démarré (pid {process.pid}, logs: {log.name})")
+                return process
+        except OSError:
+            time.sleep(0.2)
+    log.flush()
+    with open(log.name) as f:
+        output = f.read()[-2000:]
+    stop_server(process)
+    raise RuntimeError(f"Le serveur n'a pas démarré:\n{output}")
+
+
+def stop_server(process):
+    """Arrête le serveur lancé par spawn_server (et le reloader de Flask), puis supprime sa base temporaire"""
+    try:
+        if os.name != 'nt':
+            import signal
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.terminate()
+        process.wait(timeout=10)
+    finally:
+        process.log.close()
+        shutil.rmtree(process.workdir, ignore_errors=True)
+
+
+def print_report(report, baseline=None):
+    """Tableau lisible du rapport (+ écart avec un run précédent)"""
+    print()
+    print(f"Durée {report['duration_s']} s - {report['signals_sent']} signaux ({report['signals_per_s']}/s)")
+    if report['socketio_delivery_ratio'] is not None:
+        print(f"Socket.IO: {report['socketio_delivery_ratio'] * 100:.1f}% des diffusions reçues")
+    print()
+    print(f"{'Opération':<20}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'erreurs':>9}")
+    for operation, stats in report['operations'].items():
+        print(f"{operation:<20}{stats['throughput']:>9}{stats['p50_ms']:>9}{stats['p95_ms']:>9}"
+              f"{stats['p99_ms']:>9}{stats['max_ms']:>9}{stats['error_rate']:>8}%")
+        previous = (baseline or {}).get('operations', {}).get(operation)
+        if previous:
+            print(f"{'  vs baseline':<20}{stats['throughput'] - previous['throughput']:>+9.1f}"
+                  f"{stats['p50_ms'] - previous['p50_ms']:>+9.2f}{stats['p95_ms'] - previous['p95_ms']:>+9.2f}"
+                  f"{stats['p99_ms'] - previous['p99_ms']:>+9.2f}")
+
+
+def run_benchmark(argv):
+    """Benchmark de charge en local: python test_signals.py --bench [options]"""
+    parser = argparse.ArgumentParser(prog='test_signals.py --bench', description=run_benchmark.__doc__)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--spawn', action='store_true', help='démarrer le serveur sur une base temporaire')
+    parser.add_argument('--server', choices=['dev', 'eventlet', 'gevent'], default='dev',
+                        help='avec --spawn: app.py (dev) ou server.py (production)')
+    parser.add_argument('--duration', type=float, default=10, help='durée en secondes')
+    parser.add_argument('--symbols', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=0, help='signaux/s au total (0 = maximum)')
+    parser.add_argument('--concurrency', type=int, default=8, help='workers qui envoient les signaux')
+    parser.add_argument('--batch', type=int, default=1, help='signaux par requête (>1: /api/signals/batch)')
+    parser.add_argument('--trade-rate', type=float, default=2, help='commandes /api/trade par seconde')
+    parser.add_argument('--pollers', type=int, default=1, help='EA simulés qui pollent /api/pending_trades')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--poll-wait', type=float, default=0, help='long-poll ?wait=N')
+    parser.add_argument('--subscribers', type=int, default=2, help='clients Socket.IO')
+    parser.add_argument('--drain', type=float, default=2.0, help='attente des dernières diffusions (s)')
+    parser.add_argument('--json', help='écrire le rapport JSON dans ce fichier')
+    parser.add_argument('--baseline', help='rapport JSON précédent à comparer')
+    args = parser.parse_args(argv)
+
+    server = spawn_server(args.url, args.server) if args.spawn else None
+    try:
+        report = LoadGenerator(args).run()
+    finally:
+        if server is not None:
+            stop_server(server)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nRapport écrit dans {args.json}")
+    return report
+
+
 if __name__ == "__main__":
     import sys
     
     if len(sys.argv) > 1 and sys.argv[1] == "--single":
         send_single_signal()
+    elif len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        run_benchmark(sys.argv[2:])
     else:
         test_sequence()
@@ -0,0 +1,31 @@
+"""
+Fixtures communes: base SQLite en mémoire migrée, écritures exécutées comme par l'écrivain
+"""
+
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def write(conn):
+    """write(fn) -> résultat de fn(cursor), validé comme un lot de l'écrivain"""
+    def run(fn):
+        result = fn(conn.cursor())
+        conn.commit()
+        return result
+    return run
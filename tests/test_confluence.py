@@ -0,0 +1,118 @@
+"""
+Confluence: le chemin vectorisé (historique, backtest) doit reproduire le chemin scalaire (signaux live)
+"""
+
+import random
+import sqlite3
+
+import numpy as np
+import pytest
+
+from confluence import (FIELD_DEFAULTS, FIELDS, FINAL_SIGNALS, INDICATORS,
+                        columns_from_signals, compute_confluence, score_batch, score_signals)
+from migrations import migrate
+from schema import SIGNAL_SCHEMA, validate
+from signal_store import INSERT_SQL, decode_row, encode_signal
+
+ENUM_VALUES = ('BULLISH', 'BEARISH', 'NEUTRAL', 'NONE', 'DETECTED', '')
+
+
+def random_row(rng):
+    """Ligne stockée: directions parfois NULL, niveaux parfois absents (0 ou NULL)"""
+    bid = round(rng.uniform(1.0, 2.0), 5)
+    row = {'bid': bid, 'momentum_shift': rng.choice((0, 1))}
+    for field in FIELDS:
+        if field == 'trend':
+            row[field] = rng.choice(('BULLISH', 'BEARISH', 'NEUTRAL', None))    # choice() de SIGNAL_SCHEMA
+        elif field in FIELD_DEFAULTS:
+            row[field] = rng.choice(ENUM_VALUES + (None,))
+        elif field not in row:
+            row[field] = rng.choice((0, None, round(bid + rng.uniform(-0.1, 0.1), 5)))
+    return row
+
+
+def scalar_signal(row):
+    """Signal tel que construit par parse_signal: valeurs par défaut à la place des champs absents"""
+    signal = {}
+    for field in FIELDS:
+        value = row.get(field)
+        if field in FIELD_DEFAULTS:
+            signal[field] = FIELD_DEFAULTS[field] if value is None else value
+        else:
+            signal[field] = value or 0
+    return signal
+
+
+def assert_same_scores(rows):
+    batch = score_batch(columns_from_signals(rows))
+    for i, row in enumerate(rows):
+        expected = compute_confluence(scalar_signal(row))
+        assert batch['total_indicators'][i] == expected['total_indicators']
+        assert batch['bullish_count'][i] == expected['bullish_count']
+        assert batch['bearish_count'][i] == expected['bearish_count']
+        assert round(batch['bullish_score'][i], 1) == expected['bullish_score']
+        assert round(batch['bearish_score'][i], 1) == expected['bearish_score']
+        assert FINAL_SIGNALS[batch['final_code'][i]] == expected['final_signal']
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_vectorised_matches_scalar(seed):
+    rng = random.Random(seed)
+    assert_same_scores([random_row(rng) for _ in range(2000)])
+
+
+def test_missing_fields_use_defaults():
+    # Lignes antérieures aux colonnes d'indicateurs (mtf_trend inclus): seuls les champs de base existent
+    rng = random.Random(42)
+    rows = [{'bid': r['bid'], 'trend': r['trend'], 'momentum_shift': r['momentum_shift']}
+            for r in (random_row(rng) for _ in range(500))]
+    assert_same_scores(rows)
+
+
+def test_mtf_alignment_is_optional():
+    assert any(ind['name'] == 'MTF Alignment' and ind['fields'] == ('mtf_trend',) for ind in INDICATORS)
+    base = {'bid': 1.5, 'trend': 'BULLISH', 'supertrend_direction': 'BULLISH', 'harmonic_pattern': 'NONE'}
+    rows = [dict(base, mtf_trend=value) for value in ('BULLISH', 'BEARISH', 'NEUTRAL', None)]
+    batch = score_batch(columns_from_signals(rows))
+    # Compté seulement quand il est directionnel
+    assert batch['total_indicators'].tolist() == [4, 4, 3, 3]
+    assert batch['bullish_count'].tolist() == [3, 2, 2, 2]
+    assert batch['bearish_count'].tolist() == [0, 1, 0, 0]
+    assert_same_scores(rows)
+
+
+def test_stored_rows_round_trip():
+    # Directions codées en entiers (NULL = inconnue): le re-score de la base égale la confluence live
+    rng = random.Random(7)
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    signals = []
+    for _ in range(300):
+        # Champ NULL = non envoyé par l'EA: valeur par défaut de SIGNAL_SCHEMA
+        data = {f: v for f, v in random_row(rng).items() if v is not None}
+        signal = validate(dict(data, symbol='EURUSD'), SIGNAL_SCHEMA)
+        signal['confluence'] = compute_confluence(signal)
+        signals.append(signal)
+    conn.executemany(INSERT_SQL, [encode_signal(s) for s in signals])
+    conn.row_factory = sqlite3.Row
+    rows = [decode_row(row) for row in conn.execute('SELECT * FROM signals ORDER BY id')]
+    conn.close()
+
+    assert score_signals(rows) == [s['confluence']['final_signal'] for s in signals]
+    assert [row['confluence']['final_signal'] for row in rows] == score_signals(rows)
+
+
+def test_custom_weights_and_thresholds():
+    rng = random.Random(3)
+    rows = [random_row(rng) for _ in range(500)]
+    columns = columns_from_signals(rows)
+    default = score_batch(columns)
+    reweighted = score_batch(columns, weights={'Momentum Shift': 0.5})
+    np.testing.assert_array_equal(default['final_code'], reweighted['final_code'])
+    # Seuils abaissés: au moins autant de signaux directionnels
+    relaxed = score_batch(columns, strong_threshold=60, threshold=40)
+    assert np.count_nonzero(relaxed['final_code']) >= np.count_nonzero(default['final_code'])
+
+
+def test_empty_history():
+    assert score_signals([]) == []
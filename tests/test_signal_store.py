@@ -0,0 +1,115 @@
+"""
+Ingestion des signaux: une ligne par bougie mise à jour sur place, une révision par transition,
+réponses rejouées par clé d'idempotence
+"""
+
+import threading
+
+import pytest
+
+import database
+import signal_store
+from confluence import compute_confluence
+from idempotency import RequestInFlight, ResponseCache
+from schema import SIGNAL_SCHEMA, validate
+from signal_store import bar_revisions, save_signals
+
+
+@pytest.fixture(autouse=True)
+def fresh_revisions():
+    bar_revisions.clear()
+    yield
+    bar_revisions.clear()
+
+
+def signal(bar_time=1700000000, trend='BULLISH', bid=1.1, **fields):
+    parsed = validate(dict(fields, symbol='EURUSD', timeframe='M15', bar_time=bar_time, trend=trend, bid=bid,
+                           supertrend_direction=trend, mtf_trend=trend), SIGNAL_SCHEMA)
+    parsed['confluence'] = compute_confluence(parsed)
+    return parsed
+
+
+def rows(conn):
+    return conn.execute('SELECT bar_time, revision, updates, bid FROM signals ORDER BY id').fetchall()
+
+
+def test_same_bar_updated_in_place(conn, write):
+    write(lambda c: save_signals(c, [signal(bid=1.1)]))
+    write(lambda c: save_signals(c, [signal(bid=1.2), signal(bid=1.3)]))
+    assert rows(conn) == [(1700000000, 0, 3, 1.3)]
+
+
+def test_transition_adds_revision(conn, write):
+    write(lambda c: save_signals(c, [signal(), signal(trend='BEARISH', bid=1.0), signal(trend='BEARISH', bid=0.9)]))
+    assert rows(conn) == [(1700000000, 0, 1, 1.1), (1700000000, 1, 2, 0.9)]
+
+    # Nouvelle bougie: révision 0
+    write(lambda c: save_signals(c, [signal(bar_time=1700000900)]))
+    assert rows(conn)[-1] == (1700000900, 0, 1, 1.1)
+
+
+def test_revision_resumed_from_database(conn, write):
+    # Redémarrage (cache vide): la révision courante est relue en base
+    write(lambda c: save_signals(c, [signal(), signal(trend='BEARISH')]))
+    bar_revisions.clear()
+    write(lambda c: save_signals(c, [signal(trend='BEARISH', bid=1.5)]))
+    assert rows(conn) == [(1700000000, 0, 1, 1.1), (1700000000, 1, 2, 1.5)]
+
+
+def test_without_bar_time_or_in_append_mode(conn, write, monkeypatch):
+    # Anciens EA (pas d'heure de bougie): une ligne par envoi
+    write(lambda c: save_signals(c, [signal(bar_time=0), signal(bar_time=0)]))
+    assert len(rows(conn)) == 2
+    monkeypatch.setattr(signal_store, 'SIGNAL_INGEST_MODE', 'append')
+    write(lambda c: save_signals(c, [signal(), signal()]))
+    assert len(rows(conn)) == 4
+
+
+def test_rolled_back_write_clears_revision_cache(conn, write):
+    write(lambda c: save_signals(c, [signal()]))
+
+    def failing(c):
+        save_signals(c, [signal(trend='BEARISH')])
+        raise RuntimeError('lot annulé')
+    with pytest.raises(RuntimeError):
+        write(failing)
+    conn.rollback()
+    database._rolled_back()     # hooks on_rollback appelés par l'écrivain
+
+    # Transition annulée: la ligne en base reste la révision courante
+    write(lambda c: save_signals(c, [signal(bid=1.4)]))
+    assert rows(conn) == [(1700000000, 0, 2, 1.4)]
+
+
+def test_response_replayed_for_known_key():
+    cache = ResponseCache(ttl=10)
+    assert cache.begin('k') is None
+    cache.put('k', {'status': 'success'}, 200, now=0)
+    assert cache.get('k', now=5) == ({'status': 'success'}, 200)
+    assert cache.get('k', now=10) is None       # expirée
+    assert cache.begin(None) is None
+
+
+def test_released_key_is_processed_again():
+    cache = ResponseCache()
+    assert cache.begin('k') is None
+    cache.release('k')
+    assert cache.begin('k') is None
+
+
+def test_concurrent_duplicate_waits_for_original():
+    cache = ResponseCache(wait=5)
+    assert cache.begin('k') is None
+    replies = []
+    duplicate = threading.Thread(target=lambda: replies.append(cache.begin('k')))
+    duplicate.start()
+    cache.put('k', {'status': 'success'}, 200)
+    duplicate.join(5)
+    assert replies == [({'status': 'success'}, 200)]
+
+
+def test_duplicate_times_out_while_in_flight():
+    cache = ResponseCache(wait=0.05)
+    assert cache.begin('k') is None
+    with pytest.raises(RequestInFlight):
+        cache.begin('k')
@@ -0,0 +1,117 @@
+"""
+File des trades: réservation avec bail par consommateur, confirmation, expiration et idempotence
+"""
+
+import pytest
+
+import trade_queue
+from trade_queue import TradeQueueNotifier, cancel, claim, complete, enqueue, has_claimable
+
+
+def order(symbol='EURUSD', action='BUY', consumer=None):
+    return {'timestamp': '2024-01-01 00:00:00', 'symbol': symbol, 'action': action, 'volume': 0.1,
+            'price': 0.0, 'sl': 0.0, 'tp': 0.0, 'status': 'pending', 'consumer': consumer}
+
+
+def status(conn, trade_id):
+    return conn.execute('SELECT status FROM trades WHERE id = ?', (trade_id,)).fetchone()[0]
+
+
+def test_claim_leases_each_order_once(conn, write):
+    first, _ = write(enqueue(order()))
+    second, _ = write(enqueue(order('GBPUSD')))
+
+    claimed, expired = write(claim('ea-1', now=100, lease=30))
+    assert [t['id'] for t in claimed] == [first['id'], second['id']]
+    assert all(t['lease_owner'] == 'ea-1' and t['lease_expires'] == 130 for t in claimed)
+    assert expired == []
+
+    # Bail en cours: rien pour un autre EA ni pour un nouveau poll
+    assert write(claim('ea-2', now=110, lease=30)) == ([], [])
+    assert write(claim('ea-1', now=110, lease=30)) == ([], [])
+    assert not has_claimable(conn, 'ea-2', 110)
+
+
+def test_orders_routed_to_their_consumer(conn, write):
+    mine, _ = write(enqueue(order(consumer='ea-1')))
+    broadcast, _ = write(enqueue(order('GBPUSD')))     # consumer NULL: premier EA qui interroge
+
+    claimed, _ = write(claim('ea-2', now=100))
+    assert [t['id'] for t in claimed] == [broadcast['id']]
+    claimed, _ = write(claim('ea-1', now=100))
+    assert [t['id'] for t in claimed] == [mine['id']]
+
+
+def test_expired_lease_is_redelivered_then_expired(conn, write, monkeypatch):
+    monkeypatch.setattr(trade_queue, 'MAX_DELIVERIES', 2)
+    trade, _ = write(enqueue(order()))
+
+    write(claim('ea-1', now=100, lease=10))
+    assert has_claimable(conn, 'ea-2', 110)
+    claimed, _ = write(claim('ea-2', now=110, lease=10))
+    assert claimed[0]['attempts'] == 2 and claimed[0]['lease_owner'] == 'ea-2'
+
+    # MAX_DELIVERIES atteint: plus redistribuée
+    claimed, expired = write(claim('ea-1', now=120, lease=10))
+    assert claimed == [] and expired == [trade['id']]
+    assert status(conn, trade['id']) == 'expired'
+
+
+def test_confirm_by_lease_owner(conn, write):
+    trade, _ = write(enqueue(order()))
+    write(claim('ea-1', now=100, lease=30))
+
+    assert write(complete(trade['id'], 'ea-2', 'executed', 1, now=110)) == ('EURUSD', 'réservée par ea-1')
+    assert write(complete(trade['id'], 'ea-1', 'executed', 42, now=110)) == ('EURUSD', None)
+    assert conn.execute('SELECT status, ticket FROM trades WHERE id = ?', (trade['id'],)).fetchone() == ('executed', 42)
+
+    # Confirmation répétée (réponse perdue): acceptée; autre statut: conflit
+    assert write(complete(trade['id'], 'ea-1', 'executed', 42, now=111)) == ('EURUSD', None)
+    assert write(complete(trade['id'], 'ea-1', 'failed', 0, now=111)) == ('EURUSD', 'déjà terminée (executed)')
+    assert write(complete(9999, 'ea-1', 'executed', 0, now=111)) == (None, 'commande inconnue')
+
+
+def test_confirm_after_lease_expiry_without_new_claim(conn, write):
+    trade, _ = write(enqueue(order()))
+    write(claim('ea-1', now=100, lease=10))
+    assert write(complete(trade['id'], 'ea-1', 'failed', 0, now=200)) == ('EURUSD', None)
+    assert status(conn, trade['id']) == 'failed'
+
+
+def test_confirm_rejects_unknown_status():
+    with pytest.raises(ValueError):
+        complete(1, 'ea-1', 'pending', 0, now=0)
+
+
+def test_cancel_releases_lease(conn, write):
+    leased, _ = write(enqueue(order()))
+    pending, _ = write(enqueue(order('GBPUSD')))
+    write(claim('ea-1', now=100, limit=1))
+
+    assert write(cancel(leased['id'])) == 1
+    assert write(cancel()) == 1
+    assert {status(conn, leased['id']), status(conn, pending['id'])} == {'cancelled'}
+    assert write(complete(leased['id'], 'ea-1', 'executed', 1, now=110)) == ('EURUSD', 'déjà terminée (cancelled)')
+
+
+def test_idempotency_key_returns_existing_order(conn, write):
+    trade, duplicate = write(enqueue(order(), 'key-1'))
+    assert not duplicate
+    again, duplicate = write(enqueue(order('GBPUSD'), 'key-1'))
+    assert duplicate and again['id'] == trade['id'] and again['symbol'] == 'EURUSD'
+    assert conn.execute('SELECT COUNT(*) FROM trades').fetchone()[0] == 1
+
+
+def test_notifier_versions_and_consumers():
+    notifier = TradeQueueNotifier()
+    etag = notifier.etag()
+    notifier.notify()
+    assert notifier.etag() != etag
+
+    notifier.lease(100)
+    assert notifier.check_expired(now=99) == 1
+    assert notifier.check_expired(now=100) == 2
+
+    notifier.seen('ea-1', now=0)
+    notifier.seen('ea-2', now=trade_queue.CONSUMER_TTL)
+    assert notifier.active_consumers(now=trade_queue.CONSUMER_TTL) == ['ea-2']
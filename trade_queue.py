@@ -0,0 +1,192 @@
+"""
+Crystal Heikin Ashi - File des commandes de trade
+Réservation atomique avec bail (lease) par consommateur, clés d'idempotence,
+notification des changements (long-poll) et ETag des trades en attente
+"""
+
+import heapq
+import os
+import threading
+import time
+
+# Attente maximale d'un long-poll (secondes)
+MAX_WAIT = 30
+
+# Durée du bail d'une commande réservée: redistribuée seulement après expiration sans confirmation
+LEASE_SECONDS = float(os.environ.get('TRADE_LEASE_SECONDS', 30))
+
+# Distributions maximales d'une commande (au-delà: status 'expired')
+MAX_DELIVERIES = int(os.environ.get('TRADE_MAX_DELIVERIES', 3))
+
+# Consommateur des EA qui ne s'identifient pas (?consumer=)
+DEFAULT_CONSUMER = 'default'
+
+# Un EA est actif s'il a interrogé la file depuis moins de CONSUMER_TTL secondes
+CONSUMER_TTL = float(os.environ.get('TRADE_CONSUMER_TTL', 60))
+
+# Statuts de la file (idx_trades_status_created: seules ces lignes sont lues); les autres sont terminaux
+ACTIVE = "status IN ('pending', 'leased')"
+
+# Statuts terminaux qu'un EA peut confirmer (TRADE_CONFIRM_SCHEMA)
+CONFIRM_STATUSES = ('executed', 'failed', 'error')
+
+
+class TradeQueueNotifier:
+    """Compteur de version de la file, incrémenté à chaque changement des trades en attente"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._boot = os.urandom(4).hex()
+        self.version = 0
+        self._expiries = []     # tas des fins de bail (epoch)
+        self._seen = {}         # consommateur -> dernier poll (monotonic)
+
+    def etag(self, version=None):
+        """ETag de la file pour une version (invalide après redémarrage du serveur)"""
+        return f'"{self._boot}-{self.version if version is None else version}"'
+
+    def notify(self):
+        """Signale un changement et réveille les long-polls en attente"""
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+
+    def seen(self, consumer, now=None):
+        """Enregistre le poll d'un EA"""
+        now = time.monotonic() if now is None else now
+        with self._condition:
+            self._seen[consumer] = now
+
+    def active_consumers(self, now=None):
+        """EA ayant interrogé la file depuis moins de CONSUMER_TTL secondes"""
+        now = time.monotonic() if now is None else now
+        with self._condition:
+            for consumer in [c for c, t in self._seen.items() if now - t >= CONSUMER_TTL]:
+                del self._seen[consumer]
+            return sorted(self._seen)
+
+    def lease(self, expires):
+        """Enregistre une fin de bail: la file changera (redistribution) à cet instant"""
+        with self._condition:
+            heapq.heappush(self._expiries, expires)
+
+    def check_expired(self, now=None):
+        """Nouvelle version si un bail a expiré (les ETag et long-polls en cours deviennent obsolètes)"""
+        now = time.time() if now is None else now
+        with self._condition:
+            if self._expiries and self._expiries[0] <= now:
+                while self._expiries and self._expiries[0] <= now:
+                    heapq.heappop(self._expiries)
+                self.version += 1
+                self._condition.notify_all()
+            return self.version
+
+    def wait(self, version, timeout):
+        """Attend que la version dépasse `version` ou le timeout; retourne la version courante"""
+        deadline = time.monotonic() + min(timeout, MAX_WAIT)
+        with self._condition:
+            while self.version == version:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if self._expiries:
+                    remaining = min(remaining, max(0.0, self._expiries[0] - time.time()))
+                self._condition.wait(remaining)
+                self.check_expired()
+            return self.version
+
+
+# ============================================
+# FILE SQLITE (fonctions d'écriture pour db_write)
+# ============================================
+
+def has_claimable(conn, consumer, now):
+    """Lecture seule: une commande est-elle réservable? (évite une écriture par poll quand la file est vide)"""
+    row = conn.execute(f'''
+        SELECT 1 FROM trades WHERE {ACTIVE} AND lease_expires <= ? AND (consumer IS NULL OR consumer = ?)
+        LIMIT 1
+    ''', (now, consumer)).fetchone()
+    return row is not None
+
+
+def claim(consumer, now, limit=50, lease=None):
+    """
+    Réserve atomiquement les commandes disponibles pour `consumer` (en attente ou bail expiré).
+    Lecture par l'index (status, created_at) limitée aux commandes actives: coût indépendant de l'historique.
+    Retourne (commandes réservées, ids expirés après MAX_DELIVERIES distributions)
+    """
+    expires = now + (LEASE_SECONDS if lease is None else lease)
+
+    def write(c):
+        expired = [row[0] for row in c.execute(f'''
+            SELECT id FROM trades WHERE {ACTIVE} AND lease_expires > 0 AND lease_expires <= ? AND attempts >= ?
+        ''', (now, MAX_DELIVERIES))]
+        if expired:
+            c.executemany("UPDATE trades SET status = 'expired' WHERE id = ?", [(i,) for i in expired])
+        ids = [row[0] for row in c.execute(f'''
+            SELECT id FROM trades WHERE {ACTIVE} AND lease_expires <= ? AND (consumer IS NULL OR consumer = ?)
+            ORDER BY id LIMIT ?
+        ''', (now, consumer, limit))]
+        if not ids:
+            return [], expired
+        c.executemany('''
+            UPDATE trades SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+            WHERE id = ?
+        ''', [(consumer, expires, i) for i in ids])
+        rows = c.execute(f"SELECT * FROM trades WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id", ids)
+        return [dict(zip([d[0] for d in c.description], row)) for row in rows], expired
+    return write
+
+
+def enqueue(trade, idempotency_key=None):
+    """Insère une commande; avec une clé déjà connue, retourne la commande existante (doublon)"""
+    def write(c):
+        if idempotency_key is not None:
+            row = c.execute('SELECT * FROM trades WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+            if row is not None:
+                return dict(zip([d[0] for d in c.description], row)), True
+        c.execute('''
+            INSERT INTO trades (timestamp, symbol, action, volume, price, sl, tp, status, consumer, idempotency_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (trade['timestamp'], trade['symbol'], trade['action'], trade['volume'], trade['price'],
+              trade['sl'], trade['tp'], trade['status'], trade.get('consumer'), idempotency_key))
+        return dict(trade, id=c.lastrowid, idempotency_key=idempotency_key), False
+    return write
+
+
+def complete(trade_id, consumer, status, ticket, now):
+    """
+    Confirmation d'une commande par son consommateur (bail détenu, ou expiré sans autre réservation).
+    Retourne (symbole, conflit): conflit = message si la commande est réservée par un autre ou déjà terminée
+    """
+    if status not in CONFIRM_STATUSES:
+        raise ValueError(f'statut de confirmation invalide: {status}')
+
+    def write(c):
+        updated = c.execute(f'''
+            UPDATE trades SET status = ?, ticket = ?, lease_owner = ?
+            WHERE id = ? AND {ACTIVE} AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires <= ?)
+        ''', (status, ticket, consumer, trade_id, consumer, now)).rowcount
+        row = c.execute('SELECT symbol, status, lease_owner FROM trades WHERE id = ?', (trade_id,)).fetchone()
+        if row is None:
+            return None, 'commande inconnue'
+        if updated or row[1] == status and row[2] == consumer:
+            return row[0], None     # confirmation (ou confirmation répétée) du consommateur
+        if row[1] == 'leased':
+            return row[0], f'réservée par {row[2]}'
+        return row[0], f'déjà terminée ({row[1]})'
+    return write
+
+
+def cancel(trade_id=None):
+    """Annule une commande active (toutes si trade_id est None), réservée ou non: le bail est libéré"""
+    def write(c):
+        query = f"UPDATE trades SET status = 'cancelled', lease_owner = NULL, lease_expires = 0 WHERE {ACTIVE}"
+        if trade_id is None:
+            return c.execute(query).rowcount
+        return c.execute(query + ' AND id = ?', (trade_id,)).rowcount
+    return write
+
+
+# Notificateur unique du processus
+trade_notifier = TradeQueueNotifier()